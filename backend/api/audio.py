@@ -4,70 +4,160 @@ Audio generation API endpoints
 
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 import logging
-import httpx
+from metrics import TimedRoute
+from gemini_client import API_KEY, call_api, stream_api, model_url, stream_url, TTS_TIMEOUT
+from audio_processing import (
+    AUDIO_FORMATS, DEFAULT_SAMPLE_RATE, concatenate_wavs, encode_pcm_stream, sample_rate_from_mime,
+    supported_audio_formats, wav_chunks, wav_header
+)
+from rate_limiter import upstream_scheduler, TTS_CONCURRENCY, TTS_RPM
+from single_flight import single_flight, request_key
+from blob_store import blob_store, blob_url
+from narration_cache import narration_cache, narration_key
+from job_queue import job_queue
+import asyncio
 import base64
-import io
 import os
 
-router = APIRouter(prefix="/api", tags=["audio"])
+router = APIRouter(prefix="/api", tags=["audio"], route_class=TimedRoute)
 logger = logging.getLogger(__name__)
 
 # API Configuration
-API_KEY = os.getenv("GEMINI_API_KEY", "")
-TTS_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-tts:generateContent?key={API_KEY}"
+TTS_API_URL = model_url("gemini-2.5-flash-preview-tts")
+TTS_STREAM_URL = stream_url("gemini-2.5-flash-preview-tts")
+
+# Upstream budget; calls beyond it queue instead of tripping Gemini's rate limits
+upstream_scheduler.register(TTS_API_URL, TTS_CONCURRENCY, TTS_RPM)
+
+# Panels synthesised at once by the batch narration endpoint
+NARRATION_CONCURRENCY = int(os.getenv("NARRATION_CONCURRENCY", "4"))
+NARRATION_MAX_PANELS = int(os.getenv("NARRATION_MAX_PANELS", "200"))
 
 # Pydantic Models
 class AudioGenerationRequest(BaseModel):
     text: str
+    voice: Optional[str] = None  # Prebuilt Gemini voice name, e.g. "Kore"
+
+class AudioStreamRequest(BaseModel):
+    text: str
+    voice: Optional[str] = None
+    format: str = "wav"  # wav, opus or mp3
+
+class NarrationPanel(BaseModel):
+    text: str
+    id: Optional[Any] = None
+
+class NarrationRequest(BaseModel):
+    panels: List[NarrationPanel]
+    voice: Optional[str] = None
+    concatenate: bool = False
+    pauseSeconds: float = Field(0.5, ge=0, le=10)  # Silence between panels in the concatenated track
 
 # Helper Functions
-async def call_api(url: str, payload: dict) -> dict:
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            url,
-            headers={"Content-Type": "application/json"},
-            json=payload,
-            timeout=60.0
-        )
-        if not response.is_success:
-            error_detail = response.text
-            try:
-                error_json = response.json()
-                error_detail = error_json.get("error", {}).get("message", error_detail)
-            except:
-                pass
-            raise HTTPException(status_code=response.status_code, detail=error_detail)
-        return response.json()
-
-def pcm_to_wav(pcm_data: bytes, sample_rate: int = 24000) -> bytes:
-    """Convert PCM data to WAV format"""
-    import struct
-
-    # WAV header
-    num_channels = 1
-    bits_per_sample = 16
-    byte_rate = sample_rate * num_channels * bits_per_sample // 8
-    block_align = num_channels * bits_per_sample // 8
-    data_size = len(pcm_data)
-
-    header = struct.pack('<4sI4s4sIHHIIHH4sI',
-                        b'RIFF',
-                        36 + data_size,
-                        b'WAVE',
-                        b'fmt ',
-                        16,
-                        1,
-                        num_channels,
-                        sample_rate,
-                        byte_rate,
-                        block_align,
-                        bits_per_sample,
-                        b'data',
-                        data_size)
-
-    return header + pcm_data
+def tts_payload(text: str, voice: Optional[str] = None) -> dict:
+    payload = {
+        "contents": [{"parts": [{"text": text}]}],
+        "generationConfig": {"responseModalities": ["AUDIO"]},
+        "model": "gemini-2.5-flash-preview-tts"
+    }
+    if voice:
+        payload["generationConfig"]["speechConfig"] = {
+            "voiceConfig": {"prebuiltVoiceConfig": {"voiceName": voice}}
+        }
+    return payload
+
+def inline_audio(result: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """Base64 audio data and mime type of a (possibly streamed) TTS response"""
+    inline_data = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("inlineData", {})
+    return inline_data.get("data"), inline_data.get("mimeType")
+
+async def synthesize_pcm(request: AudioGenerationRequest) -> Tuple[bytes, int]:
+    """Synthesize narration, returning the raw PCM and its sample rate"""
+    try:
+        logger.info(f"Generating audio for text: {request.text[:50]}...")
+
+        result = await call_api(TTS_API_URL, tts_payload(request.text, request.voice), timeout=TTS_TIMEOUT)
+
+        audio_data, mime_type = inline_audio(result)
+        # Drop the decoded response so only the PCM is held past this point
+        del result
+
+        if not audio_data or not mime_type or not mime_type.startswith("audio/"):
+            raise HTTPException(status_code=500, detail="Invalid audio data received")
+
+        return base64.b64decode(audio_data), sample_rate_from_mime(mime_type)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Audio generation failed: {str(e)}")
+
+async def stream_pcm(text: str, voice: Optional[str] = None) -> Tuple[int, AsyncIterator[bytes]]:
+    """Start a streaming synthesis, returning the sample rate and the PCM chunks as they arrive.
+
+    The first chunk is awaited before returning so upstream failures still
+    surface as HTTP errors rather than a truncated response.
+    """
+    chunks = stream_api(TTS_STREAM_URL, tts_payload(text, voice), timeout=TTS_TIMEOUT)
+
+    # The stream holds a TTS budget slot and an upstream connection until it is closed
+    first_chunk, sample_rate = None, None
+    try:
+        async for chunk in chunks:
+            audio_data, mime_type = inline_audio(chunk)
+            if audio_data:
+                if not mime_type or not mime_type.startswith("audio/"):
+                    raise HTTPException(status_code=500, detail="Invalid audio data received")
+                first_chunk, sample_rate = base64.b64decode(audio_data), sample_rate_from_mime(mime_type)
+                break
+        if first_chunk is None:
+            raise HTTPException(status_code=500, detail="Invalid audio data received")
+    except BaseException:
+        await chunks.aclose()
+        raise
+
+    async def pcm_chunks() -> AsyncIterator[bytes]:
+        try:
+            yield first_chunk
+            async for chunk in chunks:
+                audio_data, _ = inline_audio(chunk)
+                if audio_data:
+                    yield base64.b64decode(audio_data)
+        finally:
+            # Release the slot as soon as the client goes away, not when the generator is collected
+            await chunks.aclose()
+
+    return sample_rate, pcm_chunks()
+
+async def narrate(text: str, voice: Optional[str]) -> Dict[str, Any]:
+    """Narration for one text, from the disk cache or synthesised and stored as a WAV blob"""
+    key = narration_key(text, voice, DEFAULT_SAMPLE_RATE)
+    entry = await narration_cache.aget(key)
+    if entry is not None:
+        return {**entry, "cached": True}
+
+    async def synthesize() -> Dict[str, Any]:
+        pcm_data, sample_rate = await synthesize_pcm(AudioGenerationRequest(text=text, voice=voice))
+        digest = await blob_store.aput(wav_header(sample_rate, len(pcm_data)) + pcm_data, "audio/wav")
+        entry = {
+            "digest": digest,
+            "sampleRate": sample_rate,
+            "duration": len(pcm_data) / (sample_rate * 2)
+        }
+        await narration_cache.aput(key, entry)
+        return entry
+
+    # Panels repeating the same line, or concurrent exports, synthesise it once
+    entry = await single_flight.do("narration", key, synthesize)
+    return {**entry, "cached": False}
+
+async def streamed_wav(sample_rate: int, pcm_chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    yield wav_header(sample_rate)
+    async for chunk in pcm_chunks:
+        yield chunk
 
 # API Endpoints
 @router.post("/generate-audio")
@@ -78,43 +168,141 @@ async def generate_audio(request: AudioGenerationRequest):
     if not request.text.strip():
         raise HTTPException(status_code=400, detail="Text is required for audio generation")
 
-    try:
-        logger.info(f"Generating audio for text: {request.text[:50]}...")
+    # Identical concurrent requests share one synthesis; each caller gets its own response stream
+    pcm_data, sample_rate = await single_flight.do(
+        "generate-audio", request_key(request), lambda: synthesize_pcm(request)
+    )
 
-        payload = {
-            "contents": [{"parts": [{"text": request.text}]}],
-            "generationConfig": {"responseModalities": ["AUDIO"]},
-            "model": "gemini-2.5-flash-preview-tts"
+    # Header and PCM are sent as separate chunks instead of being concatenated into a new buffer
+    return StreamingResponse(
+        wav_chunks(pcm_data, sample_rate),
+        media_type="audio/wav",
+        headers={
+            "Content-Disposition": "attachment; filename=audio.wav",
+            "Content-Length": str(len(wav_header(sample_rate)) + len(pcm_data))
         }
+    )
 
-        result = await call_api(TTS_API_URL, payload)
-
-        audio_data = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("inlineData", {}).get("data")
-        mime_type = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("inlineData", {}).get("mimeType")
+@router.post("/generate-audio/stream")
+async def generate_audio_stream(request: AudioStreamRequest):
+    """Stream narration as Gemini synthesizes it: WAV with an open-ended header, or Opus/MP3 via ffmpeg"""
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not configured")
 
-        if not audio_data or not mime_type or not mime_type.startswith("audio/"):
-            raise HTTPException(status_code=500, detail="Invalid audio data received")
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="Text is required for audio generation")
 
-        # Extract sample rate from mime type or use default
-        sample_rate = 24000
-        if "rate=" in mime_type:
-            try:
-                sample_rate = int(mime_type.split("rate=")[1].split(";")[0])
-            except:
-                pass
-
-        # Convert PCM to WAV
-        pcm_data = base64.b64decode(audio_data)
-        wav_data = pcm_to_wav(pcm_data, sample_rate)
-
-        # Return as streaming response
-        return StreamingResponse(
-            io.BytesIO(wav_data),
-            media_type="audio/wav",
-            headers={"Content-Disposition": "attachment; filename=audio.wav"}
+    if request.format not in AUDIO_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported audio format '{request.format}'. Supported: {', '.join(AUDIO_FORMATS)}"
         )
+    if request.format not in supported_audio_formats():
+        raise HTTPException(status_code=501, detail=f"Encoding to {request.format} requires ffmpeg on the server")
 
+    logger.info(f"Streaming {request.format} audio for text: {request.text[:50]}...")
+    try:
+        sample_rate, pcm_chunks = await stream_pcm(request.text, request.voice)
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Audio generation failed: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Audio generation failed: {str(e)}")
+
+    media_type, _ = AUDIO_FORMATS[request.format]
+    if request.format == "wav":
+        body = streamed_wav(sample_rate, pcm_chunks)
+    else:
+        body = encode_pcm_stream(pcm_chunks, request.format, sample_rate)
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=audio.{request.format}"}
+    )
+
+@router.post("/generate-narration")
+async def generate_narration(request: NarrationRequest):
+    """Synthesise narration for a list of panels concurrently, optionally joined into one track with timecodes"""
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not configured")
+
+    if not request.panels:
+        raise HTTPException(status_code=400, detail="At least one panel is required")
+    if len(request.panels) > NARRATION_MAX_PANELS:
+        raise HTTPException(status_code=413, detail=f"At most {NARRATION_MAX_PANELS} panels per request")
+
+    logger.info(f"Generating narration for {len(request.panels)} panels")
+    semaphore = asyncio.Semaphore(NARRATION_CONCURRENCY)
+
+    async def narrate_panel(panel: NarrationPanel) -> Optional[Dict[str, Any]]:
+        if not panel.text.strip():
+            return None
+        async with semaphore:
+            return await narrate(panel.text, request.voice)
+
+    try:
+        entries = await asyncio.gather(*(narrate_panel(panel) for panel in request.panels))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Narration generation failed: {str(e)}")
+
+    panels = [
+        {
+            "index": index,
+            "id": panel.id,
+            **({
+                "digest": entry["digest"],
+                "url": blob_url(entry["digest"]),
+                "duration": entry["duration"],
+                "cached": entry["cached"]
+            } if entry else {"digest": None, "url": None, "duration": 0.0, "cached": False})
+        }
+        for index, (panel, entry) in enumerate(zip(request.panels, entries))
+    ]
+    response = {
+        "panels": panels,
+        "cachedCount": sum(1 for entry in entries if entry and entry["cached"])
+    }
+
+    if request.concatenate:
+        voiced = [(index, entry) for index, entry in enumerate(entries) if entry]
+        if not voiced:
+            raise HTTPException(status_code=400, detail="No panel has narration text")
+        sample_rates = {entry["sampleRate"] for _, entry in voiced}
+        if len(sample_rates) > 1:
+            raise HTTPException(status_code=500, detail="Panel narration has mismatched sample rates")
+
+        tracks = [(await blob_store.aget(entry["digest"]))[0] for _, entry in voiced]
+        track, timecodes = await asyncio.to_thread(
+            concatenate_wavs, tracks, sample_rates.pop(), request.pauseSeconds
+        )
+        del tracks
+        digest = await blob_store.aput(track, "audio/wav")
+
+        response["track"] = {
+            "digest": digest,
+            "url": blob_url(digest),
+            "duration": timecodes[-1][1],
+            "timecodes": [
+                {"index": index, "id": request.panels[index].id, "start": round(start, 3), "end": round(end, 3)}
+                for (index, _), (start, end) in zip(voiced, timecodes)
+            ]
+        }
+
+    return response
+
+# Background job kinds (see api/jobs.py)
+async def audio_job(request: AudioGenerationRequest) -> Dict[str, Any]:
+    """Synthesise narration into the blob store; job results are JSON, so the WAV is returned by URL"""
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not configured")
+
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="Text is required for audio generation")
+
+    entry = await narrate(request.text, request.voice)
+    return {"digest": entry["digest"], "url": blob_url(entry["digest"]), "duration": entry["duration"]}
+
+job_queue.register("generate-audio", AudioGenerationRequest, audio_job)
+job_queue.register("generate-narration", NarrationRequest, generate_narration)
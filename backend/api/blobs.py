@@ -0,0 +1,94 @@
+"""
+Blob upload and retrieval API endpoints
+"""
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+from typing import Optional
+import logging
+from metrics import TimedRoute
+import os
+from blob_store import blob_store, blob_url, is_valid_digest
+from image_processing import DERIVATIVE_WIDTHS, make_derivatives, run_in_pool
+from request_limits import limit_body
+
+router = APIRouter(prefix="/api", tags=["blobs"], route_class=TimedRoute)
+logger = logging.getLogger(__name__)
+
+# Upload configuration
+BLOB_MAX_BYTES = int(os.getenv("BLOB_MAX_BYTES", str(20 * 1024 * 1024)))
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Stored blobs are served back from this origin, so they must never be run as a page
+BLOB_SECURITY_HEADERS = {"X-Content-Type-Options": "nosniff", "Content-Security-Policy": "default-src 'none'"}
+
+# Oversized uploads are refused from Content-Length before they are read
+limit_body(f"{router.prefix}/blobs", BLOB_MAX_BYTES)
+
+# Helper Functions
+def serve_blob(digest: str, variant: Optional[str], request: Request) -> Response:
+    """Serve a stored file with a stable ETag; content never changes for a digest so it is cached forever"""
+    etag = f'"{digest}-{variant}"' if variant else f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL, **BLOB_SECURITY_HEADERS}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    mime_type = blob_store.mime_type(digest, variant)
+    if not mime_type.startswith("image/"):
+        # Server-written audio and anything else downloads rather than rendering inline
+        headers["Content-Disposition"] = "attachment"
+    return FileResponse(blob_store.path(digest, variant), media_type=mime_type, headers=headers)
+
+async def ensure_derivatives(digest: str):
+    """Build missing thumbnail/preview derivatives of a stored image in one decode pass"""
+    data, mime_type = await blob_store.aget(digest)
+    if not mime_type.startswith("image/"):
+        raise HTTPException(status_code=404, detail="Blob has no image derivatives")
+
+    logger.info(f"Generating derivatives for blob {digest[:12]}")
+    try:
+        derivatives = await run_in_pool(make_derivatives, data)
+    except Exception as e:
+        raise HTTPException(status_code=415, detail=f"Could not decode image: {str(e)}")
+    await blob_store.aput_variants(digest, derivatives)
+
+# API Endpoints
+@router.post("/blobs")
+async def upload_blob(request: Request):
+    """Upload an image file and get back its digest and URL"""
+    data = await request.body()
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty upload")
+    if len(data) > BLOB_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Blob too large")
+
+    mime_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    # Only images are uploaded by clients; SVG is refused because it can carry script
+    if not mime_type.startswith("image/") or mime_type == "image/svg+xml":
+        raise HTTPException(status_code=415, detail=f"Unsupported upload type '{mime_type or 'none'}', expected an image")
+    digest = await blob_store.aput(data, mime_type)
+
+    return {"digest": digest, "url": blob_url(digest), "mimeType": mime_type, "size": len(data)}
+
+@router.get("/blobs/{digest}")
+async def get_blob(digest: str, request: Request):
+    """Serve a stored blob"""
+    if not is_valid_digest(digest) or not blob_store.exists(digest):
+        raise HTTPException(status_code=404, detail="Blob not found")
+
+    return serve_blob(digest, None, request)
+
+@router.get("/blobs/{digest}/{variant}")
+async def get_blob_variant(digest: str, variant: str, request: Request):
+    """Serve a derivative (thumb, preview or full) of a stored image, generating it on first request"""
+    if variant != "full" and variant not in DERIVATIVE_WIDTHS:
+        raise HTTPException(status_code=404, detail=f"Unknown variant '{variant}'")
+    if not is_valid_digest(digest) or not blob_store.exists(digest):
+        raise HTTPException(status_code=404, detail="Blob not found")
+
+    if variant == "full":
+        return serve_blob(digest, None, request)
+
+    if not blob_store.exists(digest, variant):
+        await ensure_derivatives(digest)
+
+    return serve_blob(digest, variant, request)
@@ -0,0 +1,183 @@
+"""
+Storyboard export API endpoints
+"""
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import asyncio
+import os
+import re
+from metrics import TimedRoute
+from gemini_client import API_KEY
+from audio_processing import DEFAULT_SAMPLE_RATE, ffmpeg_available, wav_pcm, wav_sample_rate
+from blob_store import blob_store, parse_blob_reference
+from export_processing import animatic_mp4, contact_sheet_pdf
+from api.audio import narrate, NARRATION_CONCURRENCY
+
+router = APIRouter(prefix="/api", tags=["export"], route_class=TimedRoute)
+logger = logging.getLogger(__name__)
+
+# Export configuration
+EXPORT_MAX_PANELS = int(os.getenv("EXPORT_MAX_PANELS", "500"))
+# Longest time one panel may be held on screen in the animatic
+EXPORT_MAX_PANEL_SECONDS = float(os.getenv("EXPORT_MAX_PANEL_SECONDS", "120"))
+EXPORT_DEFAULT_PANEL_SECONDS = float(os.getenv("EXPORT_DEFAULT_PANEL_SECONDS", "3"))
+EXPORT_NARRATION_PADDING = float(os.getenv("EXPORT_NARRATION_PADDING", "0.5"))
+
+# Export format -> (mime type, file extension)
+EXPORT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "pdf": ("application/pdf", "pdf"),
+    "animatic": ("video/mp4", "mp4"),
+}
+
+# Pydantic Models
+class ExportPanel(BaseModel):
+    imageUrl: Optional[str] = None  # Blob URL or digest, as returned by /generate-image
+    prompt: Optional[str] = None
+    motion: Optional[str] = None
+    audio: Optional[str] = None  # Audio/VO cue notes
+    text: Optional[str] = None  # On-screen text
+    # Seconds on screen, up to EXPORT_MAX_PANEL_SECONDS; extended to fit the narration
+    duration: Optional[float] = Field(None, gt=0, le=EXPORT_MAX_PANEL_SECONDS)
+    narration: Optional[str] = None  # Text to narrate in the animatic (served from the narration cache when possible)
+    narrationUrl: Optional[str] = None  # WAV blob from /generate-narration or a generate-audio job
+
+class ExportRequest(BaseModel):
+    panels: List[ExportPanel]
+    format: str = "pdf"  # pdf or animatic
+    title: Optional[str] = None
+    voice: Optional[str] = None  # Voice for narration synthesised during export
+    columns: int = 2  # Contact sheet grid
+    rows: int = 2
+
+# Helper Functions
+def stored_blob(reference: Optional[str], what: str, index: int) -> Optional[str]:
+    """Digest of a panel's blob reference; exports only read blobs already on this server"""
+    if not reference:
+        return None
+    digest = parse_blob_reference(reference)
+    if not digest or not blob_store.exists(digest):
+        raise HTTPException(status_code=400, detail=f"Panel {index + 1}: {what} must reference a stored blob")
+    return digest
+
+def export_filename(title: Optional[str], extension: str) -> str:
+    stem = re.sub(r"[^A-Za-z0-9_-]+", "_", (title or "").strip()).strip("_") or "storyboard"
+    return f"{stem[:80]}.{extension}"
+
+def sheet_panels(request: ExportRequest) -> List[Dict[str, Any]]:
+    panels = []
+    for index, panel in enumerate(request.panels):
+        digest = stored_blob(panel.imageUrl, "imageUrl", index)
+        image = None
+        if digest:
+            # The preview derivative is already sized for a printed sheet
+            image = blob_store.path(digest, "preview") if blob_store.exists(digest, "preview") else blob_store.path(digest)
+        notes = [
+            (label, value) for label, value in (
+                ("Prompt", panel.prompt), ("Motion", panel.motion), ("Audio", panel.audio), ("Text", panel.text)
+            ) if value and value.strip()
+        ]
+        panels.append({"label": f"Panel {index + 1}", "image": image, "notes": notes})
+    return panels
+
+def narration_wav_info(path: Path) -> Tuple[int, int]:
+    """Sample rate and sample count of a stored narration WAV"""
+    wav_data = path.read_bytes()
+    return wav_sample_rate(wav_data), len(wav_pcm(wav_data)) // 2
+
+async def animatic_panels(request: ExportRequest) -> Tuple[List[Dict[str, Any]], int]:
+    """Resolve each panel's frame and narration, and how long it stays on screen"""
+    image_digests = [stored_blob(panel.imageUrl, "imageUrl", index) for index, panel in enumerate(request.panels)]
+    audio_digests = [stored_blob(panel.narrationUrl, "narrationUrl", index) for index, panel in enumerate(request.panels)]
+
+    to_narrate = [
+        index for index, panel in enumerate(request.panels)
+        if audio_digests[index] is None and panel.narration and panel.narration.strip()
+    ]
+    if to_narrate:
+        if not API_KEY:
+            raise HTTPException(status_code=500, detail="API key not configured")
+        semaphore = asyncio.Semaphore(NARRATION_CONCURRENCY)
+
+        async def narrate_panel(index: int) -> Dict[str, Any]:
+            async with semaphore:
+                return await narrate(request.panels[index].narration, request.voice)
+
+        logger.info(f"Narrating {len(to_narrate)} panels for animatic export")
+        try:
+            entries = await asyncio.gather(*(narrate_panel(index) for index in to_narrate))
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Narration generation failed: {str(e)}")
+        for index, entry in zip(to_narrate, entries):
+            audio_digests[index] = entry["digest"]
+
+    audio_info: Dict[int, Tuple[int, int]] = {}
+    for index, digest in enumerate(audio_digests):
+        if digest:
+            try:
+                audio_info[index] = await asyncio.to_thread(narration_wav_info, blob_store.path(digest))
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Panel {index + 1}: narrationUrl is not a WAV file")
+
+    sample_rates = {rate for rate, _ in audio_info.values()}
+    if len(sample_rates) > 1:
+        raise HTTPException(status_code=400, detail="Panel narration has mismatched sample rates")
+    sample_rate = sample_rates.pop() if sample_rates else DEFAULT_SAMPLE_RATE
+
+    panels = []
+    for index, panel in enumerate(request.panels):
+        seconds = panel.duration
+        if index in audio_info:
+            narration_seconds = audio_info[index][1] / sample_rate + EXPORT_NARRATION_PADDING
+            seconds = max(seconds or 0.0, narration_seconds)
+        panels.append({
+            "image": blob_store.path(image_digests[index]) if image_digests[index] else None,
+            "audio": blob_store.path(audio_digests[index]) if audio_digests[index] else None,
+            "samples": round((seconds or EXPORT_DEFAULT_PANEL_SECONDS) * sample_rate)
+        })
+    return panels, sample_rate
+
+# API Endpoints
+@router.get("/export/formats")
+async def get_export_formats():
+    """Export formats available on this server; the animatic needs ffmpeg"""
+    return {"formats": [name for name in EXPORT_FORMATS if name != "animatic" or ffmpeg_available()]}
+
+@router.post("/export")
+async def export_storyboard(request: ExportRequest):
+    """Stream a PDF contact sheet or an MP4 animatic of a storyboard, built from blobs already stored here"""
+    if request.format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported export format '{request.format}'. Supported: {', '.join(EXPORT_FORMATS)}"
+        )
+    if not request.panels:
+        raise HTTPException(status_code=400, detail="At least one panel is required")
+    if len(request.panels) > EXPORT_MAX_PANELS:
+        raise HTTPException(status_code=413, detail=f"At most {EXPORT_MAX_PANELS} panels per export")
+
+    media_type, extension = EXPORT_FORMATS[request.format]
+    title = (request.title or "").strip() or "Storyboard"
+    logger.info(f"Exporting {len(request.panels)} panels as {request.format}")
+
+    if request.format == "pdf":
+        if not (1 <= request.columns <= 4 and 1 <= request.rows <= 4):
+            raise HTTPException(status_code=400, detail="columns and rows must be between 1 and 4")
+        body = contact_sheet_pdf(sheet_panels(request), title, request.columns, request.rows)
+    else:
+        if not ffmpeg_available():
+            raise HTTPException(status_code=501, detail="Animatic export requires ffmpeg on the server")
+        panels, sample_rate = await animatic_panels(request)
+        body = animatic_mp4(panels, sample_rate)
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{export_filename(request.title, extension)}"'}
+    )
@@ -3,24 +3,51 @@ Image generation API endpoints
 """
 
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import logging
+from metrics import TimedRoute
 from prompt_manager import prompt_manager, image_prompt
-import httpx
+from gemini_client import API_KEY, call_api, model_url, IMAGE_TIMEOUT, TEXT_TIMEOUT
+from blob_store import blob_store, blob_url, parse_blob_reference
+from session_store import session_store, new_session
+from image_processing import crop_with_derivatives, make_derivatives, run_in_pool, supported_formats
+from rate_limiter import upstream_scheduler, IMAGE_CONCURRENCY, IMAGE_RPM, TEXT_CONCURRENCY, TEXT_RPM
+from single_flight import single_flight, request_key
+from job_queue import job_queue
+from similarity_index import image_descriptor, session_indexes
+from reference_images import REFERENCE_NORMALISE, prepare_reference
+from context_cache import context_cache
+from request_limits import (
+    limit_body, check_inline_size, IMAGE_REQUEST_MAX_BYTES, INLINE_IMAGE_MAX_BYTES, ASSET_IMAGES_MAX_BYTES
+)
+import asyncio
 import json
 import base64
-import io
-from PIL import Image
 import os
+import re
 
-router = APIRouter(prefix="/api", tags=["images"])
+router = APIRouter(prefix="/api", tags=["images"], route_class=TimedRoute)
 logger = logging.getLogger(__name__)
 
 # API Configuration
-API_KEY = os.getenv("GEMINI_API_KEY", "")
-IMAGE_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-image-preview:generateContent?key={API_KEY}"
-TEXT_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={API_KEY}"
+IMAGE_API_URL = model_url("gemini-2.5-flash-image-preview")
+TEXT_API_URL = model_url("gemini-2.5-flash-preview-05-20")
+
+# Upstream budgets; calls beyond them queue instead of tripping Gemini's rate limits
+upstream_scheduler.register(IMAGE_API_URL, IMAGE_CONCURRENCY, IMAGE_RPM)
+upstream_scheduler.register(TEXT_API_URL, TEXT_CONCURRENCY, TEXT_RPM)
+
+# Routes that accept base64 images get the larger body limit
+for path in ("/generate-image", "/generate-storyboard-images", "/analyze-style", "/create-style-session"):
+    limit_body(f"{router.prefix}{path}", IMAGE_REQUEST_MAX_BYTES)
+
+# Upper bound on panels rendered at once by the batch endpoint
+STORYBOARD_IMAGE_CONCURRENCY = int(os.getenv("STORYBOARD_IMAGE_CONCURRENCY", "4"))
+
+# Most earlier session panels attached as references to one generation
+SIMILARITY_MAX_REFERENCES = int(os.getenv("SIMILARITY_MAX_REFERENCES", "3"))
 
 # Pydantic Models
 class ImageGenerationRequest(BaseModel):
@@ -30,10 +57,18 @@ class ImageGenerationRequest(BaseModel):
     previousImageUrl: Optional[str] = None
     styleImageBase64: Optional[str] = None
     styleImageMimeType: Optional[str] = None
+    # Stored blob digest, preferred over styleImageBase64
+    styleImageDigest: Optional[str] = None
+    # Each asset is {"digest", "mimeType"} or {"base64", "mimeType"}
     assetImages: List[Dict[str, str]] = []
     # Add consistency parameters
     projectStyleId: Optional[str] = None
     maintainConsistency: bool = True
+    # Attach this many of the session's panels most similar to the previous frame (or the latest panel)
+    referenceCount: int = 0
+    # Output encoding of the cropped panel
+    outputFormat: str = "jpeg"
+    maxWidth: Optional[int] = None
 
     class Config:
         json_schema_extra = {
@@ -43,80 +78,156 @@ class ImageGenerationRequest(BaseModel):
             }
         }
 
+class StoryboardImagesRequest(BaseModel):
+    panels: List[Dict[str, Any]]
+    style: str = "Cinematic Realism"
+    styleImageBase64: Optional[str] = None
+    styleImageMimeType: Optional[str] = None
+    styleImageDigest: Optional[str] = None
+    # Named library assets, referenced from panel prompts as [name]
+    assetLibrary: List[Dict[str, str]] = []
+    projectStyleId: Optional[str] = None
+    maintainConsistency: bool = True
+    referenceCount: int = 0
+    outputFormat: str = "jpeg"
+    maxWidth: Optional[int] = None
+    maxConcurrency: Optional[int] = None
+
+class SimilarPanelsRequest(BaseModel):
+    imageUrl: str  # Blob URL or digest of the panel to compare against
+    k: int = 5
+
 class StyleGenerationRequest(BaseModel):
     style: str
 
 class StyleAnalysisRequest(BaseModel):
-    image_base64: str
-    mime_type: str
+    image_base64: Optional[str] = None
+    image_digest: Optional[str] = None
+    mime_type: Optional[str] = None
 
 # Helper Functions
-async def call_api(url: str, payload: dict) -> dict:
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            url,
-            headers={"Content-Type": "application/json"},
-            json=payload,
-            timeout=60.0
-        )
-        if not response.is_success:
-            error_detail = response.text
-            try:
-                error_json = response.json()
-                error_detail = error_json.get("error", {}).get("message", error_detail)
-            except:
-                pass
-            raise HTTPException(status_code=response.status_code, detail=error_detail)
-        return response.json()
-
-def crop_image_to_16_9(image_base64: str) -> str:
-    """Crop image to 16:9 aspect ratio using center crop as fallback"""
-    try:
-        # Decode base64 image
-        image_data = base64.b64decode(image_base64)
-        image = Image.open(io.BytesIO(image_data))
-
-        # Calculate 16:9 crop dimensions
-        target_aspect_ratio = 16 / 9
-        width, height = image.size
-
-        if width / height > target_aspect_ratio:
-            # Image is too wide
-            new_width = int(height * target_aspect_ratio)
-            left = (width - new_width) // 2
-            crop_box = (left, 0, left + new_width, height)
-        else:
-            # Image is too tall
-            new_height = int(width / target_aspect_ratio)
-            top = (height - new_height) // 2
-            crop_box = (0, top, width, top + new_height)
+def resolve_panel_assets(prompt: str, asset_library: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Collect library assets referenced in a prompt as [name]"""
+    assets_by_name = {asset.get("name"): asset for asset in asset_library}
+    assets = []
+    for name in re.findall(r"\[(.*?)\]", prompt):
+        asset = assets_by_name.get(name)
+        if asset:
+            assets.append({k: v for k, v in asset.items() if k != "name"})
+    return assets
+
+async def inline_image_part(base64_data: Optional[str] = None,
+                            mime_type: Optional[str] = None,
+                            digest: Optional[str] = None,
+                            transfer: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """Build an inlineData part, reading stored blobs only when the payload is built.
+
+    Images are normalised for upload (see reference_images); `transfer`
+    accumulates their original and sent sizes for the caller to report.
+    """
+    if digest and not blob_store.exists(digest):
+        raise HTTPException(status_code=400, detail=f"Unknown image digest: {digest}")
+    if not digest and (not base64_data or not mime_type):
+        raise HTTPException(status_code=400, detail="Image reference requires data and a mime type")
+
+    if not REFERENCE_NORMALISE:
+        if digest:
+            data, stored_mime_type = await blob_store.aget(digest)
+            base64_data = base64.b64encode(data).decode("ascii")
+            mime_type = mime_type or stored_mime_type
+        return {"inlineData": {"mimeType": mime_type, "data": base64_data}}
 
-        cropped_image = image.crop(crop_box)
-
-        # Convert back to base64
-        buffer = io.BytesIO()
-        cropped_image.save(buffer, format='JPEG', quality=90)
-        cropped_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-
-        return f"data:image/jpeg;base64,{cropped_base64}"
+    try:
+        data = None if digest else base64.b64decode(base64_data)
+        data, sent_mime_type, original_size = await prepare_reference(data, mime_type, digest)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Unknown image digest: {digest}")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Image reference is not valid base64")
+    if transfer is not None:
+        transfer["images"] = transfer.get("images", 0) + 1
+        transfer["original"] = transfer.get("original", 0) + original_size
+        transfer["sent"] = transfer.get("sent", 0) + len(data)
+    return {"inlineData": {"mimeType": sent_mime_type or mime_type, "data": base64.b64encode(data).decode("ascii")}}
+
+async def previous_image_part(previous_image_url: str,
+                              transfer: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """Resolve the previous frame from a blob URL or a data URL"""
+    digest = parse_blob_reference(previous_image_url)
+    if digest:
+        return await inline_image_part(digest=digest, transfer=transfer)
+
+    # Extract base64 from data URL
+    header, base64_data = previous_image_url.split(',', 1)
+    mime_type = header.split(';')[0].split(':')[1]
+    return await inline_image_part(base64_data, mime_type, transfer=transfer)
+
+def check_image_fields(style_image: Optional[str], assets: List[Dict[str, str]]) -> int:
+    """Reject oversized inline images with 413; returns their total base64 size"""
+    return (
+        check_inline_size("styleImageBase64", [style_image], INLINE_IMAGE_MAX_BYTES)
+        + check_inline_size("assetImages", (asset.get("base64") for asset in assets), ASSET_IMAGES_MAX_BYTES)
+    )
+
+def image_urls(digest: str) -> Dict[str, str]:
+    """URLs of a stored image and its derivatives"""
+    return {
+        "thumbnailUrl": blob_url(digest, "thumb"),
+        "previewUrl": blob_url(digest, "preview")
+    }
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Image cropping failed: {str(e)}")
+def extract_inline_image(result: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """Return the first inlineData part of a generateContent response"""
+    for part in result.get("candidates", [{}])[0].get("content", {}).get("parts", []):
+        if "inlineData" in part:
+            return part["inlineData"]
+    return None
 
 # Style consistency management
-style_sessions = {}
-
-def get_or_create_style_session(project_style_id: str, base_style: str, style_image: dict = None) -> dict:
+async def style_image_reference(style_image: Optional[dict]) -> Optional[dict]:
+    """Reduce a style image to a blob digest so sessions never hold image payloads"""
+    if not style_image:
+        return None
+    mime_type = style_image.get("mimeType")
+    digest = style_image.get("digest")
+    if not digest and style_image.get("base64"):
+        digest = await blob_store.aput(base64.b64decode(style_image["base64"]), mime_type or "application/octet-stream")
+    return {"digest": digest, "mimeType": mime_type} if digest else None
+
+async def get_or_create_style_session(project_style_id: str, base_style: str, style_image: dict = None) -> dict:
     """Get or create a style session for consistency"""
-    if project_style_id not in style_sessions:
-        style_sessions[project_style_id] = {
-            "base_style": base_style,
-            "style_image": style_image,
-            "generated_images": [],
-            "style_keywords": [],
-            "consistency_prompt": ""
-        }
-    return style_sessions[project_style_id]
+    session = await session_store.get(project_style_id)
+    if session is None:
+        session = await session_store.get_or_create(
+            project_style_id,
+            new_session(base_style, await style_image_reference(style_image))
+        )
+    return session
+
+async def blob_descriptor(digest: str) -> str:
+    """Similarity descriptor of a stored image, from its thumbnail when there is one"""
+    path = blob_store.path(digest, "thumb") if blob_store.exists(digest, "thumb") else blob_store.path(digest)
+    return await run_in_pool(image_descriptor, await asyncio.to_thread(path.read_bytes))
+
+async def similar_session_panels(session_id: str,
+                                 style_session: dict,
+                                 previous_image_url: Optional[str],
+                                 count: int) -> List[str]:
+    """Digests of the session panels most similar to the previous frame, or to the latest panel without one"""
+    index = session_indexes.get(session_id, style_session)
+    if not len(index):
+        return []
+
+    previous = parse_blob_reference(previous_image_url) if previous_image_url else None
+    descriptor = index.descriptor_of(previous) if previous else None
+    if previous and descriptor is None and blob_store.exists(previous):
+        descriptor = await blob_descriptor(previous)
+    if descriptor is None:
+        descriptor = index.descriptor_of(index.digests[-1])
+
+    # The previous frame is attached separately
+    matches = index.top_k(descriptor, count, exclude=[previous] if previous else [])
+    return [match["digest"] for match in matches]
 
 def build_consistency_prompt(style_session: dict, new_prompt: str) -> str:
     """Build a prompt that maintains visual consistency"""
@@ -140,29 +251,23 @@ def build_consistency_prompt(style_session: dict, new_prompt: str) -> str:
     return f"Style: {base_style}. {new_prompt}{consistency_text}"
 
 # API Endpoints
-@router.post("/generate-image")
-async def generate_image(request: ImageGenerationRequest):
-    if not API_KEY:
-        raise HTTPException(status_code=500, detail="API key not configured")
-
+async def render_image(request: ImageGenerationRequest) -> Dict[str, Any]:
+    """Generate, crop and store one panel image"""
     try:
-        # Log request size for debugging
-        request_size = len(str(request.dict()))
-        logger.info(f"Generating image for prompt: {request.prompt[:50]}... (Request size: {request_size / 1024:.1f}KB)")
-
-        # Validate request size
-        if request_size > 45 * 1024 * 1024:  # 45MB limit
-            raise HTTPException(
-                status_code=413,
-                detail="Request too large. Please reduce image sizes or number of assets."
-            )
+        inline_size = check_image_fields(request.styleImageBase64, request.assetImages)
+        logger.info(f"Generating image for prompt: {request.prompt[:50]}... (Inline images: {inline_size / 1024:.1f}KB)")
 
         # Handle style consistency
-        if request.maintainConsistency and request.projectStyleId:
-            style_session = get_or_create_style_session(
+        use_session = bool(request.maintainConsistency and request.projectStyleId)
+        if use_session:
+            style_session = await get_or_create_style_session(
                 request.projectStyleId,
                 request.style,
-                {"base64": request.styleImageBase64, "mimeType": request.styleImageMimeType} if request.styleImageBase64 else None
+                {
+                    "digest": request.styleImageDigest,
+                    "base64": request.styleImageBase64,
+                    "mimeType": request.styleImageMimeType
+                }
             )
 
             # Use LangChain prompt management with consistency
@@ -188,73 +293,195 @@ async def generate_image(request: ImageGenerationRequest):
         # Build parts for API call
         parts = [{"text": final_prompt}]
 
-        # Add asset images
+        # Asset and style images are shared across the board, so they form the cacheable context
+        transfer: Dict[str, int] = {}
+        reference_parts = []
         for asset in request.assetImages:
-            parts.append({
-                "inlineData": {
-                    "mimeType": asset["mimeType"],
-                    "data": asset["base64"]
-                }
-            })
+            reference_parts.append(await inline_image_part(
+                asset.get("base64"), asset.get("mimeType"), asset.get("digest"), transfer
+            ))
 
         # Add style reference image
-        if request.styleImageBase64:
-            parts.append({
-                "inlineData": {
-                    "mimeType": request.styleImageMimeType,
-                    "data": request.styleImageBase64
-                }
-            })
+        if request.styleImageDigest or request.styleImageBase64:
+            reference_parts.append(await inline_image_part(
+                request.styleImageBase64,
+                request.styleImageMimeType,
+                request.styleImageDigest,
+                transfer
+            ))
 
         # Add previous frame reference
-        if request.refPrev and request.previousImageUrl:
+        previous_image_url = request.previousImageUrl if request.refPrev else None
+        if previous_image_url:
             try:
-                # Extract base64 from data URL
-                header, base64_data = request.previousImageUrl.split(',', 1)
-                mime_type = header.split(';')[0].split(':')[1]
-                parts.append({
-                    "inlineData": {
-                        "mimeType": mime_type,
-                        "data": base64_data
-                    }
-                })
+                parts.append(await previous_image_part(previous_image_url, transfer))
             except Exception as e:
                 logger.warning(f"Failed to process previous image: {e}")
 
+        # Add the session's most similar earlier panels
+        if use_session and request.referenceCount > 0:
+            references = await similar_session_panels(
+                request.projectStyleId, style_session, previous_image_url, min(request.referenceCount, SIMILARITY_MAX_REFERENCES)
+            )
+            logger.info(f"Attaching {len(references)} similar session panels as references")
+            for reference in references:
+                parts.append(await inline_image_part(digest=reference, transfer=transfer))
+
+        if transfer:
+            saved = transfer["original"] - transfer["sent"]
+            logger.info(f"Reference images: {transfer['images']}, {transfer['original'] / 1024:.1f}KB -> "
+                        f"{transfer['sent'] / 1024:.1f}KB (saved {saved / 1024:.1f}KB)")
+
         payload = {
             "contents": [{"parts": parts}],
             "generationConfig": {"responseModalities": ["IMAGE"]}
         }
 
-        result = await call_api(IMAGE_API_URL, payload)
+        context = {"contents": [{"role": "user", "parts": reference_parts}]} if reference_parts else {}
+        result = await context_cache.call(
+            IMAGE_API_URL, payload, context,
+            owner=request.projectStyleId if use_session else None,
+            timeout=IMAGE_TIMEOUT
+        )
 
         # Extract image data
-        base64_data = None
-        for part in result.get("candidates", [{}])[0].get("content", {}).get("parts", []):
-            if "inlineData" in part:
-                base64_data = part["inlineData"]["data"]
-                break
-
-        if not base64_data:
+        inline_image = extract_inline_image(result)
+        if not inline_image:
             raise HTTPException(status_code=500, detail="No image data received from API")
 
-        # Crop to 16:9 and return
-        cropped_image_url = crop_image_to_16_9(base64_data)
-
-        # Update style session for consistency
-        if request.maintainConsistency and request.projectStyleId:
-            style_session["generated_images"].append({
+        # Crop to 16:9 and build thumbnails off the event loop, then store
+        try:
+            rendered = await run_in_pool(
+                crop_with_derivatives,
+                base64.b64decode(inline_image["data"]),
+                request.outputFormat,
+                request.maxWidth
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Image cropping failed: {str(e)}")
+        cropped_image, mime_type = rendered.pop("full")
+        digest = await blob_store.aput(cropped_image, mime_type)
+        await blob_store.aput_variants(digest, rendered)
+
+        # Update style session for consistency, flagging near-duplicates of earlier panels
+        duplicate_of = None
+        if use_session:
+            descriptor = await run_in_pool(image_descriptor, rendered["thumb"][0])
+            current_session = await session_store.get(request.projectStyleId)
+            if current_session is not None:
+                duplicates = session_indexes.get(request.projectStyleId, current_session).duplicates(descriptor)
+                if duplicates:
+                    duplicate_of = duplicates[0]["digest"]
+                    logger.info(f"Panel {digest[:12]} is a near-duplicate of {duplicate_of[:12]}")
+            await session_store.append_image(request.projectStyleId, {
                 "prompt": request.prompt,
-                "image_url": cropped_image_url
+                "digest": digest,
+                "descriptor": descriptor
             })
+            session_indexes.invalidate(request.projectStyleId)
 
-        return {"imageUrl": cropped_image_url}
+        return {"imageUrl": blob_url(digest), "digest": digest, **image_urls(digest), "duplicateOf": duplicate_of}
 
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Image generation failed: {str(e)}")
 
+@router.post("/generate-image")
+async def generate_image(request: ImageGenerationRequest):
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not configured")
+
+    if request.outputFormat not in supported_formats():
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported output format '{request.outputFormat}'. Supported: {', '.join(supported_formats())}"
+        )
+
+    # Before hashing the request for single flight, which copies it
+    check_image_fields(request.styleImageBase64, request.assetImages)
+
+    # Identical concurrent requests (double-clicks, duplicate tabs) share one generation
+    return await single_flight.do("generate-image", request_key(request), lambda: render_image(request))
+
+@router.post("/generate-storyboard-images")
+async def generate_storyboard_images(request: StoryboardImagesRequest):
+    """Render every panel of a storyboard concurrently, streaming NDJSON results as they complete.
+
+    Panels with refPrev wait only for the panel before them, so independent
+    runs of the board render in parallel while refPrev chains stay ordered.
+    """
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not configured")
+
+    if not request.panels:
+        raise HTTPException(status_code=400, detail="At least one panel is required")
+
+    check_image_fields(request.styleImageBase64, request.assetLibrary)
+    for panel in request.panels:
+        check_image_fields(None, panel.get("assetImages") or [])
+
+    concurrency = max(1, min(request.maxConcurrency or STORYBOARD_IMAGE_CONCURRENCY, STORYBOARD_IMAGE_CONCURRENCY))
+    logger.info(f"Generating {len(request.panels)} storyboard images (concurrency: {concurrency})")
+
+    async def stream_results():
+        semaphore = asyncio.Semaphore(concurrency)
+        results: asyncio.Queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        # Resolves to each panel's image URL (None on failure) for dependent panels
+        rendered = [loop.create_future() for _ in request.panels]
+
+        async def render_panel(index: int, panel: Dict[str, Any]):
+            previous_image_url = None
+            ref_prev = bool(panel.get("refPrev", False)) and index > 0
+            if ref_prev:
+                previous_image_url = await rendered[index - 1]
+                if previous_image_url is None:
+                    logger.warning(f"Panel {index + 1} renders without its reference: previous panel failed")
+
+            prompt = panel.get("prompt", "")
+            try:
+                if not prompt.strip():
+                    raise HTTPException(status_code=400, detail="Panel has no prompt")
+
+                panel_request = ImageGenerationRequest(
+                    prompt=prompt,
+                    style=request.style,
+                    refPrev=ref_prev and previous_image_url is not None,
+                    previousImageUrl=previous_image_url,
+                    styleImageBase64=request.styleImageBase64,
+                    styleImageMimeType=request.styleImageMimeType,
+                    styleImageDigest=request.styleImageDigest,
+                    assetImages=panel.get("assetImages") or resolve_panel_assets(prompt, request.assetLibrary),
+                    projectStyleId=request.projectStyleId,
+                    maintainConsistency=request.maintainConsistency,
+                    referenceCount=request.referenceCount,
+                    outputFormat=request.outputFormat,
+                    maxWidth=request.maxWidth
+                )
+
+                async with semaphore:
+                    result = await generate_image(panel_request)
+
+                rendered[index].set_result(result["imageUrl"])
+                await results.put({"index": index, **result})
+            except Exception as e:
+                rendered[index].set_result(None)
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                logger.error(f"Panel {index + 1} image generation failed: {detail}")
+                await results.put({"index": index, "error": detail})
+
+        tasks = [asyncio.create_task(render_panel(i, panel)) for i, panel in enumerate(request.panels)]
+        try:
+            for _ in tasks:
+                yield json.dumps(await results.get()) + "\n"
+        finally:
+            # Stop outstanding work if the client goes away
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
 @router.post("/generate-suggestions")
 async def generate_suggestions(request: dict):
     if not API_KEY:
@@ -280,7 +507,7 @@ async def generate_suggestions(request: dict):
             }
         }
 
-        result = await call_api(TEXT_API_URL, payload)
+        result = await call_api(TEXT_API_URL, payload, timeout=TEXT_TIMEOUT)
         suggestions_text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "[]")
         suggestions = json.loads(suggestions_text)
 
@@ -290,11 +517,8 @@ async def generate_suggestions(request: dict):
         logger.error(f"Error generating suggestions: {e}")
         return {"suggestions": []}
 
-@router.post("/generate-style")
-async def generate_style(request: StyleGenerationRequest):
-    if not API_KEY:
-        raise HTTPException(status_code=500, detail="API key not configured")
-
+async def render_style_reference(request: StyleGenerationRequest) -> Dict[str, Any]:
+    """Generate and store a style reference image"""
     try:
         logger.info(f"Generating style reference for: {request.style}")
 
@@ -307,21 +531,22 @@ async def generate_style(request: StyleGenerationRequest):
             "generationConfig": {"responseModalities": ["IMAGE"]}
         }
 
-        result = await call_api(IMAGE_API_URL, payload)
-
-        base64_data = None
-        for part in result.get("candidates", [{}])[0].get("content", {}).get("parts", []):
-            if "inlineData" in part:
-                base64_data = part["inlineData"]["data"]
-                break
+        result = await call_api(IMAGE_API_URL, payload, timeout=IMAGE_TIMEOUT)
 
-        if not base64_data:
+        inline_image = extract_inline_image(result)
+        if not inline_image:
             raise HTTPException(status_code=500, detail="No image data received")
 
+        mime_type = inline_image.get("mimeType", "image/png")
+        image_data = base64.b64decode(inline_image["data"])
+        digest = await blob_store.aput(image_data, mime_type)
+        await blob_store.aput_variants(digest, await run_in_pool(make_derivatives, image_data))
+
         return {
-            "base64": base64_data,
-            "mimeType": "image/png",
-            "dataUrl": f"data:image/png;base64,{base64_data}"
+            "digest": digest,
+            "mimeType": mime_type,
+            "url": blob_url(digest),
+            **image_urls(digest)
         }
 
     except HTTPException:
@@ -329,18 +554,29 @@ async def generate_style(request: StyleGenerationRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Style generation failed: {str(e)}")
 
+@router.post("/generate-style")
+async def generate_style(request: StyleGenerationRequest):
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not configured")
+
+    return await single_flight.do("generate-style", request_key(request), lambda: render_style_reference(request))
+
 @router.post("/analyze-style")
 async def analyze_style(request: StyleAnalysisRequest):
     if not API_KEY:
         raise HTTPException(status_code=500, detail="API key not configured")
 
+    check_inline_size("image_base64", [request.image_base64], INLINE_IMAGE_MAX_BYTES)
+
     try:
         logger.info(f"Analyzing style from uploaded image")
 
+        image_part = await inline_image_part(request.image_base64, request.mime_type, request.image_digest)
+
         # Use LangChain prompt management
         variables = {
-            "image_data": request.image_base64,
-            "mime_type": request.mime_type
+            "image_data": image_part["inlineData"]["data"],
+            "mime_type": image_part["inlineData"]["mimeType"]
         }
 
         system_prompt = prompt_manager.get_system_prompt('style_analysis', variables)
@@ -348,26 +584,18 @@ async def analyze_style(request: StyleAnalysisRequest):
         response_schema = prompt_manager.get_response_schema('style_analysis')
 
         # Build parts for API call with image
-        parts = [
-            {"text": user_prompt},
-            {
-                "inlineData": {
-                    "mimeType": request.mime_type,
-                    "data": request.image_base64
-                }
-            }
-        ]
+        parts = [{"text": user_prompt}, image_part]
 
         payload = {
             "contents": [{"parts": parts}],
-            "systemInstruction": {"parts": [{"text": system_prompt}]},
             "generationConfig": {
                 "responseMimeType": "application/json",
                 "responseSchema": response_schema
             }
         }
+        context = {"systemInstruction": {"parts": [{"text": system_prompt}]}}
 
-        result = await call_api(TEXT_API_URL, payload)
+        result = await context_cache.call(TEXT_API_URL, payload, context, timeout=TEXT_TIMEOUT)
         analysis_text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "{}")
 
         try:
@@ -412,29 +640,69 @@ async def create_style_session(request: dict):
 
     if not project_id:
         raise HTTPException(status_code=400, detail="Project ID required")
+    if style_image:
+        check_inline_size("styleImage", [style_image.get("base64")], INLINE_IMAGE_MAX_BYTES)
 
-    style_sessions[project_id] = {
-        "base_style": base_style,
-        "style_image": style_image,
-        "generated_images": [],
-        "style_keywords": [],
-        "consistency_prompt": ""
-    }
+    await session_store.save(project_id, new_session(base_style, await style_image_reference(style_image)))
+    session_indexes.invalidate(project_id)
 
     return {"sessionId": project_id, "status": "created"}
 
 @router.get("/style-session/{project_id}")
 async def get_style_session(project_id: str):
     """Get current style session state"""
-    if project_id not in style_sessions:
+    session = await session_store.get(project_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Style session not found")
 
-    return style_sessions[project_id]
+    # The packed descriptors are for the server's similarity index only
+    descriptors = session.get("descriptors") or {"digests": []}
+    return {**{key: value for key, value in session.items() if key != "descriptors"},
+            "indexed_panels": len(descriptors["digests"])}
+
+@router.post("/style-session/{project_id}/similar")
+async def find_similar_panels(project_id: str, request: SimilarPanelsRequest):
+    """Session panels most visually similar to an image, and any near-duplicates of it"""
+    session = await session_store.get(project_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Style session not found")
+
+    digest = parse_blob_reference(request.imageUrl)
+    if not digest or not blob_store.exists(digest):
+        raise HTTPException(status_code=400, detail="imageUrl must reference a stored blob")
+
+    index = session_indexes.get(project_id, session)
+    descriptor = index.descriptor_of(digest)
+    if descriptor is None:
+        try:
+            descriptor = await blob_descriptor(digest)
+        except Exception as e:
+            raise HTTPException(status_code=415, detail=f"Could not decode image: {str(e)}")
+
+    k = max(1, min(request.k, 50))
+    return {
+        "indexed": len(index),
+        "matches": [{**match, **image_urls(match["digest"])} for match in index.top_k(descriptor, k, exclude=[digest])],
+        "duplicates": [{**match, **image_urls(match["digest"])} for match in index.duplicates(descriptor, exclude=[digest])]
+    }
 
 @router.delete("/style-session/{project_id}")
 async def clear_style_session(project_id: str):
     """Clear style session for fresh start"""
-    if project_id in style_sessions:
-        del style_sessions[project_id]
-
-    return {"status": "cleared"}
\ No newline at end of file
+    await session_store.delete(project_id)
+    await context_cache.release(project_id)
+    session_indexes.invalidate(project_id)
+
+    return {"status": "cleared"}
+
+# Background job kinds (see api/jobs.py)
+async def storyboard_images_job(request: StoryboardImagesRequest) -> Dict[str, Any]:
+    """Render a whole board and return every panel's result at once"""
+    response = await generate_storyboard_images(request)
+    results = [json.loads(line) async for line in response.body_iterator]
+    return {"panels": sorted(results, key=lambda result: result["index"])}
+
+job_queue.register("generate-image", ImageGenerationRequest, generate_image)
+job_queue.register("generate-storyboard-images", StoryboardImagesRequest, storyboard_images_job)
+job_queue.register("generate-style", StyleGenerationRequest, generate_style)
+job_queue.register("analyze-style", StyleAnalysisRequest, analyze_style)
@@ -0,0 +1,119 @@
+"""
+Background job API endpoints
+
+Long-running generations can be submitted as jobs instead of being called
+directly: the job id comes back at once and the result is fetched by
+polling, by subscribing to status events, or via a webhook.
+"""
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import Any, Dict, Optional
+import logging
+import os
+import time
+from metrics import TimedRoute
+from job_queue import job_queue, check_webhook_url, FINISHED_STATUSES, SUCCEEDED, FAILED
+from streaming import sse_comment, sse_event
+from request_limits import limit_body, IMAGE_REQUEST_MAX_BYTES
+
+router = APIRouter(prefix="/api", tags=["jobs"], route_class=TimedRoute)
+logger = logging.getLogger(__name__)
+
+# Job payloads may carry the same inline images as the endpoints they stand in for
+limit_body(f"{router.prefix}/jobs", IMAGE_REQUEST_MAX_BYTES)
+
+# Seconds of silence on a job's event stream before a comment is sent, so proxies don't close it as idle
+JOB_EVENTS_KEEPALIVE = float(os.getenv("JOB_EVENTS_KEEPALIVE", "15"))
+
+# Pydantic Models
+class JobSubmission(BaseModel):
+    kind: str  # e.g. "generate-image"; see GET /api/jobs/kinds
+    payload: Dict[str, Any]
+    webhookUrl: Optional[str] = None
+
+# Helper Functions
+def job_links(job_id: str) -> Dict[str, str]:
+    return {
+        "status": f"/api/jobs/{job_id}",
+        "events": f"/api/jobs/{job_id}/events",
+        "result": f"/api/jobs/{job_id}/result"
+    }
+
+async def get_job_or_404(job_id: str) -> Dict[str, Any]:
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# API Endpoints
+@router.post("/jobs", status_code=202)
+async def submit_job(request: JobSubmission):
+    """Queue a generation and return its job id immediately"""
+    if request.webhookUrl:
+        await check_webhook_url(request.webhookUrl)
+
+    job = await job_queue.submit(request.kind, request.payload, request.webhookUrl)
+    return {**job, "links": job_links(job["id"])}
+
+@router.get("/jobs/kinds")
+async def list_job_kinds():
+    """Kinds of work that can be submitted as jobs"""
+    return {"kinds": sorted(job_queue.kinds)}
+
+@router.get("/jobs/stats")
+async def get_job_stats():
+    """Job counts by status and worker pool state"""
+    return await job_queue.get_stats()
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Current status of a job, including its result once finished"""
+    job = await get_job_or_404(job_id)
+    return {**job, "links": job_links(job_id)}
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """The job's result; 409 while it is still pending, the original error if it failed"""
+    job = await get_job_or_404(job_id)
+    if job["status"] == SUCCEEDED:
+        return job["result"]
+    if job["status"] == FAILED:
+        raise HTTPException(status_code=job["error"]["status_code"], detail=job["error"]["detail"])
+    raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Server-sent events with the job's status each time it changes, ending once it finishes"""
+    job = await get_job_or_404(job_id)
+
+    async def events():
+        current = job
+        last_status = None
+        last_sent = time.monotonic()
+        while True:
+            if current["status"] != last_status:
+                last_status = current["status"]
+                last_sent = time.monotonic()
+                yield sse_event("status", current)
+            if current["status"] in FINISHED_STATUSES:
+                return
+            if time.monotonic() - last_sent >= JOB_EVENTS_KEEPALIVE:
+                last_sent = time.monotonic()
+                yield sse_comment("keep-alive")
+            await job_queue.wait_for_change(job_id)
+            current = await job_queue.get(job_id)
+            if current is None:
+                yield sse_event("error", {"detail": "Job not found"})
+                return
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job"""
+    await get_job_or_404(job_id)
+    job = await job_queue.cancel(job_id)
+    logger.info(f"Cancel requested for job {job_id} ({job['status']})")
+    return job
@@ -0,0 +1,90 @@
+"""
+Prometheus metrics endpoint
+"""
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+import asyncio
+import logging
+from metrics import METRICS_ENABLED, registry, TimedRoute
+from job_queue import job_queue
+from narration_cache import narration_cache
+from prompt_manager import prompt_manager
+from rate_limiter import upstream_scheduler
+from response_cache import response_cache
+from session_store import session_store
+from single_flight import single_flight
+
+router = APIRouter(tags=["metrics"], route_class=TimedRoute)
+logger = logging.getLogger(__name__)
+
+# Helper Functions
+class ServiceStatsCollector:
+    """Cache, queue and pool gauges, read from the existing stats objects at scrape time"""
+
+    def collect(self):
+        cache = response_cache.read_stats()
+        yield GaugeMetricFamily("akaza_response_cache_entries", "Upstream responses cached in memory",
+                                value=cache["memory_entries"])
+        lookups = CounterMetricFamily("akaza_response_cache_lookups", "Response cache lookups by result",
+                                      labels=["result"])
+        lookups.add_metric(["hit"], cache["hits"])
+        lookups.add_metric(["miss"], cache["misses"])
+        yield lookups
+
+        queued = GaugeMetricFamily("akaza_upstream_queue_depth", "Calls waiting for an upstream slot", labels=["model"])
+        in_flight = GaugeMetricFamily("akaza_upstream_in_flight", "Upstream calls in progress", labels=["model"])
+        rate = GaugeMetricFamily("akaza_upstream_rate_rpm", "Current adaptive request rate (0 when unlimited)",
+                                 labels=["model"])
+        throttled = CounterMetricFamily("akaza_upstream_throttled", "Upstream 429 responses", labels=["model"])
+        rejected = CounterMetricFamily("akaza_upstream_rejected", "Calls that timed out waiting for a slot",
+                                       labels=["model"])
+        for model, stats in upstream_scheduler.get_stats().items():
+            queued.add_metric([model], stats["queue_depth"])
+            in_flight.add_metric([model], stats["in_flight"])
+            rate.add_metric([model], stats["current_rpm"] or 0)
+            throttled.add_metric([model], stats["throttled"])
+            rejected.add_metric([model], stats["rejected"])
+        yield from (queued, in_flight, rate, throttled, rejected)
+
+        coalescing = single_flight.get_stats()
+        yield GaugeMetricFamily("akaza_single_flight_in_flight", "Distinct generations in flight",
+                                value=coalescing["in_flight"])
+        coalesced = CounterMetricFamily("akaza_single_flight_coalesced", "Requests served by an in-flight call",
+                                        labels=["endpoint"])
+        for endpoint, stats in coalescing["endpoints"].items():
+            coalesced.add_metric([endpoint], stats["coalesced"])
+        yield coalesced
+
+        narration = CounterMetricFamily("akaza_narration_cache_lookups", "Narration cache lookups by result",
+                                        labels=["result"])
+        narration.add_metric(["hit"], narration_cache.stats["hits"])
+        narration.add_metric(["miss"], narration_cache.stats["misses"])
+        yield narration
+
+        yield GaugeMetricFamily("akaza_style_sessions", "Stored style sessions",
+                                value=session_store.read_stats()["sessions"])
+        yield CounterMetricFamily("akaza_prompt_reloads", "Prompt template hot reloads", value=prompt_manager.reloads)
+
+        jobs = job_queue.read_stats()
+        by_status = GaugeMetricFamily("akaza_jobs", "Background jobs by status", labels=["status"])
+        for status, count in jobs["jobs"].items():
+            by_status.add_metric([status], count)
+        yield by_status
+        yield GaugeMetricFamily("akaza_jobs_running", "Jobs running in this process", value=jobs["running_here"])
+
+if METRICS_ENABLED:
+    registry.register(ServiceStatsCollector())
+
+# API Endpoints
+@router.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics in the text exposition format"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+
+    # Collectors query SQLite-backed stores, so render off the event loop
+    output = await asyncio.to_thread(generate_latest, registry)
+    return Response(output, headers={"Content-Type": CONTENT_TYPE_LATEST})
@@ -3,20 +3,28 @@ Storyboard generation API endpoints
 """
 
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import logging
+from metrics import TimedRoute
 from prompt_manager import prompt_manager, storyboard_prompt
-import httpx
+from gemini_client import API_KEY, stream_api, chunk_text, model_url, stream_url, TEXT_TIMEOUT
+from streaming import PanelStreamParser, sse_event
+from job_queue import job_queue
+from rate_limiter import upstream_scheduler, TEXT_CONCURRENCY, TEXT_RPM
+from context_cache import context_cache
 import json
-import os
 
-router = APIRouter(prefix="/api", tags=["storyboards"])
+router = APIRouter(prefix="/api", tags=["storyboards"], route_class=TimedRoute)
 logger = logging.getLogger(__name__)
 
 # API Configuration
-API_KEY = os.getenv("GEMINI_API_KEY", "")
-TEXT_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={API_KEY}"
+TEXT_API_URL = model_url("gemini-2.5-flash-preview-05-20")
+TEXT_STREAM_URL = stream_url("gemini-2.5-flash-preview-05-20")
+
+# Upstream budget, shared by the blocking and streaming text calls
+upstream_scheduler.register(TEXT_API_URL, TEXT_CONCURRENCY, TEXT_RPM)
 
 # Pydantic Models
 class StoryboardGenerationRequest(BaseModel):
@@ -31,23 +39,46 @@ class ScriptRefinementRequest(BaseModel):
     natural_language: str
 
 # Helper Functions
-async def call_api(url: str, payload: dict) -> dict:
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            url,
-            headers={"Content-Type": "application/json"},
-            json=payload,
-            timeout=60.0
+def build_storyboard_payload(request: StoryboardGenerationRequest) -> dict:
+    """Build the upstream payload for storyboard generation"""
+    if request.templateType:
+        # Use template-based generation
+        system_prompt, user_request, schema = storyboard_prompt.create_prompt(
+            request.templateType,
+            request.script,
+            request.panelCount
         )
-        if not response.is_success:
-            error_detail = response.text
-            try:
-                error_json = response.json()
-                error_detail = error_json.get("error", {}).get("message", error_detail)
-            except:
-                pass
-            raise HTTPException(status_code=response.status_code, detail=error_detail)
-        return response.json()
+    else:
+        # Default script analysis
+        variables = {"script": request.script}
+        system_prompt = prompt_manager.get_system_prompt('script_analysis', variables)
+        user_request = prompt_manager.render_template('script_analysis', variables)
+        schema = prompt_manager.get_response_schema('script_analysis')
+
+    return {
+        "contents": [{"parts": [{"text": user_request}]}],
+        "systemInstruction": {"parts": [{"text": system_prompt}]},
+        "generationConfig": {
+            "responseMimeType": "application/json",
+            "responseSchema": schema
+        }
+    }
+
+def system_context(payload: dict) -> dict:
+    """Move a payload's system prompt into a context the context cache can serve"""
+    return {"systemInstruction": payload.pop("systemInstruction")}
+
+def build_refinement_payload(request: ScriptRefinementRequest) -> dict:
+    """Build the upstream payload for script refinement"""
+    # Use LangChain prompt management for script refinement
+    variables = {"natural_language": request.natural_language}
+    system_prompt = prompt_manager.get_system_prompt('script_refinement', variables)
+    user_prompt = prompt_manager.render_template('script_refinement', variables)
+
+    return {
+        "contents": [{"parts": [{"text": user_prompt}]}],
+        "systemInstruction": {"parts": [{"text": system_prompt}]}
+    }
 
 # API Endpoints
 @router.post("/generate-storyboard")
@@ -57,31 +88,11 @@ async def generate_storyboard(request: StoryboardGenerationRequest):
 
     try:
         logger.info(f"Generating storyboard for template: {request.templateType}")
+        payload = build_storyboard_payload(request)
+        context = system_context(payload)
 
-        if request.templateType:
-            # Use template-based generation
-            system_prompt, user_request, schema = storyboard_prompt.create_prompt(
-                request.templateType,
-                request.script,
-                request.panelCount
-            )
-        else:
-            # Default script analysis
-            variables = {"script": request.script}
-            system_prompt = prompt_manager.get_system_prompt('script_analysis', variables)
-            user_request = prompt_manager.render_template('script_analysis', variables)
-            schema = prompt_manager.get_response_schema('script_analysis')
-
-        payload = {
-            "contents": [{"parts": [{"text": user_request}]}],
-            "systemInstruction": {"parts": [{"text": system_prompt}]},
-            "generationConfig": {
-                "responseMimeType": "application/json",
-                "responseSchema": schema
-            }
-        }
-
-        result = await call_api(TEXT_API_URL, payload)
+        # Storyboards are creative output; regenerating should give a fresh board
+        result = await context_cache.call(TEXT_API_URL, payload, context, timeout=TEXT_TIMEOUT, cache=False)
         json_text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text")
 
         if not json_text:
@@ -117,12 +128,10 @@ async def analyze_story(request: StoryAnalysisRequest):
         system_prompt = prompt_manager.get_system_prompt('story_analysis', variables)
         user_prompt = prompt_manager.render_template('story_analysis', variables)
 
-        payload = {
-            "contents": [{"parts": [{"text": user_prompt}]}],
-            "systemInstruction": {"parts": [{"text": system_prompt}]}
-        }
+        payload = {"contents": [{"parts": [{"text": user_prompt}]}]}
+        context = {"systemInstruction": {"parts": [{"text": system_prompt}]}}
 
-        result = await call_api(TEXT_API_URL, payload)
+        result = await context_cache.call(TEXT_API_URL, payload, context, timeout=TEXT_TIMEOUT)
         analysis_text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
 
         return {"analysis": analysis_text}
@@ -143,17 +152,9 @@ async def refine_script(request: ScriptRefinementRequest):
     try:
         logger.info(f"Refining natural language to script: {request.natural_language[:50]}...")
 
-        # Use LangChain prompt management for script refinement
-        variables = {"natural_language": request.natural_language}
-        system_prompt = prompt_manager.get_system_prompt('script_refinement', variables)
-        user_prompt = prompt_manager.render_template('script_refinement', variables)
-
-        payload = {
-            "contents": [{"parts": [{"text": user_prompt}]}],
-            "systemInstruction": {"parts": [{"text": system_prompt}]}
-        }
-
-        result = await call_api(TEXT_API_URL, payload)
+        payload = build_refinement_payload(request)
+        context = system_context(payload)
+        result = await context_cache.call(TEXT_API_URL, payload, context, timeout=TEXT_TIMEOUT)
         refined_script = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
 
         if not refined_script:
@@ -164,4 +165,77 @@ async def refine_script(request: ScriptRefinementRequest):
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Script refinement failed: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Script refinement failed: {str(e)}")
+
+@router.post("/generate-storyboard/stream")
+async def generate_storyboard_stream(request: StoryboardGenerationRequest):
+    """Stream storyboard panels over SSE as soon as each panel object is complete"""
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not configured")
+
+    logger.info(f"Streaming storyboard for template: {request.templateType}")
+    payload = build_storyboard_payload(request)
+
+    async def events():
+        parser = PanelStreamParser()
+        text = []
+        index = 0
+        try:
+            async for chunk in stream_api(TEXT_STREAM_URL, payload, timeout=TEXT_TIMEOUT):
+                fragment = chunk_text(chunk)
+                text.append(fragment)
+                for panel in parser.feed(fragment):
+                    yield sse_event("panel", {"index": index, "panel": panel})
+                    index += 1
+
+            json_text = "".join(text)
+            if not json_text:
+                raise HTTPException(status_code=500, detail="AI returned an empty response")
+            yield sse_event("done", {"panels": json.loads(json_text)})
+
+        except HTTPException as e:
+            yield sse_event("error", {"status": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logger.error(f"Storyboard streaming failed: {e}")
+            yield sse_event("error", {"status": 500, "detail": f"Storyboard generation failed: {str(e)}"})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.post("/refine-script/stream")
+async def refine_script_stream(request: ScriptRefinementRequest):
+    """Stream the refined script over SSE token by token"""
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not configured")
+
+    if not request.natural_language.strip():
+        raise HTTPException(status_code=400, detail="Natural language description is required")
+
+    logger.info(f"Streaming script refinement: {request.natural_language[:50]}...")
+    payload = build_refinement_payload(request)
+
+    async def events():
+        text = []
+        try:
+            async for chunk in stream_api(TEXT_STREAM_URL, payload, timeout=TEXT_TIMEOUT):
+                fragment = chunk_text(chunk)
+                if fragment:
+                    text.append(fragment)
+                    yield sse_event("token", {"text": fragment})
+
+            refined_script = "".join(text)
+            if not refined_script:
+                raise HTTPException(status_code=500, detail="AI returned an empty script")
+            yield sse_event("done", {"refined_script": refined_script})
+
+        except HTTPException as e:
+            yield sse_event("error", {"status": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logger.error(f"Script refinement streaming failed: {e}")
+            yield sse_event("error", {"status": 500, "detail": f"Script refinement failed: {str(e)}"})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Background job kinds (see api/jobs.py)
+job_queue.register("generate-storyboard", StoryboardGenerationRequest, generate_storyboard)
+job_queue.register("analyze-story", StoryAnalysisRequest, analyze_story)
+job_queue.register("refine-script", ScriptRefinementRequest, refine_script)
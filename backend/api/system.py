@@ -0,0 +1,83 @@
+"""
+System and diagnostics API endpoints
+"""
+
+from fastapi import APIRouter, HTTPException
+import asyncio
+import logging
+from metrics import TimedRoute
+from prompt_manager import prompt_manager
+from rate_limiter import upstream_scheduler
+from response_cache import response_cache
+from context_cache import context_cache
+from narration_cache import narration_cache
+from session_store import session_store
+from single_flight import single_flight
+
+router = APIRouter(prefix="/api", tags=["system"], route_class=TimedRoute)
+logger = logging.getLogger(__name__)
+
+# API Endpoints
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """Hit/miss counters and occupancy of the upstream response cache"""
+    return await response_cache.get_stats()
+
+@router.delete("/cache")
+async def clear_cache():
+    """Drop every cached upstream response"""
+    await response_cache.clear()
+    logger.info("Response cache cleared")
+    return {"status": "cleared"}
+
+@router.get("/context-cache/stats")
+async def get_context_cache_stats():
+    """Upstream cached-content handles: hits, creations, refreshes and inline fallbacks"""
+    return context_cache.get_stats()
+
+@router.delete("/context-cache")
+async def clear_context_cache():
+    """Delete every cached context upstream; later calls inline them until they are cached again"""
+    await context_cache.clear()
+    logger.info("Context cache cleared")
+    return {"status": "cleared"}
+
+@router.get("/upstream/stats")
+async def get_upstream_stats():
+    """Queue depth, in-flight calls and throttling per upstream model"""
+    return upstream_scheduler.get_stats()
+
+@router.get("/single-flight/stats")
+async def get_single_flight_stats():
+    """How many duplicate generation requests were served by an already in-flight call"""
+    return single_flight.get_stats()
+
+@router.get("/narration-cache/stats")
+async def get_narration_cache_stats():
+    """Hits and misses of the on-disk narration cache"""
+    return narration_cache.get_stats()
+
+@router.get("/style-sessions/stats")
+async def get_style_session_stats():
+    """Size and configuration of the style session store"""
+    return await session_store.get_stats()
+
+@router.get("/prompts")
+async def get_prompt_registry():
+    """Active revision of every prompt template"""
+    return prompt_manager.get_registry_info()
+
+@router.get("/prompts/{template_name}/versions")
+async def get_prompt_versions(template_name: str):
+    """Retained revisions of a prompt template, addressable by hash"""
+    versions = prompt_manager.list_versions(template_name)
+    if not versions:
+        raise HTTPException(status_code=404, detail=f"Template '{template_name}' not found")
+    return {"name": template_name, "versions": versions}
+
+@router.post("/prompts/reload")
+async def reload_prompts():
+    """Reload prompt templates changed on disk now instead of waiting for the watcher"""
+    changed = await asyncio.to_thread(prompt_manager.reload_changed)
+    logger.info(f"Prompt reload requested, {len(changed)} template(s) changed")
+    return {"changed": changed, "templates": prompt_manager.revisions}
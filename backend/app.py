@@ -1,29 +1,73 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 
+from gemini_client import gemini_client
+from context_cache import context_cache
+from job_queue import job_queue
+from image_processing import shutdown_executor
+from prompt_manager import prompt_manager
+from response_cache import CacheControlMiddleware
+from metrics import MetricsMiddleware
+from request_limits import BodySizeLimitMiddleware
+from fast_json import response_class
+
 # Import modular routers
 from api.images import router as images_router
 from api.storyboards import router as storyboards_router
 from api.audio import router as audio_router
+from api.blobs import router as blobs_router
+from api.system import router as system_router
+from api.jobs import router as jobs_router
+from api.export import router as export_router
+from api.metrics import router as metrics_router
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Share one pooled upstream client across all routers
+    gemini_client.start()
+    # Pick up edited prompt YAML without restarting workers
+    prompt_manager.start_watcher()
+    # Resume jobs interrupted by the last shutdown and start the job workers
+    job_queue.start()
+    yield
+    await job_queue.stop()
+    await prompt_manager.stop_watcher()
+    # Stop paying for cached contexts nobody will use
+    await context_cache.clear()
+    await gemini_client.close()
+    shutdown_executor()
+
+
 app = FastAPI(
     title="Akaza Backend",
     version="1.0.0",
     description="Professional AI-powered storyboarding application",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    # ORJSONResponse when FAST_JSON is enabled
+    default_response_class=response_class(),
+    lifespan=lifespan
 )
 
 # Include modular routers
 app.include_router(images_router)
 app.include_router(storyboards_router)
 app.include_router(audio_router)
+app.include_router(blobs_router)
+app.include_router(system_router)
+app.include_router(jobs_router)
+app.include_router(export_router)
+app.include_router(metrics_router)
 
+# Innermost, so oversized requests are refused before routing but still get CORS headers
+app.add_middleware(BodySizeLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -31,6 +75,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CacheControlMiddleware)
+# Added last so it is outermost and times the whole middleware stack
+app.add_middleware(MetricsMiddleware)
 
 
 @app.get("/")
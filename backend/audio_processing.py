@@ -0,0 +1,173 @@
+"""
+Audio helpers for narration: WAV framing of Gemini's raw PCM and optional
+on-the-fly compression through ffmpeg
+
+Gemini TTS returns 16-bit little-endian mono PCM. WAV output is framed
+without copying the PCM; Opus and MP3 are produced by piping the PCM
+through an ffmpeg subprocess while it streams, when ffmpeg is installed.
+"""
+
+import asyncio
+import logging
+import shutil
+import struct
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_RATE = 24000
+NUM_CHANNELS = 1
+BITS_PER_SAMPLE = 16
+
+# Output format -> (mime type, ffmpeg encoder arguments); WAV needs no encoder
+AUDIO_FORMATS: Dict[str, Tuple[str, Optional[List[str]]]] = {
+    "wav": ("audio/wav", None),
+    "opus": ("audio/ogg", ["-c:a", "libopus", "-b:a", "32k", "-f", "ogg"]),
+    "mp3": ("audio/mpeg", ["-c:a", "libmp3lame", "-b:a", "64k", "-f", "mp3"]),
+}
+
+# Data size used in a streamed WAV header, when the total length is not known yet
+_UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+def sample_rate_from_mime(mime_type: Optional[str], default: int = DEFAULT_SAMPLE_RATE) -> int:
+    """Read the rate parameter of a mime type such as audio/L16;codec=pcm;rate=24000"""
+    if mime_type and "rate=" in mime_type:
+        try:
+            return int(mime_type.split("rate=")[1].split(";")[0])
+        except ValueError:
+            pass
+    return default
+
+
+def wav_header(sample_rate: int = DEFAULT_SAMPLE_RATE, data_size: Optional[int] = None) -> bytes:
+    """RIFF/WAVE header for 16-bit mono PCM.
+
+    Without a data size the header declares the maximum length, which
+    players treat as "read until the stream ends".
+    """
+    byte_rate = sample_rate * NUM_CHANNELS * BITS_PER_SAMPLE // 8
+    block_align = NUM_CHANNELS * BITS_PER_SAMPLE // 8
+    riff_size = _UNKNOWN_SIZE if data_size is None else 36 + data_size
+
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+                       b'RIFF',
+                       riff_size,
+                       b'WAVE',
+                       b'fmt ',
+                       16,
+                       1,
+                       NUM_CHANNELS,
+                       sample_rate,
+                       byte_rate,
+                       block_align,
+                       BITS_PER_SAMPLE,
+                       b'data',
+                       _UNKNOWN_SIZE if data_size is None else data_size)
+
+
+def wav_chunks(pcm_data: bytes, sample_rate: int = DEFAULT_SAMPLE_RATE) -> Iterator[bytes]:
+    """Yield a complete WAV file as its header followed by the PCM itself, without concatenating them"""
+    yield wav_header(sample_rate, len(pcm_data))
+    yield pcm_data
+
+
+def _wav_chunk(wav_data: bytes, wanted_id: bytes) -> memoryview:
+    view = memoryview(wav_data)
+    offset = 12
+    while offset + 8 <= len(view):
+        chunk_id, chunk_size = struct.unpack_from('<4sI', view, offset)
+        if chunk_id == wanted_id:
+            return view[offset + 8:offset + 8 + chunk_size]
+        offset += 8 + chunk_size + (chunk_size & 1)
+    raise ValueError(f"WAV file has no {wanted_id.decode().strip()} chunk")
+
+
+def wav_pcm(wav_data: bytes) -> memoryview:
+    """The PCM samples of a WAV file, without copying them"""
+    return _wav_chunk(wav_data, b'data')
+
+
+def wav_sample_rate(wav_data: bytes) -> int:
+    """Sample rate declared in a WAV file's fmt chunk"""
+    return struct.unpack_from('<I', _wav_chunk(wav_data, b'fmt '), 4)[0]
+
+
+def concatenate_wavs(tracks: List[bytes],
+                    sample_rate: int = DEFAULT_SAMPLE_RATE,
+                    pause_seconds: float = 0.0) -> Tuple[bytes, List[Tuple[float, float]]]:
+    """Join WAV tracks into one WAV file with silence between them.
+
+    Returns the file and the (start, end) time in seconds of each track.
+    """
+    bytes_per_second = sample_rate * NUM_CHANNELS * BITS_PER_SAMPLE // 8
+    block_align = NUM_CHANNELS * BITS_PER_SAMPLE // 8
+    pause = bytes(int(pause_seconds * sample_rate) * block_align)
+
+    pieces, timecodes, position = [], [], 0
+    for index, track in enumerate(tracks):
+        if index and pause:
+            pieces.append(pause)
+            position += len(pause)
+        pcm = wav_pcm(track)
+        pieces.append(pcm)
+        timecodes.append((position / bytes_per_second, (position + len(pcm)) / bytes_per_second))
+        position += len(pcm)
+
+    return b"".join([wav_header(sample_rate, position), *pieces]), timecodes
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+def supported_audio_formats() -> List[str]:
+    """Output formats available on this host"""
+    return [name for name, (_, encoder) in AUDIO_FORMATS.items() if encoder is None or ffmpeg_available()]
+
+
+async def ffmpeg_pipe(arguments: List[str], input_chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Run ffmpeg with input_chunks fed to its stdin, yielding its stdout as ffmpeg produces it"""
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-hide_banner", "-loglevel", "error", *arguments,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+
+    async def feed():
+        try:
+            async for chunk in input_chunks:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        finally:
+            process.stdin.close()
+
+    feeder = asyncio.create_task(feed())
+    try:
+        while True:
+            output = await process.stdout.read(64 * 1024)
+            if not output:
+                break
+            yield output
+        # Surface errors from the input source (e.g. the upstream stream failing)
+        await feeder
+        if await process.wait() != 0:
+            logger.error(f"ffmpeg exited with status {process.returncode}")
+    finally:
+        if not feeder.done():
+            feeder.cancel()
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+
+
+def encode_pcm_stream(pcm_chunks: AsyncIterator[bytes],
+                      output_format: str,
+                      sample_rate: int = DEFAULT_SAMPLE_RATE) -> AsyncIterator[bytes]:
+    """Compress a stream of PCM chunks with ffmpeg, yielding encoded bytes as ffmpeg produces them"""
+    _, encoder = AUDIO_FORMATS[output_format]
+    return ffmpeg_pipe(
+        ["-f", "s16le", "-ar", str(sample_rate), "-ac", str(NUM_CHANNELS), "-i", "pipe:0", *encoder, "pipe:1"],
+        pcm_chunks
+    )
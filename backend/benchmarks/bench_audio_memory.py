@@ -0,0 +1,112 @@
+"""
+Peak memory of narration synthesis for long texts
+
+    python -m benchmarks.bench_audio_memory --chars 1000 5000 20000
+
+Runs the Gemini stub in a subprocess (its audio length grows with the text)
+and measures, with tracemalloc, the peak Python memory this process holds
+while producing and draining one narration response:
+
+- legacy: the previous path (decode, concatenate header + PCM, BytesIO)
+- buffered: /api/generate-audio today (PCM sent after the header, no copy)
+- streaming: /api/generate-audio/stream (PCM chunks forwarded as they arrive)
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import httpx
+
+PORT = 8794
+os.environ["GEMINI_API_BASE"] = f"http://127.0.0.1:{PORT}/v1beta"
+os.environ.setdefault("GEMINI_API_KEY", "stub")
+
+from api.audio import (  # noqa: E402
+    AudioGenerationRequest, TTS_API_URL, TTS_TIMEOUT, inline_audio, stream_pcm, streamed_wav, synthesize_pcm, tts_payload
+)
+from audio_processing import sample_rate_from_mime, wav_chunks, wav_header  # noqa: E402
+from gemini_client import call_api, gemini_client  # noqa: E402
+
+
+async def legacy(text: str):
+    """The previous implementation, which held several full copies of the audio"""
+    result = await call_api(TTS_API_URL, tts_payload(text), timeout=TTS_TIMEOUT)
+    audio_data, mime_type = inline_audio(result)
+    pcm_data = base64.b64decode(audio_data)
+    wav_data = wav_header(sample_rate_from_mime(mime_type), len(pcm_data)) + pcm_data
+    body = io.BytesIO(wav_data)
+    while body.read(64 * 1024):
+        pass
+
+
+async def buffered(text: str):
+    pcm_data, sample_rate = await synthesize_pcm(AudioGenerationRequest(text=text))
+    for _ in wav_chunks(pcm_data, sample_rate):
+        pass
+
+
+async def streaming(text: str):
+    sample_rate, pcm_chunks = await stream_pcm(text)
+    async for _ in streamed_wav(sample_rate, pcm_chunks):
+        pass
+
+
+async def peak_mb(fn, text: str) -> float:
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    await fn(text)
+    _, peak = tracemalloc.get_traced_memory()
+    return (peak - baseline) / 1024 / 1024
+
+
+def start_stub() -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.gemini_stub", "--port", str(PORT), "--latency-ms", "5"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{PORT}/docs", timeout=0.5)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Gemini stub did not start")
+
+
+async def main(args):
+    gemini_client.start()
+    tracemalloc.start()
+
+    print(f"{'chars':>7} {'audio (s)':>10} {'PCM (MB)':>9} {'legacy':>9} {'buffered':>9} {'streaming':>10}   peak MB")
+    for chars in args.chars:
+        text = ("The lighthouse keeper climbs the stairs one last time. " * (chars // 55 + 1))[:chars]
+        seconds = max(1.0, chars / 15)
+        pcm_mb = seconds * 24000 * 2 / 1024 / 1024
+        results = [await peak_mb(fn, text) for fn in (legacy, buffered, streaming)]
+        print(f"{chars:>7} {seconds:>10.0f} {pcm_mb:>9.1f} " + " ".join(f"{mb:>9.1f}" for mb in results[:2])
+              + f" {results[2]:>10.1f}")
+
+    tracemalloc.stop()
+    await gemini_client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chars", type=int, nargs="+", default=[1000, 5000, 20000],
+                        help="Narration lengths to synthesise; the stub speaks 15 characters per second")
+    args = parser.parse_args()
+
+    stub = start_stub()
+    try:
+        asyncio.run(main(args))
+    finally:
+        stub.terminate()
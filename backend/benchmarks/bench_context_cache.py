@@ -0,0 +1,121 @@
+"""
+Upstream bytes for a storyboard with and without Gemini context caching
+
+    python -m benchmarks.bench_context_cache --panels 20
+
+Renders a board's worth of image calls against the Gemini stub, each panel
+sending its own prompt plus the board's shared context (a normalised style
+reference and two asset images). Compares, per run, the bytes POSTed to
+generateContent and to cachedContents, caches created, cache hits, inline
+fallbacks and wall time:
+
+- off: CONTEXT_CACHE_ENABLED=false, every panel inlines the context
+- on: the context is cached from its second use and referenced by name
+- evicted: as on, with every upstream cache dropped halfway through the
+  board (as if it had expired), so the next panel falls back to inline
+  data and the cache is re-created
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import os
+import socket
+import time
+from typing import Any, Dict, Tuple
+
+import httpx
+from PIL import Image, ImageFilter
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+STUB_PORT = free_port()
+os.environ["GEMINI_API_BASE"] = f"http://127.0.0.1:{STUB_PORT}/v1beta"
+os.environ.setdefault("GEMINI_API_KEY", "stub")
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "false")
+os.environ.setdefault("METRICS_ENABLED", "false")
+
+from benchmarks import gemini_stub  # noqa: E402
+from context_cache import ContextCache  # noqa: E402
+from gemini_client import gemini_client, model_url  # noqa: E402
+
+KB = 1024
+IMAGE_URL = model_url("gemini-2.5-flash-image-preview")
+
+
+def image_part(size: Tuple[int, int]) -> Dict[str, Any]:
+    image = Image.effect_noise(size, 40).convert("RGB").filter(ImageFilter.GaussianBlur(1.5))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return {"inlineData": {"mimeType": "image/jpeg", "data": base64.b64encode(buffer.getvalue()).decode("ascii")}}
+
+
+async def run_board(cache: ContextCache, context: Dict[str, Any], panels: int, evict_at: int = 0) -> Dict[str, Any]:
+    stub = f"http://127.0.0.1:{STUB_PORT}/stub"
+    async with httpx.AsyncClient() as client:
+        before = (await client.get(f"{stub}/stats")).json()
+        start = time.perf_counter()
+        for panel in range(panels):
+            if evict_at and panel == evict_at:
+                await client.delete(f"{stub}/caches")
+            payload = {
+                "contents": [{"parts": [{"text": f"Style: Film noir. Panel {panel}: the keeper climbs the stairs."}]}],
+                "generationConfig": {"responseModalities": ["IMAGE"]}
+            }
+            await cache.call(IMAGE_URL, payload, context, owner="bench-board")
+        elapsed = time.perf_counter() - start
+        after = (await client.get(f"{stub}/stats")).json()
+    await cache.clear()
+    return {
+        "sent_kb": (after["request_bytes"] - before["request_bytes"]) / KB,
+        "cache_kb": (after["cache_request_bytes"] - before["cache_request_bytes"]) / KB,
+        "creates": after["cache_creates"] - before["cache_creates"],
+        "hits": cache.stats["hits"],
+        "fallbacks": cache.stats["fallbacks"],
+        "cached_tokens": cache.stats["cached_tokens"],
+        "seconds": elapsed,
+    }
+
+
+async def run(args):
+    context = {"contents": [{"role": "user", "parts": [
+        image_part((1536, 864)), image_part((1024, 1024)), image_part((1024, 1024))
+    ]}]}
+    runs = [
+        ("off", ContextCache(enabled=False), 0),
+        ("on", ContextCache(enabled=True), 0),
+        ("evicted", ContextCache(enabled=True), args.panels // 2),
+    ]
+    print(f"{args.panels} panels, shared context {len(str(context)) / KB:.0f}KB, "
+          f"stub latency {args.latency_ms:.0f}ms\n")
+    print(f"{'run':<8} {'generateContent KB':>19} {'cachedContents KB':>18} {'creates':>8} {'hits':>5} "
+          f"{'fallbacks':>10} {'cached tokens':>14} {'seconds':>8}")
+    for label, cache, evict_at in runs:
+        result = await run_board(cache, context, args.panels, evict_at)
+        print(f"{label:<8} {result['sent_kb']:>19.0f} {result['cache_kb']:>18.0f} {result['creates']:>8} "
+              f"{result['hits']:>5} {result['fallbacks']:>10} {result['cached_tokens']:>14} {result['seconds']:>8.2f}")
+    await gemini_client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    gemini_stub.STUB_LATENCY_MS = args.latency_ms
+    server = gemini_stub.serve_in_thread(STUB_PORT)
+    try:
+        asyncio.run(run(args))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Panel crop latency per source format, with and without the fast path
+
+    python -m benchmarks.bench_crop --repeat 20
+
+Times crop_image_to_16_9 (the stored panel alone) and crop_with_derivatives
+(panel plus preview and thumbnail, what /api/generate-image runs) on
+generated-looking sources, first with IMAGE_CROP_FAST_PATH off (always
+decode, crop and re-encode) and then on (pass-through when already 16:9,
+lossless jpegtran crop for JPEGs when jpegtran is installed).
+"""
+
+import argparse
+import io
+import statistics
+import time
+from typing import Callable, List, Tuple
+
+from PIL import Image, ImageFilter
+
+import image_processing
+from image_processing import crop_image_to_16_9, crop_with_derivatives, jpegtran_available
+
+# (label, size, source PIL format, output format)
+CASES: List[Tuple[str, Tuple[int, int], str, str]] = [
+    ("jpeg 16:9", (1344, 768), "JPEG", "jpeg"),
+    ("jpeg 1:1", (1024, 1024), "JPEG", "jpeg"),
+    ("webp 16:9", (1344, 768), "WEBP", "webp"),
+    ("png 16:9", (1344, 768), "PNG", "jpeg"),
+    ("png 1:1", (1024, 1024), "PNG", "jpeg"),
+]
+
+
+def make_image(size: Tuple[int, int], image_format: str) -> bytes:
+    # Softened noise compresses more like a rendered frame than raw noise does
+    image = Image.effect_noise(size, 64).convert("RGB").filter(ImageFilter.GaussianBlur(1.5))
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=92)
+    return buffer.getvalue()
+
+
+def median_ms(fn: Callable[[], object], repeat: int) -> float:
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"jpegtran: {'available' if jpegtran_available() else 'not installed (JPEG crops are re-encoded)'}\n")
+    print(f"{'source':<10} {'output':<6} {'panel ms':>9} {'fast':>7} {'with derivatives ms':>20} {'fast':>7}")
+    for label, size, source_format, output_format in CASES:
+        data = make_image(size, source_format)
+        results = []
+        for fast in (False, True):
+            image_processing.CROP_FAST_PATH = fast
+            results.append((
+                median_ms(lambda: crop_image_to_16_9(data, output_format), args.repeat),
+                median_ms(lambda: crop_with_derivatives(data, output_format), args.repeat),
+            ))
+        (panel, derivatives), (fast_panel, fast_derivatives) = results
+        print(f"{label:<10} {output_format:<6} {panel:>9.1f} {fast_panel:>7.1f} {derivatives:>20.1f} {fast_derivatives:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark per-request httpx clients against the shared pooled Gemini client
+
+    python -m benchmarks.bench_gemini_client --requests 500 --concurrency 20
+
+Both modes hit the local Gemini stub; reports p50/p99 latency and requests/sec.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from benchmarks.gemini_stub import serve_in_thread
+from gemini_client import GeminiClient
+
+PAYLOAD = {"contents": [{"parts": [{"text": "benchmark"}]}]}
+
+
+async def legacy_call(url: str) -> dict:
+    """The pre-pool behaviour: a brand-new client per request"""
+    async with httpx.AsyncClient() as client:
+        response = await client.post(url, headers={"Content-Type": "application/json"}, json=PAYLOAD, timeout=60.0)
+        return response.json()
+
+
+async def run(call, url: str, total: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await call(url)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "rps": total / elapsed
+    }
+
+
+async def main(args):
+    url = f"http://127.0.0.1:{args.port}/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key=stub"
+
+    pooled = GeminiClient(http2=False)
+    pooled.start()
+
+    async def pooled_call(target: str) -> dict:
+        response = await pooled.post(target, PAYLOAD)
+        return response.json()
+
+    results = {
+        "per-request client": await run(legacy_call, url, args.requests, args.concurrency),
+        "pooled client": await run(pooled_call, url, args.requests, args.concurrency)
+    }
+    await pooled.close()
+
+    print(f"{'mode':<20} {'p50 (ms)':>10} {'p99 (ms)':>10} {'req/s':>10}")
+    for mode, stats in results.items():
+        print(f"{mode:<20} {stats['p50_ms']:>10.1f} {stats['p99_ms']:>10.1f} {stats['rps']:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    serve_in_thread(args.port)
+    asyncio.run(main(args))
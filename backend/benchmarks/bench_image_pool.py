@@ -0,0 +1,87 @@
+"""
+Event-loop latency and throughput of panel post-processing, inline vs worker pool
+
+    python -m benchmarks.bench_image_pool --requests 32 --concurrency 8
+
+A heartbeat task measures how late the event loop wakes up while concurrent
+requests crop and re-encode generated images, first directly on the loop
+(the old behaviour) and then through image_processing.run_in_pool.
+"""
+
+import argparse
+import asyncio
+import io
+import statistics
+import time
+
+from PIL import Image
+
+import image_processing
+from image_processing import crop_image_to_16_9, run_in_pool
+
+HEARTBEAT_INTERVAL = 0.005
+
+
+def make_image(size: int, image_format: str) -> bytes:
+    image = Image.effect_noise((size, size), 64).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+async def heartbeat(lags: list, stop: asyncio.Event):
+    """Record how far past its deadline each wake-up happens"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        lags.append(time.perf_counter() - start - HEARTBEAT_INTERVAL)
+
+
+async def run(mode: str, data: bytes, total: int, concurrency: int, max_width) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    lags = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(heartbeat(lags, stop))
+
+    async def one():
+        async with semaphore:
+            if mode == "inline":
+                crop_image_to_16_9(data, "jpeg", max_width)
+            else:
+                await run_in_pool(crop_image_to_16_9, data, "jpeg", max_width)
+            # Yield like a real handler would between requests
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+
+    lags.sort()
+    return {
+        "images_per_s": total / elapsed,
+        "lag_p50_ms": statistics.median(lags) * 1000 if lags else 0.0,
+        "lag_max_ms": lags[-1] * 1000 if lags else 0.0
+    }
+
+
+async def main(args):
+    print(f"{'input':<14} {'mode':<8} {'images/s':>10} {'loop lag p50':>14} {'loop lag max':>14}")
+    for image_format in ("PNG", "JPEG"):
+        data = make_image(args.size, image_format)
+        for mode in ("inline", "pool"):
+            stats = await run(mode, data, args.requests, args.concurrency, args.max_width)
+            label = f"{image_format} {args.size}px"
+            print(f"{label:<14} {mode:<8} {stats['images_per_s']:>10.1f} "
+                  f"{stats['lag_p50_ms']:>12.1f}ms {stats['lag_max_ms']:>12.1f}ms")
+    image_processing.shutdown_executor()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--size", type=int, default=1536)
+    parser.add_argument("--max-width", type=int, default=None)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,122 @@
+"""
+JSON encoding and decoding cost of realistic image and audio payloads
+
+    python -m benchmarks.bench_json --repeat 10
+
+Compares the stdlib json module with orjson (the FAST_JSON path) on the
+payloads that dominate our traffic, reporting median CPU time per call and
+peak RSS growth during one call (Linux /proc; tracemalloc misreports
+orjson's buffer growth). The benchmark re-executes itself with glibc's mmap
+threshold pinned, so freed buffers leave RSS and each peak is per call:
+
+- upstream request: a generateContent payload with three inline reference images
+- image response: a generateContent response carrying one inline image
+- audio response: a TTS response carrying 30 seconds of 24kHz PCM
+- client request: a /api/generate-image body with four base64 assets
+"""
+
+import argparse
+import base64
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MB = 1024 * 1024
+
+CODECS: Dict[str, Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]] = {
+    "stdlib": (lambda value: json.dumps(value, ensure_ascii=False).encode("utf-8"), json.loads),
+}
+if orjson is not None:
+    CODECS["orjson"] = (lambda value: orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS), orjson.loads)
+
+
+def b64(size: int) -> str:
+    return base64.b64encode(os.urandom(size)).decode("ascii")
+
+
+def inline_response(mime_type: str, size: int) -> Dict[str, Any]:
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"inlineData": {"mimeType": mime_type, "data": b64(size)}}]},
+                        "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {"promptTokenCount": 1290, "candidatesTokenCount": 1290, "totalTokenCount": 2580}
+    }
+
+
+def payloads() -> Dict[str, Any]:
+    return {
+        "upstream request": {
+            "contents": [{"parts": [{"text": "Style: Cinematic Realism. A lighthouse keeper climbs the stairs. " * 8}]
+                          + [{"inlineData": {"mimeType": "image/jpeg", "data": b64(3 * MB)}} for _ in range(3)]}],
+            "generationConfig": {"responseModalities": ["IMAGE"]}
+        },
+        "image response": inline_response("image/png", 2 * MB),
+        "audio response": inline_response("audio/L16;codec=pcm;rate=24000", 30 * 24000 * 2),
+        "client request": {
+            "prompt": "A lighthouse keeper climbs the stairs",
+            "assetImages": [{"base64": b64(2 * MB), "mimeType": "image/jpeg"} for _ in range(4)],
+            "maintainConsistency": True, "projectStyleId": "bench"
+        },
+    }
+
+
+def peak_growth_mb(fn: Callable[[], Any]) -> Optional[float]:
+    """RSS high-water mark growth while fn runs, by resetting the kernel's counter first"""
+    status = Path("/proc/self/status")
+    try:
+        gc.collect()
+        Path("/proc/self/clear_refs").write_text("5")
+        before = next(int(line.split()[1]) for line in status.read_text().splitlines() if line.startswith("VmHWM"))
+        result = fn()
+        after = next(int(line.split()[1]) for line in status.read_text().splitlines() if line.startswith("VmHWM"))
+    except OSError:
+        return None
+    del result
+    return (after - before) / 1024
+
+
+def cpu_ms(fn: Callable[[], Any], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        times.append(time.process_time() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    if "MALLOC_MMAP_THRESHOLD_" not in os.environ:
+        os.environ["MALLOC_MMAP_THRESHOLD_"] = str(128 * 1024)
+        os.execv(sys.executable, [sys.executable, "-m", "benchmarks.bench_json", *sys.argv[1:]])
+
+    if orjson is None:
+        print("orjson is not installed; only the stdlib is measured")
+
+    print(f"{'payload':<18} {'MB':>6} {'codec':<7} {'encode ms':>10} {'peak MB':>8} {'decode ms':>10} {'peak MB':>8}")
+    for name, value in payloads().items():
+        size = len(CODECS["stdlib"][0](value)) / MB
+        for codec, (encode, decode) in CODECS.items():
+            encoded = encode(value)
+            encode_peak, decode_peak = peak_growth_mb(lambda: encode(value)), peak_growth_mb(lambda: decode(encoded))
+            print(f"{name:<18} {size:>6.1f} {codec:<7} {cpu_ms(lambda: encode(value), args.repeat):>10.1f} "
+                  f"{encode_peak if encode_peak is not None else float('nan'):>8.1f} "
+                  f"{cpu_ms(lambda: decode(encoded), args.repeat):>10.1f} "
+                  f"{decode_peak if decode_peak is not None else float('nan'):>8.1f}")
+            del encoded
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Per-request cost of the metrics instrumentation
+
+    python -m benchmarks.bench_metrics --requests 5000
+
+Serves a trivial JSON endpoint in-process (through httpx's ASGI transport,
+so no sockets are involved) with and without MetricsMiddleware and
+TimedRoute, and times the raw stage observation that prompt rendering,
+upstream calls and image processing pay.
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import APIRouter, FastAPI
+from pydantic import BaseModel
+
+from metrics import MetricsMiddleware, TimedRoute, observe_stage
+
+
+class EchoRequest(BaseModel):
+    prompt: str
+    count: int = 1
+
+
+def build_app(instrumented: bool) -> FastAPI:
+    app = FastAPI()
+    router = APIRouter(prefix="/api", route_class=TimedRoute) if instrumented else APIRouter(prefix="/api")
+
+    @router.post("/echo")
+    async def echo(request: EchoRequest):
+        return {"prompt": request.prompt, "count": request.count}
+
+    app.include_router(router)
+    if instrumented:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+async def per_request_us(app: FastAPI, requests: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        body = {"prompt": "A lighthouse at dusk", "count": 3}
+        for _ in range(200):
+            await client.post("/api/echo", json=body)
+        start = time.perf_counter()
+        for _ in range(requests):
+            await client.post("/api/echo", json=body)
+        return (time.perf_counter() - start) / requests * 1e6
+
+
+async def main(args):
+    # Alternate runs so drift in machine load affects both sides equally
+    plain, instrumented = [], []
+    for _ in range(args.rounds):
+        plain.append(await per_request_us(build_app(False), args.requests))
+        instrumented.append(await per_request_us(build_app(True), args.requests))
+    plain_us, instrumented_us = min(plain), min(instrumented)
+    print(f"{'plain':>14}: {plain_us:8.1f} us/request")
+    print(f"{'instrumented':>14}: {instrumented_us:8.1f} us/request "
+          f"(+{instrumented_us - plain_us:.1f} us, {(instrumented_us / plain_us - 1) * 100:+.1f}%)")
+
+    iterations = 100_000
+    start = time.perf_counter()
+    for _ in range(iterations):
+        observe_stage("prompt_render", 0.0001)
+    print(f"{'observe_stage':>14}: {(time.perf_counter() - start) / iterations * 1e6:8.2f} us/call")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--rounds", type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
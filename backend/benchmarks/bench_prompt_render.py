@@ -0,0 +1,82 @@
+"""
+Prompt template render throughput per YAML in prompts/
+
+    python -m benchmarks.bench_prompt_render --seconds 1
+
+Compares re-parsing the Jinja source on every call (the previous
+behaviour) with rendering the templates compiled once at load. Both paths
+render the template body and the system prompt, as a request would.
+"""
+
+import argparse
+import time
+from typing import Any, Callable, Dict
+
+from prompt_manager import PromptManager
+
+SAMPLE_VALUES: Dict[str, Any] = {
+    "string": "A lighthouse keeper discovers the lamp has been signalling to ships that sank a century ago.",
+    "integer": 8,
+    "boolean": True,
+    "object": {
+        "shot_type": "Wide Shot",
+        "camera_angle": "Low Angle",
+        "camera_movement": "Slow Push In",
+        "lighting": "Golden Hour"
+    },
+}
+
+
+def sample_variables(manager: PromptManager, template_name: str) -> Dict[str, Any]:
+    """Plausible values for every declared variable of a template"""
+    return {
+        var_def["name"]: SAMPLE_VALUES.get(var_def.get("type"), "sample")
+        for var_def in manager.get_variable_definitions(template_name)
+    }
+
+
+def legacy_render(manager: PromptManager, template_name: str, variables: Dict[str, Any]):
+    """Render the way PromptManager did before templates were compiled at load"""
+    template_data = manager.get_template(template_name)
+    for var_def in template_data.get("variables", []):
+        if var_def.get("required", False) and var_def["name"] not in variables:
+            raise ValueError(var_def["name"])
+        if var_def["name"] not in variables and var_def.get("default") is not None:
+            variables[var_def["name"]] = var_def["default"]
+    manager.jinja_env.from_string(template_data.get("template", "")).render(**variables)
+    system_prompt = template_data.get("system_prompt", "")
+    if system_prompt:
+        manager.jinja_env.from_string(system_prompt).render(**variables)
+
+
+def compiled_render(manager: PromptManager, template_name: str, variables: Dict[str, Any]):
+    manager.render_template(template_name, variables)
+    manager.get_system_prompt(template_name, variables)
+
+
+def renders_per_second(render: Callable, manager: PromptManager, template_name: str, seconds: float) -> float:
+    variables = sample_variables(manager, template_name)
+    count = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        render(manager, template_name, dict(variables))
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main(args):
+    manager = PromptManager(args.prompts_dir)
+
+    print(f"{'template':<28} {'from_string/s':>14} {'compiled/s':>12} {'speedup':>8}")
+    for template_name in sorted(manager.list_templates()):
+        legacy = renders_per_second(legacy_render, manager, template_name, args.seconds)
+        compiled = renders_per_second(compiled_render, manager, template_name, args.seconds)
+        print(f"{template_name:<28} {legacy:>14,.0f} {compiled:>12,.0f} {compiled / legacy:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--prompts-dir", default="prompts")
+    parser.add_argument("--seconds", type=float, default=1.0, help="Time spent rendering each template per path")
+    main(parser.parse_args())
@@ -0,0 +1,99 @@
+"""
+Burst of upstream calls against a rate-limited stub, with and without the scheduler
+
+    python -m benchmarks.bench_rate_limiter --requests 200 --stub-rps 20 --spike-rate 0.05
+
+The stub answers 429 (with Retry-After) once a model exceeds --stub-rps and
+occasionally stalls for --spike-ms. Unscheduled calls go straight to the
+stub, the way call_api used to; scheduled calls go through the per-model
+budget with retries. Reports how many requests failed for the user, how
+many 429s the stub issued, latency percentiles and the peak queue depth.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks import gemini_stub
+from benchmarks.gemini_stub import serve_in_thread
+from fast_json import dumps
+from gemini_client import gemini_client, post_with_retries
+from rate_limiter import upstream_scheduler
+
+PAYLOAD = {"contents": [{"parts": [{"text": "benchmark"}]}]}
+
+
+async def burst(call, total: int) -> dict:
+    """Fire every request at once, the way several users generating boards would"""
+    latencies, failures = [], 0
+    throttled_before = gemini_stub.stats["throttled"]
+
+    async def one():
+        nonlocal failures
+        start = time.perf_counter()
+        response = await call()
+        latencies.append(time.perf_counter() - start)
+        if not response.is_success:
+            failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "failed": failures,
+        "upstream_429s": gemini_stub.stats["throttled"] - throttled_before,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "elapsed_s": elapsed
+    }
+
+
+async def main(args):
+    url = f"http://127.0.0.1:{args.port}/v1beta/models/bench-model:generateContent?key=stub"
+    budget = upstream_scheduler.register(url, args.concurrency, args.rpm)
+    gemini_client.start()
+
+    peak_queue = 0
+
+    async def watch_queue():
+        nonlocal peak_queue
+        while True:
+            peak_queue = max(peak_queue, budget.queued)
+            await asyncio.sleep(0.005)
+
+    results = {"unscheduled": await burst(lambda: gemini_client.post(url, dumps(PAYLOAD)), args.requests)}
+    # Let the stub's one-second quota window drain between runs
+    await asyncio.sleep(1.5)
+    watcher = asyncio.create_task(watch_queue())
+    results["scheduled"] = await burst(lambda: post_with_retries(url, PAYLOAD), args.requests)
+    watcher.cancel()
+    await gemini_client.close()
+
+    print(f"{args.requests} requests, stub quota {args.stub_rps:g}/s, "
+          f"budget {args.concurrency} in flight / {args.rpm:g} rpm")
+    print(f"{'mode':<14} {'failed':>7} {'429s':>6} {'p50 (ms)':>10} {'p99 (ms)':>10} {'total (s)':>10}")
+    for mode, stats in results.items():
+        print(f"{mode:<14} {stats['failed']:>7} {stats['upstream_429s']:>6} {stats['p50_ms']:>10.0f} "
+              f"{stats['p99_ms']:>10.0f} {stats['elapsed_s']:>10.1f}")
+    print(f"peak queue depth: {peak_queue}, retries: {budget.retries}, spikes: {gemini_stub.stats['spikes']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8, help="Scheduler in-flight cap")
+    parser.add_argument("--rpm", type=float, default=1080, help="Scheduler requests per minute (0 = no rate limit)")
+    parser.add_argument("--stub-rps", type=float, default=20, help="Stub quota per second before it returns 429")
+    parser.add_argument("--spike-rate", type=float, default=0.05)
+    parser.add_argument("--spike-ms", type=float, default=1000)
+    args = parser.parse_args()
+
+    gemini_stub.STUB_RATE_LIMIT_RPS = args.stub_rps
+    gemini_stub.STUB_SPIKE_RATE = args.spike_rate
+    gemini_stub.STUB_SPIKE_MS = args.spike_ms
+    serve_in_thread(args.port)
+    asyncio.run(main(args))
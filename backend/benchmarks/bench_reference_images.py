@@ -0,0 +1,108 @@
+"""
+Reference image normalisation across a storyboard
+
+    python -m benchmarks.bench_reference_images --panels 20
+
+Simulates one asset reused by every panel of a storyboard, for a few
+typical uploads (a 12MP PNG, a 12MP phone JPEG, a 1024px PNG with
+transparency). For each, reports the bytes sent upstream per panel with
+REFERENCE_NORMALISE off and on, the time to prepare the first panel's
+reference (decode, downscale, encode, store) and the median for the
+panels after it (decoding the request's base64, hashing it and reading the
+cached variant), and how many normalisations ran when
+all panels asked for the asset at once.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import os
+import statistics
+import tempfile
+import time
+from typing import Tuple
+
+from PIL import Image, ImageDraw, ImageFilter
+
+os.environ.setdefault("BLOB_STORE_DIR", tempfile.mkdtemp(prefix="bench-blobs-"))
+
+import reference_images  # noqa: E402
+from reference_images import prepare_reference, reference_variant  # noqa: E402
+from blob_store import blob_store  # noqa: E402
+from single_flight import single_flight  # noqa: E402
+
+KB = 1024
+
+
+def make_upload(size: Tuple[int, int], image_format: str, alpha: bool = False) -> bytes:
+    # Blurred noise with a few shapes compresses roughly like a photo or illustration
+    image = Image.effect_noise((size[0] // 4, size[1] // 4), 40).convert("RGB").resize(size, Image.BILINEAR)
+    draw = ImageDraw.Draw(image)
+    for i in range(6):
+        draw.ellipse([i * size[0] // 7, size[1] // 4, (i + 2) * size[0] // 7, size[1] * 3 // 4],
+                     fill=(40 * i, 255 - 40 * i, 128))
+    image = image.filter(ImageFilter.GaussianBlur(1))
+    if alpha:
+        image.putalpha(255)
+        ImageDraw.Draw(image).rectangle([0, 0, size[0] // 3, size[1]], fill=(0, 0, 0, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=95)
+    return buffer.getvalue()
+
+
+async def prepare_panels(data: bytes, mime_type: str, panels: int):
+    first_start = time.perf_counter()
+    sent, _, _ = await prepare_reference(base64.b64decode(base64.b64encode(data)), mime_type)
+    first_ms = (time.perf_counter() - first_start) * 1000
+    times = []
+    for _ in range(panels - 1):
+        start = time.perf_counter()
+        await prepare_reference(base64.b64decode(base64.b64encode(data)), mime_type)
+        times.append(time.perf_counter() - start)
+    return len(sent), first_ms, statistics.median(times) * 1000 if times else 0.0
+
+
+def forget(data: bytes):
+    digest = hashlib.sha256(data).hexdigest()
+    path = blob_store.path(digest, reference_variant())
+    for stale in (path, path.with_name(path.name + ".mime")):
+        stale.unlink(missing_ok=True)
+
+
+async def concurrent_normalisations(data: bytes, mime_type: str, panels: int) -> int:
+    forget(data)
+    before = single_flight.stats.get("reference-images", {}).get("calls", 0) - \
+        single_flight.stats.get("reference-images", {}).get("coalesced", 0)
+    await asyncio.gather(*(prepare_reference(data, mime_type) for _ in range(panels)))
+    stats = single_flight.stats["reference-images"]
+    return stats["calls"] - stats["coalesced"] - before
+
+
+async def run(panels: int):
+    cases = [
+        ("12MP png", make_upload((4032, 3024), "PNG"), "image/png"),
+        ("12MP jpeg", make_upload((4032, 3024), "JPEG"), "image/jpeg"),
+        ("1024px png+alpha", make_upload((1024, 1024), "PNG", alpha=True), "image/png"),
+    ]
+    print(f"{panels} panels, max edge {reference_images.REFERENCE_MAX_EDGE}, {reference_images.REFERENCE_FORMAT} "
+          f"q{reference_images.REFERENCE_QUALITY}\n")
+    print(f"{'upload':<17} {'original KB':>12} {'sent KB':>8} {'first ms':>9} {'cached ms':>10} "
+          f"{'storyboard MB off':>18} {'on':>6} {'concurrent runs':>16}")
+    for label, data, mime_type in cases:
+        sent, first_ms, cached_ms = await prepare_panels(data, mime_type, panels)
+        runs = await concurrent_normalisations(data, mime_type, panels)
+        print(f"{label:<17} {len(data) / KB:>12.0f} {sent / KB:>8.0f} {first_ms:>9.1f} {cached_ms:>10.1f} "
+              f"{len(data) * panels / KB / KB:>18.1f} {sent * panels / KB / KB:>6.1f} {runs:>16}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.panels))
+
+
+if __name__ == "__main__":
+    main()
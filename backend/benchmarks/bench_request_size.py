@@ -0,0 +1,114 @@
+"""
+Peak memory of large /api/generate-image requests
+
+    python -m benchmarks.bench_request_size --mb 40
+
+Sends requests through the full middleware stack in-process (Gemini stub in
+a subprocess) and measures, with tracemalloc, the peak Python memory held
+while each one is served:
+
+- assets: a body of --mb MB split across four assetImages (accepted)
+- one field: the same size as a single styleImageBase64 (over the per-field limit)
+- over route limit: a body above IMAGE_REQUEST_MAX_BYTES with a Content-Length
+- chunked: --mb MB streamed without a Content-Length to a small-body route
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import httpx
+
+PORT = 8795
+os.environ["GEMINI_API_BASE"] = f"http://127.0.0.1:{PORT}/v1beta"
+os.environ.setdefault("GEMINI_API_KEY", "stub")
+os.environ.setdefault("BLOB_STORE_DIR", tempfile.mkdtemp(prefix="akaza-bench-blobs-"))
+
+from app import app  # noqa: E402
+from gemini_client import gemini_client  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def image_request(mb: float, assets: int) -> bytes:
+    field = "A" * int(mb * MB / max(assets, 1))
+    body = {"prompt": "A lighthouse at dusk", "maintainConsistency": False}
+    if assets:
+        body["assetImages"] = [{"base64": field, "mimeType": "image/jpeg"} for _ in range(assets)]
+    else:
+        body.update(styleImageBase64=field, styleImageMimeType="image/jpeg")
+    return json.dumps(body).encode("utf-8")
+
+
+async def chunks(mb: float):
+    chunk = b" " * MB
+    yield b'{"script": "'
+    for _ in range(int(mb)):
+        yield chunk
+    yield b'"}'
+
+
+async def measure(client: httpx.AsyncClient, path: str, content) -> tuple:
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    response = await client.post(path, content=content, headers={"Content-Type": "application/json"})
+    _, peak = tracemalloc.get_traced_memory()
+    return response.status_code, (peak - baseline) / MB
+
+
+def start_stub() -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.gemini_stub", "--port", str(PORT), "--latency-ms", "5",
+         "--image-size", "512", "--image-format", "jpeg"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{PORT}/docs", timeout=0.5)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Gemini stub did not start")
+
+
+async def main(args):
+    gemini_client.start()
+    transport = httpx.ASGITransport(app=app)
+    cases = [
+        ("assets", "/api/generate-image", image_request(args.mb, 4)),
+        ("one field", "/api/generate-image", image_request(args.mb, 0)),
+        ("over route limit", "/api/generate-image", image_request(args.over_mb, 4)),
+        ("chunked", "/api/generate-storyboard", None),
+    ]
+
+    tracemalloc.start()
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        print(f"{'case':<18} {'body MB':>8} {'status':>6} {'peak MB':>8}")
+        for name, path, body in cases:
+            size = len(body) / MB if body is not None else args.mb
+            status, peak = await measure(client, path, body if body is not None else chunks(args.mb))
+            print(f"{name:<18} {size:>8.1f} {status:>6} {peak:>8.1f}")
+            del body
+    tracemalloc.stop()
+    await gemini_client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=float, default=40, help="Body size for the accepted and per-field cases")
+    parser.add_argument("--over-mb", type=float, default=50, help="Body size for the over-limit case")
+    args = parser.parse_args()
+
+    stub = start_stub()
+    try:
+        asyncio.run(main(args))
+    finally:
+        stub.terminate()
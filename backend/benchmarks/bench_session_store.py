@@ -0,0 +1,85 @@
+"""
+Memory footprint of style session storage over many sessions
+
+    python -m benchmarks.bench_session_store --sessions 10000 --panels 8
+
+Compares the old unbounded dict holding cropped data URLs with the bounded
+in-memory LRU and the SQLite store, both of which hold digests only. The
+legacy dict is measured on a sample and extrapolated, since storing every
+data URL for 10k sessions would not fit in memory.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import os
+import tempfile
+import tracemalloc
+
+from session_store import MemorySessionStore, SQLiteSessionStore, new_session
+
+
+def legacy_footprint(sessions: int, panels: int, image_kb: int) -> int:
+    """Bytes held by the previous process-local dict of data URLs"""
+    style_sessions = {}
+    image = base64.b64encode(os.urandom(image_kb * 1024)).decode("ascii")
+
+    tracemalloc.start()
+    for i in range(sessions):
+        style_sessions[f"project_{i}"] = {
+            "base_style": "Cinematic Realism",
+            "style_image": None,
+            "generated_images": [
+                # Each data URL was a fresh string built per generation
+                {"prompt": f"Panel {p}", "image_url": "data:image/jpeg;base64," + image}
+                for p in range(panels)
+            ],
+            "style_keywords": [],
+            "consistency_prompt": ""
+        }
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current
+
+
+async def store_footprint(store, sessions: int, panels: int) -> int:
+    """Bytes held by a session store after filling it with digest-only sessions"""
+    tracemalloc.start()
+    for i in range(sessions):
+        session_id = f"project_{i}"
+        await store.get_or_create(session_id, new_session("Cinematic Realism"))
+        for p in range(panels):
+            digest = hashlib.sha256(f"{session_id}-{p}".encode()).hexdigest()
+            await store.append_image(session_id, {"prompt": f"Panel {p}", "digest": digest})
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current
+
+
+async def main(args):
+    sample = min(args.sessions, args.legacy_sample)
+    legacy = legacy_footprint(sample, args.panels, args.image_kb) * args.sessions / sample
+
+    memory_store = MemorySessionStore(max_entries=args.max_entries)
+    memory = await store_footprint(memory_store, args.sessions, args.panels)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite_store = SQLiteSessionStore(path=os.path.join(tmp, "sessions.db"))
+        sqlite = await store_footprint(sqlite_store, args.sessions, args.panels)
+
+    print(f"{args.sessions} sessions x {args.panels} panels")
+    print(f"{'store':<32} {'footprint (MB)':>15}")
+    print(f"{'legacy dict (extrapolated)':<32} {legacy / 1024 / 1024:>15.1f}")
+    print(f"{f'memory LRU (cap {args.max_entries})':<32} {memory / 1024 / 1024:>15.1f}")
+    print(f"{'sqlite':<32} {sqlite / 1024 / 1024:>15.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--panels", type=int, default=8)
+    parser.add_argument("--image-kb", type=int, default=300, help="Size of each cropped JPEG in the legacy dict")
+    parser.add_argument("--legacy-sample", type=int, default=50)
+    parser.add_argument("--max-entries", type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
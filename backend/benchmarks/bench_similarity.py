@@ -0,0 +1,92 @@
+"""
+Similarity lookups over large style sessions
+
+    python -m benchmarks.bench_similarity --panels 200 1000 5000 20000
+
+Builds sessions of random panel descriptors and times a top-5 query plus a
+near-duplicate scan on a built SimilarityIndex (as session_indexes keeps
+it between generations), against the same scoring done panel by panel in
+pure Python, and separately the cost of building the index from the
+session's packed descriptors after a panel is added. Also reports the cost
+of computing one descriptor from a thumbnail.
+"""
+
+import argparse
+import io
+import os
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+
+from PIL import Image, ImageFilter
+
+import similarity_index
+from similarity_index import DESCRIPTOR_BYTES, HASH_BITS, HISTOGRAM_BINS, SimilarityIndex, image_descriptor
+
+
+def random_images(panels: int) -> List[Dict[str, Any]]:
+    return [{"digest": f"{i:064x}", "descriptor": os.urandom(DESCRIPTOR_BYTES).hex()} for i in range(panels)]
+
+
+def as_session(images: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """The same panels stored the way a session keeps them"""
+    return {"generated_images": [], "descriptors": {
+        "digests": [image["digest"] for image in images],
+        "packed": "".join(image["descriptor"] for image in images)
+    }}
+
+
+def python_lookup(images: List[Dict[str, Any]], descriptor: str, k: int):
+    """Scoring panel by panel, as a loop over the stored entries would"""
+    query = bytes.fromhex(descriptor)
+    query_hash = int.from_bytes(query[HISTOGRAM_BINS:], "big")
+    weight = similarity_index.SIMILARITY_HISTOGRAM_WEIGHT
+    scored = []
+    for image in images:
+        stored = bytes.fromhex(image["descriptor"])
+        histogram = sum(min(a, b) for a, b in zip(stored[:HISTOGRAM_BINS], query[:HISTOGRAM_BINS])) / 255
+        distance = bin(int.from_bytes(stored[HISTOGRAM_BINS:], "big") ^ query_hash).count("1")
+        scored.append((weight * histogram + (1 - weight) * (1 - distance / HASH_BITS), distance, image["digest"]))
+    duplicates = [entry for entry in scored if entry[1] <= similarity_index.SIMILARITY_DUPLICATE_DISTANCE]
+    return sorted(scored, reverse=True)[:k], duplicates
+
+
+def vectorised_lookup(index: SimilarityIndex, descriptor: str, k: int):
+    return index.top_k(descriptor, k), index.duplicates(descriptor)
+
+
+def median_ms(fn: Callable[[], object], repeat: int) -> float:
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, nargs="+", default=[200, 1000, 5000, 20000])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    thumb = io.BytesIO()
+    Image.effect_noise((320, 180), 48).convert("RGB").filter(ImageFilter.GaussianBlur(2)).save(thumb, "JPEG")
+    print(f"descriptor from a 320px thumbnail: {median_ms(lambda: image_descriptor(thumb.getvalue()), args.repeat):.2f} ms\n")
+
+    print(f"{'panels':>7} {'python ms':>10} {'numpy ms':>9} {'build ms':>9} {'speedup':>8}")
+    for panels in args.panels:
+        images = random_images(panels)
+        session = as_session(images)
+        index = SimilarityIndex.from_session(session)
+        query = os.urandom(DESCRIPTOR_BYTES).hex()
+        python_ms = median_ms(lambda: python_lookup(images, query, args.k), max(1, args.repeat // 5))
+        numpy_ms = median_ms(lambda: vectorised_lookup(index, query, args.k), args.repeat)
+        build_ms = median_ms(lambda: SimilarityIndex.from_session(session), args.repeat)
+        print(f"{panels:>7} {python_ms:>10.2f} {numpy_ms:>9.2f} {build_ms:>9.2f} {python_ms / numpy_ms:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Worker cold-start cost of the backend
+
+    python -m benchmarks.bench_startup --runs 5
+
+Reports the slowest imports of `app` from `python -X importtime`, which
+heavy optional dependencies end up imported at startup, and the
+time-to-first-request of a fresh uvicorn process serving `app:app`.
+"""
+
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+HEAVY_MODULES = ["langchain", "langchain_core", "PIL", "numpy"]
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def import_times(runs: int):
+    """Total import time of app and the cumulative time of each top-level import"""
+    totals = []
+    modules = {}
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import app"],
+            capture_output=True, text=True, env={**os.environ, "PROMPT_RELOAD_INTERVAL": "0"}
+        )
+        for line in result.stderr.splitlines():
+            match = _IMPORTTIME_LINE.match(line)
+            if not match:
+                continue
+            cumulative, indent, module = int(match.group(2)), len(match.group(3)), match.group(4)
+            if module == "app":
+                totals.append(cumulative / 1000)
+            elif indent <= 3:
+                modules.setdefault(module, []).append(cumulative / 1000)
+    return totals, {module: statistics.median(times) for module, times in modules.items()}
+
+
+def loaded_heavy_modules():
+    code = f"import sys, app; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    return [module for module in result.stdout.strip().split(",") if module]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_request(timeout: float = 30.0) -> float:
+    """Seconds from spawning uvicorn until GET / answers"""
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/", timeout=0.5).status_code == 200:
+                    return time.perf_counter() - start
+            except httpx.TransportError:
+                time.sleep(0.01)
+        raise RuntimeError("Server did not answer before the timeout")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(args):
+    totals, modules = import_times(args.runs)
+    print(f"import app: median {statistics.median(totals):.0f}ms over {args.runs} runs")
+    print(f"\n{'slowest top-level imports':<40} {'ms':>8}")
+    for module, ms in sorted(modules.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{module:<40} {ms:>8.1f}")
+
+    heavy = loaded_heavy_modules()
+    print(f"\nheavy modules loaded at startup: {', '.join(heavy) or 'none'}")
+
+    first_request = [time_to_first_request() for _ in range(args.runs)]
+    print(f"time to first request: median {statistics.median(first_request) * 1000:.0f}ms, "
+          f"max {max(first_request) * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=12, help="How many of the slowest imports to list")
+    main(parser.parse_args())
@@ -0,0 +1,316 @@
+"""
+Local stub of the Gemini generateContent and cachedContents APIs for offline benchmarking
+
+Run standalone with:
+    python -m benchmarks.gemini_stub --port 8790 --latency-ms 50
+
+and point the backend at it with GEMINI_API_BASE=http://127.0.0.1:8790/v1beta
+"""
+
+import argparse
+import asyncio
+import base64
+import functools
+import io
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from PIL import Image
+import uvicorn
+
+# Stub behaviour (overridable via CLI flags or environment)
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "50"))
+STUB_IMAGE_SIZE = int(os.getenv("STUB_IMAGE_SIZE", "1024"))
+# png (large, lossless noise) or jpeg (a typical photographic payload)
+STUB_IMAGE_FORMAT = os.getenv("STUB_IMAGE_FORMAT", "png")
+# Panels in JSON text responses, which sets the size of storyboard payloads
+STUB_TEXT_PANELS = int(os.getenv("STUB_TEXT_PANELS", "8"))
+# Requests per second each model accepts before answering 429 (0 = unlimited)
+STUB_RATE_LIMIT_RPS = float(os.getenv("STUB_RATE_LIMIT_RPS", "0"))
+# Fraction of requests answered 429 regardless of load
+STUB_THROTTLE_RATE = float(os.getenv("STUB_THROTTLE_RATE", "0"))
+STUB_RETRY_AFTER = os.getenv("STUB_RETRY_AFTER", "1")
+# Fraction of requests failing with STUB_ERROR_STATUS (a transient server error by default)
+STUB_ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+STUB_ERROR_STATUS = int(os.getenv("STUB_ERROR_STATUS", "503"))
+# Fraction of requests that take STUB_SPIKE_MS instead of STUB_LATENCY_MS
+STUB_SPIKE_RATE = float(os.getenv("STUB_SPIKE_RATE", "0"))
+STUB_SPIKE_MS = float(os.getenv("STUB_SPIKE_MS", "2000"))
+# Synthesised speech length: characters of text per second of audio
+STUB_SPEECH_CHARS_PER_SECOND = float(os.getenv("STUB_SPEECH_CHARS_PER_SECOND", "15"))
+STUB_SAMPLE_RATE = 24000
+# Smallest context cachedContents accepts, in (estimated) tokens
+STUB_CACHE_MIN_TOKENS = int(os.getenv("STUB_CACHE_MIN_TOKENS", "1024"))
+
+app = FastAPI(title="Gemini Stub")
+
+# Per-model sliding one-second windows of accepted request times
+_accepted = {}
+# Live cached contents by name
+_caches = {}
+stats = {"requests": 0, "throttled": 0, "errors": 0, "spikes": 0, "request_bytes": 0,
+         "cache_creates": 0, "cache_refused": 0, "cache_request_bytes": 0, "cache_hits": 0, "cache_misses": 0}
+
+
+def _throttled(model: str) -> bool:
+    """Whether this request exceeds the stub's simulated quota"""
+    if STUB_THROTTLE_RATE and random.random() < STUB_THROTTLE_RATE:
+        return True
+    if not STUB_RATE_LIMIT_RPS:
+        return False
+    now = time.monotonic()
+    window = [t for t in _accepted.get(model, []) if now - t < 1.0]
+    if len(window) >= STUB_RATE_LIMIT_RPS:
+        _accepted[model] = window
+        return True
+    window.append(now)
+    _accepted[model] = window
+    return False
+
+
+def _latency() -> float:
+    if STUB_SPIKE_RATE and random.random() < STUB_SPIKE_RATE:
+        stats["spikes"] += 1
+        return STUB_SPIKE_MS / 1000
+    return STUB_LATENCY_MS / 1000
+
+
+@functools.lru_cache(maxsize=4)
+def _stub_image(size: int, image_format: str = "png") -> str:
+    """A square noise image, so the backend has to crop it to 16:9"""
+    image = Image.effect_noise((size, size), 64).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format.upper())
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def _inline_part(mime_type: str, data: str) -> dict:
+    return {"inlineData": {"mimeType": mime_type, "data": data}}
+
+
+def build_response(model: str, payload: dict) -> dict:
+    """Build a canned response shaped like the real API for the given model"""
+    modalities = payload.get("generationConfig", {}).get("responseModalities", [])
+    if "IMAGE" in modalities:
+        part = _inline_part(f"image/{STUB_IMAGE_FORMAT}", _stub_image(STUB_IMAGE_SIZE, STUB_IMAGE_FORMAT))
+    elif "AUDIO" in modalities or model.endswith("-tts"):
+        text = "".join(p.get("text", "") for c in payload.get("contents", []) for p in c.get("parts", []))
+        seconds = max(1.0, len(text) / STUB_SPEECH_CHARS_PER_SECOND)
+        pcm = bytes(int(seconds * STUB_SAMPLE_RATE) * 2)
+        part = _inline_part(f"audio/L16;codec=pcm;rate={STUB_SAMPLE_RATE}", base64.b64encode(pcm).decode("ascii"))
+    elif payload.get("generationConfig", {}).get("responseMimeType") == "application/json":
+        panels = [{"prompt": f"Shot {i + 1}: a wide shot", "audio": f"Narration {i + 1}"} for i in range(STUB_TEXT_PANELS)]
+        part = {"text": json.dumps(panels)}
+    else:
+        part = {"text": "stub response"}
+    return {"candidates": [{"content": {"parts": [part]}}]}
+
+
+async def stream_response(response: dict, chunk_chars: int = 64):
+    """Re-emit a text response as SSE chunks, the way streamGenerateContent does"""
+    part = response["candidates"][0]["content"]["parts"][0]
+    text = part.get("text")
+    if text is None and part.get("inlineData", {}).get("mimeType", "").startswith("audio/"):
+        # One second of audio per chunk; 48000 bytes is a whole number of base64 groups
+        data, mime_type = part["inlineData"]["data"], part["inlineData"]["mimeType"]
+        chunk_chars = STUB_SAMPLE_RATE * 2 // 3 * 4
+        for start in range(0, len(data), chunk_chars):
+            await asyncio.sleep(STUB_LATENCY_MS / 1000 / 10)
+            chunk = {"candidates": [{"content": {"parts": [_inline_part(mime_type, data[start:start + chunk_chars])]}}]}
+            yield f"data: {json.dumps(chunk)}\r\n\r\n"
+        return
+    if text is None:
+        yield f"data: {json.dumps(response)}\r\n\r\n"
+        return
+    for start in range(0, len(text), chunk_chars):
+        await asyncio.sleep(STUB_LATENCY_MS / 1000 / 10)
+        chunk = {"candidates": [{"content": {"parts": [{"text": text[start:start + chunk_chars]}]}}]}
+        yield f"data: {json.dumps(chunk)}\r\n\r\n"
+
+
+def _error(status: int, message: str, reason: str) -> JSONResponse:
+    return JSONResponse(status_code=status, content={"error": {"code": status, "message": message, "status": reason}})
+
+
+def _timestamp(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _context_tokens(body: dict) -> int:
+    """Tokens of a cached context: ~4 characters per text token, 258 per 768px image tile"""
+    parts = list(body.get("systemInstruction", {}).get("parts", []))
+    parts += [part for content in body.get("contents", []) for part in content.get("parts", [])]
+    tokens = 0
+    for part in parts:
+        if "text" in part:
+            tokens += len(part["text"]) // 4
+        elif "inlineData" in part:
+            width, height = Image.open(io.BytesIO(base64.b64decode(part["inlineData"]["data"]))).size
+            tokens += 258 * math.ceil(width / 768) * math.ceil(height / 768)
+    return tokens
+
+
+def _live_cache(name: str):
+    cache = _caches.get(name)
+    if cache is not None and cache["expires_at"] <= time.time():
+        del _caches[name]
+        cache = None
+    return cache
+
+
+def _cache_view(name: str, cache: dict) -> dict:
+    return {"name": name, "model": cache["model"], "displayName": cache["displayName"],
+            "createTime": _timestamp(cache["created_at"]), "updateTime": _timestamp(cache["updated_at"]),
+            "expireTime": _timestamp(cache["expires_at"]), "usageMetadata": {"totalTokenCount": cache["tokens"]}}
+
+
+@app.post("/v1beta/cachedContents")
+async def create_cached_content(request: Request):
+    raw = await request.body()
+    body = json.loads(raw)
+    stats["cache_creates"] += 1
+    stats["cache_request_bytes"] += len(raw)
+    tokens = _context_tokens(body)
+    if tokens < STUB_CACHE_MIN_TOKENS:
+        stats["cache_refused"] += 1
+        return _error(400, f"Cached content is too small. total_token_count={tokens}, "
+                           f"min_total_token_count={STUB_CACHE_MIN_TOKENS}", "INVALID_ARGUMENT")
+    now = time.time()
+    name = f"cachedContents/{uuid.uuid4().hex[:16]}"
+    _caches[name] = {"model": body.get("model"), "displayName": body.get("displayName", ""), "tokens": tokens,
+                     "created_at": now, "updated_at": now, "expires_at": now + float(body.get("ttl", "3600s").rstrip("s"))}
+    return _cache_view(name, _caches[name])
+
+
+@app.get("/v1beta/cachedContents/{cache_id}")
+async def get_cached_content(cache_id: str):
+    name = f"cachedContents/{cache_id}"
+    cache = _live_cache(name)
+    if cache is None:
+        return _error(403, "CachedContent not found (or permission denied)", "PERMISSION_DENIED")
+    return _cache_view(name, cache)
+
+
+@app.patch("/v1beta/cachedContents/{cache_id}")
+async def update_cached_content(cache_id: str, request: Request):
+    name = f"cachedContents/{cache_id}"
+    cache = _live_cache(name)
+    if cache is None:
+        return _error(403, "CachedContent not found (or permission denied)", "PERMISSION_DENIED")
+    body = await request.json()
+    cache["updated_at"] = time.time()
+    cache["expires_at"] = cache["updated_at"] + float(body.get("ttl", "3600s").rstrip("s"))
+    return _cache_view(name, cache)
+
+
+@app.delete("/v1beta/cachedContents/{cache_id}")
+async def delete_cached_content(cache_id: str):
+    if _caches.pop(f"cachedContents/{cache_id}", None) is None:
+        return _error(404, "CachedContent not found", "NOT_FOUND")
+    return {}
+
+
+@app.delete("/stub/caches")
+async def evict_caches():
+    """Drop every cached content, as if they had all expired"""
+    evicted = len(_caches)
+    _caches.clear()
+    return {"evicted": evicted}
+
+
+@app.post("/v1beta/models/{model_call}")
+async def generate_content(model_call: str, request: Request):
+    model, _, method = model_call.partition(":")
+    body = await request.body()
+    payload = json.loads(body)
+    stats["requests"] += 1
+    stats["request_bytes"] += len(body)
+    cached_tokens = 0
+    if payload.get("cachedContent"):
+        if "systemInstruction" in payload:
+            return _error(400, "CachedContent can not be used with GenerateContent request setting "
+                               "system_instruction, tools or tool_config.", "INVALID_ARGUMENT")
+        cache = _live_cache(payload["cachedContent"])
+        if cache is None:
+            stats["cache_misses"] += 1
+            return _error(403, "CachedContent not found (or permission denied)", "PERMISSION_DENIED")
+        stats["cache_hits"] += 1
+        cached_tokens = cache["tokens"]
+    if _throttled(model):
+        stats["throttled"] += 1
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).",
+                               "status": "RESOURCE_EXHAUSTED"}},
+            headers={"Retry-After": STUB_RETRY_AFTER} if STUB_RETRY_AFTER else None
+        )
+    await asyncio.sleep(_latency())
+    if STUB_ERROR_RATE and random.random() < STUB_ERROR_RATE:
+        stats["errors"] += 1
+        return JSONResponse(
+            status_code=STUB_ERROR_STATUS,
+            content={"error": {"code": STUB_ERROR_STATUS, "message": "The service is currently unavailable.",
+                               "status": "UNAVAILABLE"}}
+        )
+    response = build_response(model, payload)
+    if cached_tokens:
+        response["usageMetadata"] = {"cachedContentTokenCount": cached_tokens}
+    if method == "streamGenerateContent":
+        return StreamingResponse(stream_response(response), media_type="text/event-stream")
+    return response
+
+
+@app.get("/stub/stats")
+async def get_stub_stats():
+    """Requests the stub has seen, for checking what a benchmark sent upstream"""
+    return stats
+
+
+def serve_in_thread(port: int) -> uvicorn.Server:
+    """Start the stub on a background thread and wait until it accepts requests"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gemini API stub server")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--latency-ms", type=float, default=STUB_LATENCY_MS)
+    parser.add_argument("--image-size", type=int, default=STUB_IMAGE_SIZE)
+    parser.add_argument("--image-format", choices=["png", "jpeg"], default=STUB_IMAGE_FORMAT)
+    parser.add_argument("--text-panels", type=int, default=STUB_TEXT_PANELS)
+    parser.add_argument("--rate-limit-rps", type=float, default=STUB_RATE_LIMIT_RPS)
+    parser.add_argument("--throttle-rate", type=float, default=STUB_THROTTLE_RATE)
+    parser.add_argument("--retry-after", default=STUB_RETRY_AFTER)
+    parser.add_argument("--error-rate", type=float, default=STUB_ERROR_RATE)
+    parser.add_argument("--error-status", type=int, default=STUB_ERROR_STATUS)
+    parser.add_argument("--spike-rate", type=float, default=STUB_SPIKE_RATE)
+    parser.add_argument("--spike-ms", type=float, default=STUB_SPIKE_MS)
+    parser.add_argument("--cache-min-tokens", type=int, default=STUB_CACHE_MIN_TOKENS)
+    args = parser.parse_args()
+
+    STUB_LATENCY_MS = args.latency_ms
+    STUB_IMAGE_SIZE = args.image_size
+    STUB_IMAGE_FORMAT = args.image_format
+    STUB_TEXT_PANELS = args.text_panels
+    STUB_RATE_LIMIT_RPS = args.rate_limit_rps
+    STUB_THROTTLE_RATE = args.throttle_rate
+    STUB_RETRY_AFTER = args.retry_after
+    STUB_ERROR_RATE = args.error_rate
+    STUB_ERROR_STATUS = args.error_status
+    STUB_SPIKE_RATE = args.spike_rate
+    STUB_SPIKE_MS = args.spike_ms
+    STUB_CACHE_MIN_TOKENS = args.cache_min_tokens
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,383 @@
+"""
+Load test every backend route against the Gemini stub
+
+    python -m benchmarks.run_suite --requests 50 --concurrency 8
+    python -m benchmarks.run_suite --routes generate-image export --json results.json
+    python -m benchmarks.run_suite --stub-latency-ms 200 --stub-error-rate 0.05
+
+Starts the Gemini stub and the backend (uvicorn, one worker) as local
+subprocesses, with blobs, jobs and caches in a temporary directory, then
+drives each route in turn at the given concurrency. Reports throughput,
+latency percentiles, non-2xx responses and the backend's resident memory
+(current and peak during the route), and lists any route of the app that
+no scenario covers. Everything runs on localhost; no network is needed.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+from PIL import Image
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+SCRIPT = (
+    "INT. LIGHTHOUSE - NIGHT. The keeper climbs the spiral stairs as the storm hits. "
+    "He finds the lamp signalling to a ship that sank a century ago."
+)
+
+
+class Scenario:
+    """One route to drive; `build(i)` returns the path and request options for the i-th request"""
+
+    def __init__(self, method: str, route: str, build: Optional[Callable[[int], Dict[str, Any]]] = None,
+                 path: Optional[str] = None):
+        self.method = method
+        self.route = route
+        self.path = path or route
+        self._build = build
+
+    @property
+    def name(self) -> str:
+        return f"{self.method} {self.route}"
+
+    def build(self, i: int) -> Dict[str, Any]:
+        return self._build(i) if self._build else {}
+
+
+def json_body(factory: Callable[[int], Any]) -> Callable[[int], Dict[str, Any]]:
+    return lambda i: {"json": factory(i)}
+
+
+def panels(i: int, count: int = 3) -> List[Dict[str, str]]:
+    return [{"prompt": f"Shot {k + 1} of take {i}: the keeper on the stairs", "audio": f"Narration {i}-{k}"}
+            for k in range(count)]
+
+
+def sample_jpeg(size: Tuple[int, int] = (1280, 720)) -> bytes:
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 48).convert("RGB").save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+async def prepare_fixtures(client: httpx.AsyncClient) -> Dict[str, Any]:
+    """Create the blobs, style session and finished job that GET/DELETE scenarios point at"""
+    image = sample_jpeg()
+    blob = (await client.post("/api/blobs", content=image, headers={"Content-Type": "image/jpeg"})).json()
+
+    await client.post("/api/create-style-session", json={"projectId": "bench-fixture"})
+
+    job = (await client.post("/api/jobs", json={"kind": "generate-storyboard", "payload": {"script": SCRIPT}})).json()
+    for _ in range(600):
+        if (await client.get(f"/api/jobs/{job['id']}")).json()["status"] in ("succeeded", "failed", "cancelled"):
+            break
+        await asyncio.sleep(0.1)
+
+    templates = sorted((await client.get("/api/prompts")).json()["templates"])
+    return {"image": image, "digest": blob["digest"], "job_id": job["id"], "template": templates[0]}
+
+
+def build_scenarios(fixtures: Dict[str, Any]) -> List[Scenario]:
+    digest, job_id = fixtures["digest"], fixtures["job_id"]
+    return [
+        Scenario("GET", "/"),
+
+        # Images
+        Scenario("POST", "/api/generate-image", json_body(
+            lambda i: {"prompt": f"A lighthouse at dusk, take {i}", "projectStyleId": "bench-fixture", "referenceCount": 2,
+                       "styleImageDigest": digest, "assetImages": [{"digest": digest, "mimeType": "image/jpeg"}]}
+        )),
+        Scenario("POST", "/api/generate-storyboard-images", json_body(lambda i: {"panels": panels(i)})),
+        Scenario("POST", "/api/generate-suggestions", json_body(lambda i: {"prompt": f"A lighthouse at dusk, take {i}"})),
+        Scenario("POST", "/api/generate-style", json_body(lambda i: {"style": f"Film noir, variation {i}"})),
+        Scenario("POST", "/api/analyze-style", json_body(lambda i: {"image_digest": digest, "mime_type": "image/jpeg"})),
+        Scenario("POST", "/api/create-style-session", json_body(lambda i: {"projectId": f"bench-{i}"})),
+        Scenario("GET", "/api/style-session/{project_id}", path="/api/style-session/bench-fixture"),
+        Scenario("POST", "/api/style-session/{project_id}/similar",
+                 lambda i: {"path": "/api/style-session/bench-fixture/similar", "json": {"imageUrl": digest}}),
+        Scenario("DELETE", "/api/style-session/{project_id}",
+                 lambda i: {"path": f"/api/style-session/bench-{i}"}),
+
+        # Storyboards
+        Scenario("POST", "/api/generate-storyboard", json_body(lambda i: {"script": f"{SCRIPT} Take {i}."})),
+        Scenario("POST", "/api/generate-storyboard/stream", json_body(lambda i: {"script": f"{SCRIPT} Take {i}."})),
+        Scenario("POST", "/api/analyze-story", json_body(lambda i: {"panels": panels(i)})),
+        Scenario("POST", "/api/refine-script", json_body(lambda i: {"natural_language": f"{SCRIPT} Take {i}."})),
+        Scenario("POST", "/api/refine-script/stream", json_body(lambda i: {"natural_language": f"{SCRIPT} Take {i}."})),
+
+        # Audio
+        Scenario("POST", "/api/generate-audio", json_body(lambda i: {"text": f"The storm rolls in, take {i}."})),
+        Scenario("POST", "/api/generate-audio/stream", json_body(lambda i: {"text": f"The storm rolls in, take {i}."})),
+        Scenario("POST", "/api/generate-narration",
+                 json_body(lambda i: {"panels": [{"text": f"Line {k} of take {i}."} for k in range(3)]})),
+
+        # Blobs
+        Scenario("POST", "/api/blobs", lambda i: {"content": fixtures["image"], "headers": {"Content-Type": "image/jpeg"}}),
+        Scenario("GET", "/api/blobs/{digest}", path=f"/api/blobs/{digest}"),
+        Scenario("GET", "/api/blobs/{digest}/{variant}", path=f"/api/blobs/{digest}/thumb"),
+
+        # Export
+        Scenario("GET", "/api/export/formats"),
+        Scenario("POST", "/api/export", json_body(
+            lambda i: {"title": f"Bench {i}", "panels": [{"imageUrl": digest, **panel} for panel in panels(i, 12)]}
+        )),
+
+        # Jobs
+        Scenario("POST", "/api/jobs", json_body(
+            lambda i: {"kind": "generate-storyboard", "payload": {"script": f"{SCRIPT} Job {i}."}}
+        )),
+        Scenario("GET", "/api/jobs/kinds"),
+        Scenario("GET", "/api/jobs/stats"),
+        Scenario("GET", "/api/jobs/{job_id}", path=f"/api/jobs/{job_id}"),
+        Scenario("GET", "/api/jobs/{job_id}/result", path=f"/api/jobs/{job_id}/result"),
+        Scenario("GET", "/api/jobs/{job_id}/events", path=f"/api/jobs/{job_id}/events"),
+        Scenario("DELETE", "/api/jobs/{job_id}", path=f"/api/jobs/{job_id}"),
+
+        # System
+        Scenario("GET", "/api/cache/stats"),
+        Scenario("DELETE", "/api/cache"),
+        Scenario("GET", "/api/context-cache/stats"),
+        Scenario("DELETE", "/api/context-cache"),
+        Scenario("GET", "/api/upstream/stats"),
+        Scenario("GET", "/api/single-flight/stats"),
+        Scenario("GET", "/api/narration-cache/stats"),
+        Scenario("GET", "/api/style-sessions/stats"),
+        Scenario("GET", "/api/prompts"),
+        Scenario("GET", "/api/prompts/{template_name}/versions", path=f"/api/prompts/{fixtures['template']}/versions"),
+        Scenario("POST", "/api/prompts/reload"),
+        Scenario("GET", "/metrics"),
+    ]
+
+
+# Memory of the backend process (Linux /proc)
+
+def read_memory_mb(pid: int) -> Tuple[Optional[float], Optional[float]]:
+    """Current and peak resident set size of a process, in MB"""
+    try:
+        fields = dict(
+            line.split(":", 1) for line in Path(f"/proc/{pid}/status").read_text().splitlines() if ":" in line
+        )
+        return int(fields["VmRSS"].split()[0]) / 1024, int(fields["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def reset_peak_memory(pid: int) -> bool:
+    """Reset the kernel's peak RSS counter so each route's peak can be read separately"""
+    try:
+        Path(f"/proc/{pid}/clear_refs").write_text("5")
+        return True
+    except OSError:
+        return False
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+async def drive(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int) -> Dict[str, Any]:
+    """Send `requests` requests to one route from `concurrency` workers, reading every response to the end"""
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    indices = iter(range(requests))
+
+    async def worker():
+        for i in indices:
+            options = scenario.build(i)
+            path = options.pop("path", scenario.path)
+            start = time.perf_counter()
+            try:
+                async with client.stream(scenario.method, path, **options) as response:
+                    async for _ in response.aiter_raw():
+                        pass
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "route": scenario.name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "throughput": requests / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p90_ms": percentile(latencies, 0.90) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+        "errors": sum(count for status, count in statuses.items() if not status.startswith("2")),
+        "statuses": dict(statuses),
+    }
+
+
+def uncovered_routes(openapi: Dict[str, Any], scenarios: List[Scenario]) -> List[str]:
+    covered: Set[Tuple[str, str]] = {(scenario.method, scenario.route) for scenario in scenarios}
+    return sorted(
+        f"{method.upper()} {path}"
+        for path, operations in openapi.get("paths", {}).items()
+        for method in operations
+        if (method.upper(), path) not in covered
+    )
+
+
+# Processes
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(process.args)} exited with status {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def start_stub(args, port: int) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.gemini_stub", "--port", str(port),
+         "--latency-ms", str(args.stub_latency_ms), "--image-size", str(args.stub_image_size),
+         "--image-format", args.stub_image_format, "--text-panels", str(args.stub_text_panels),
+         "--error-rate", str(args.stub_error_rate), "--throttle-rate", str(args.stub_throttle_rate)],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    wait_until_ready(f"http://127.0.0.1:{port}/stub/stats", process)
+    return process
+
+
+def start_backend(args, port: int, stub_port: int, data_dir: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "GEMINI_API_BASE": f"http://127.0.0.1:{stub_port}/v1beta",
+        "GEMINI_API_KEY": "stub",
+        "BLOB_STORE_DIR": os.path.join(data_dir, "blobs"),
+        "JOB_QUEUE_DB": os.path.join(data_dir, "jobs.db"),
+        "NARRATION_CACHE_DIR": os.path.join(data_dir, "narration"),
+        "STYLE_SESSION_DB": os.path.join(data_dir, "style_sessions.db"),
+        "RESPONSE_CACHE_ENABLED": "true" if args.response_cache else "false",
+        "CONTEXT_CACHE_ENABLED": "true" if args.context_cache else "false",
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL
+    )
+    wait_until_ready(f"http://127.0.0.1:{port}/", process)
+    return process
+
+
+def print_report(results: List[Dict[str, Any]]):
+    print(f"{'route':<44} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+          f"{'errors':>6} {'RSS MB':>7} {'peak MB':>7}")
+    for result in results:
+        rss = f"{result['rss_mb']:7.1f}" if result.get("rss_mb") is not None else f"{'-':>7}"
+        peak = f"{result['peak_rss_mb']:7.1f}" if result.get("peak_rss_mb") is not None else f"{'-':>7}"
+        print(f"{result['route'][:44]:<44} {result['throughput']:8.1f} {result['p50_ms']:8.1f} "
+              f"{result['p90_ms']:8.1f} {result['p99_ms']:8.1f} {result['max_ms']:8.1f} "
+              f"{result['errors']:>6} {rss} {peak}")
+
+
+async def run(args, base_url: str, pid: Optional[int], stub_url: Optional[str]) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency + 4, max_keepalive_connections=args.concurrency + 4)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        fixtures = await prepare_fixtures(client)
+        scenarios = build_scenarios(fixtures)
+        openapi = (await client.get("/openapi.json")).json()
+
+        selected = [s for s in scenarios if not args.routes or any(f in s.name for f in args.routes)]
+        peak_supported = pid is not None and reset_peak_memory(pid)
+        results = []
+        for scenario in selected:
+            if peak_supported:
+                reset_peak_memory(pid)
+            result = await drive(client, scenario, args.requests, args.concurrency)
+            rss, peak = read_memory_mb(pid) if pid is not None else (None, None)
+            result.update({"rss_mb": rss, "peak_rss_mb": peak if peak_supported else None})
+            results.append(result)
+            if args.verbose:
+                print_report([result])
+
+    upstream = httpx.get(f"{stub_url}/stub/stats").json() if stub_url else None
+    return {"results": results, "uncovered": uncovered_routes(openapi, scenarios), "upstream": upstream}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=40, help="Requests per route")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--routes", nargs="*", help="Only routes whose 'METHOD /path' contains one of these")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--base-url", help="Drive an already running backend instead of starting one (no RSS)")
+    parser.add_argument("--response-cache", action="store_true", help="Leave the upstream response cache on")
+    parser.add_argument("--context-cache", action="store_true", help="Cache shared contexts with the stub's cachedContents")
+    parser.add_argument("--stub-latency-ms", type=float, default=50)
+    parser.add_argument("--stub-image-size", type=int, default=1024)
+    parser.add_argument("--stub-image-format", choices=["png", "jpeg"], default="png")
+    parser.add_argument("--stub-text-panels", type=int, default=8)
+    parser.add_argument("--stub-error-rate", type=float, default=0)
+    parser.add_argument("--stub-throttle-rate", type=float, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="Print each route as it finishes and backend errors")
+    args = parser.parse_args()
+
+    processes: List[subprocess.Popen] = []
+    with tempfile.TemporaryDirectory(prefix="akaza-bench-") as data_dir:
+        try:
+            if args.base_url:
+                base_url, pid, stub_url = args.base_url.rstrip("/"), None, None
+            else:
+                stub_port, backend_port = free_port(), free_port()
+                processes.append(start_stub(args, stub_port))
+                backend = start_backend(args, backend_port, stub_port, data_dir)
+                processes.append(backend)
+                base_url, pid, stub_url = f"http://127.0.0.1:{backend_port}", backend.pid, f"http://127.0.0.1:{stub_port}"
+
+            report = asyncio.run(run(args, base_url, pid, stub_url))
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    print(f"\n{args.requests} requests per route, concurrency {args.concurrency}\n")
+    print_report(report["results"])
+    if report["upstream"]:
+        print(f"\nUpstream (stub): {report['upstream']}")
+    if report["uncovered"]:
+        print(f"\nRoutes without a scenario: {', '.join(report['uncovered'])}")
+    if args.json:
+        Path(args.json).write_text(json.dumps({"args": vars(args), **report}, indent=2))
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Content-addressed binary store for images and other generated assets
+
+Blobs are written once to the local filesystem under their SHA-256 digest,
+so requests can reference images by digest instead of shipping base64 data
+URLs back and forth. Bytes are only read back when an upstream payload is
+built or a client fetches the blob URL.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Storage configuration
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "data/blobs")
+BLOB_URL_PREFIX = "/api/blobs/"
+
+_DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_valid_digest(digest: str) -> bool:
+    """Check that a string is a lowercase hex SHA-256 digest"""
+    return bool(digest) and bool(_DIGEST_PATTERN.match(digest))
+
+
+def blob_url(digest: str, variant: Optional[str] = None) -> str:
+    """Public URL a client uses to fetch a blob or one of its derivatives"""
+    return f"{BLOB_URL_PREFIX}{digest}/{variant}" if variant else f"{BLOB_URL_PREFIX}{digest}"
+
+
+def parse_blob_reference(reference: Optional[str]) -> Optional[str]:
+    """Return the digest referenced by a blob URL or bare digest, if any"""
+    if not reference:
+        return None
+    candidate = reference.split("?", 1)[0].rstrip("/")
+    if BLOB_URL_PREFIX in candidate:
+        # Derivative URLs (/api/blobs/<digest>/<variant>) still reference the original
+        candidate = candidate.split(BLOB_URL_PREFIX, 1)[1].split("/", 1)[0]
+    return candidate if is_valid_digest(candidate) else None
+
+
+class BlobStore:
+    """Digest-keyed blob storage on the local filesystem"""
+
+    def __init__(self, root: str = BLOB_STORE_DIR):
+        self.root = Path(root)
+
+    def path(self, digest: str, variant: Optional[str] = None) -> Path:
+        """Location of a blob (or a derivative stored alongside it), sharded by digest prefix"""
+        if not is_valid_digest(digest):
+            raise ValueError(f"Invalid blob digest '{digest}'")
+        name = f"{digest}.{variant}" if variant else digest
+        return self.root / digest[:2] / name
+
+    def _mime_path(self, digest: str, variant: Optional[str] = None) -> Path:
+        path = self.path(digest, variant)
+        return path.with_name(path.name + ".mime")
+
+    def _write_atomic(self, path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def exists(self, digest: str, variant: Optional[str] = None) -> bool:
+        return is_valid_digest(digest) and self.path(digest, variant).exists()
+
+    def put(self, data: bytes, mime_type: str = "application/octet-stream") -> str:
+        """Store bytes and return their digest; identical content is stored once"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not path.exists():
+            self._write_atomic(self._mime_path(digest), mime_type.encode("utf-8"))
+            self._write_atomic(path, data)
+            logger.info(f"Stored blob {digest[:12]} ({len(data) / 1024:.1f}KB, {mime_type})")
+        return digest
+
+    def put_variant(self, digest: str, variant: str, data: bytes, mime_type: str):
+        """Store a derivative (e.g. a thumbnail) next to its original blob"""
+        self._write_atomic(self._mime_path(digest, variant), mime_type.encode("utf-8"))
+        self._write_atomic(self.path(digest, variant), data)
+
+    def mime_type(self, digest: str, variant: Optional[str] = None) -> str:
+        try:
+            return self._mime_path(digest, variant).read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return "application/octet-stream"
+
+    def get(self, digest: str, variant: Optional[str] = None) -> Tuple[bytes, str]:
+        """Read a blob (or one of its derivatives) and its mime type; raises KeyError if it is missing"""
+        try:
+            data = self.path(digest, variant).read_bytes()
+        except (FileNotFoundError, ValueError):
+            raise KeyError(digest)
+        return data, self.mime_type(digest, variant)
+
+    async def aput(self, data: bytes, mime_type: str = "application/octet-stream") -> str:
+        return await asyncio.to_thread(self.put, data, mime_type)
+
+    async def aget(self, digest: str, variant: Optional[str] = None) -> Tuple[bytes, str]:
+        return await asyncio.to_thread(self.get, digest, variant)
+
+    async def aput_variants(self, digest: str, variants: Dict[str, Tuple[bytes, str]]):
+        """Store a set of derivatives, given as {variant: (bytes, mime type)}"""
+        def write_all():
+            for variant, (data, mime_type) in variants.items():
+                self.put_variant(digest, variant, data, mime_type)
+        await asyncio.to_thread(write_all)
+
+
+# Global blob store instance
+blob_store = BlobStore()
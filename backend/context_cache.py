@@ -0,0 +1,308 @@
+"""
+Upstream context caching with Gemini cachedContents
+
+Every panel of a board re-sends the same style reference and asset images,
+and text routes re-send the same rendered system prompts. Once a context
+(a system instruction and/or leading reference parts) has been used
+CONTEXT_CACHE_MIN_USES times, it is uploaded once as a cachedContents
+resource and later calls reference it by name instead of inlining it.
+
+Handles are tracked locally per model, owner (a style session, or shared)
+and content hash, together with their expiry. A handle close to expiry is
+extended with a TTL update while it is still in use. If a call finds its
+handle expired or evicted upstream, the handle is dropped and the call is
+repeated with the context inlined, so callers never see the difference.
+A context Gemini refuses to cache, or one estimated below
+CONTEXT_CACHE_MIN_TOKENS (Gemini's minimum cache size), is inlined too.
+Handles owned by a style session are deleted upstream along with it, and
+every handle is deleted on shutdown. Handles pushed out of the local
+bookkeeping are left to expire upstream.
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from fast_json import dumps, loads
+from gemini_client import API_BASE, API_KEY, CONNECT_TIMEOUT, call_api, gemini_client
+from metrics import observe_upstream
+from rate_limiter import model_name
+from single_flight import single_flight
+
+logger = logging.getLogger(__name__)
+
+# Context cache configuration
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", "3600"))
+# Handles with less than this many seconds left are extended before use
+CONTEXT_CACHE_REFRESH_MARGIN = int(os.getenv("CONTEXT_CACHE_REFRESH_MARGIN", "300"))
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "1024"))
+CONTEXT_CACHE_MIN_USES = int(os.getenv("CONTEXT_CACHE_MIN_USES", "2"))
+CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", "256"))
+# Seconds to keep inlining a context after Gemini refused to cache it
+CONTEXT_CACHE_RETRY_AFTER = int(os.getenv("CONTEXT_CACHE_RETRY_AFTER", "600"))
+CONTEXT_CACHE_TIMEOUT = float(os.getenv("CONTEXT_CACHE_TIMEOUT", "30"))
+
+# Statuses Gemini answers for a cachedContent that has expired or never existed
+STALE_HANDLE_STATUSES = (400, 403, 404)
+
+# Gemini bills images up to 384px as one 258-token tile, larger ones per 768px tile
+IMAGE_TILE_TOKENS = 258
+IMAGE_TILE_SIZE = 768
+IMAGE_SMALL_SIZE = 384
+
+
+def _context_parts(context: Dict[str, Any]) -> List[Dict[str, Any]]:
+    parts = list(context.get("systemInstruction", {}).get("parts", []))
+    for content in context.get("contents", []):
+        parts.extend(content.get("parts", []))
+    return parts
+
+
+def _image_tokens(inline: Dict[str, Any]) -> int:
+    from PIL import Image
+    try:
+        width, height = Image.open(io.BytesIO(base64.b64decode(inline.get("data", "")))).size
+    except Exception:
+        return IMAGE_TILE_TOKENS
+    if width <= IMAGE_SMALL_SIZE and height <= IMAGE_SMALL_SIZE:
+        return IMAGE_TILE_TOKENS
+    return math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE) * IMAGE_TILE_TOKENS
+
+
+def estimate_tokens(context: Dict[str, Any]) -> int:
+    """Rough input token count of a context: ~4 characters per text token, images by tile"""
+    tokens = 0
+    for part in _context_parts(context):
+        if "text" in part:
+            tokens += len(part["text"]) // 4
+        elif "inlineData" in part:
+            tokens += _image_tokens(part["inlineData"])
+    return tokens
+
+
+def inline_context(payload: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
+    """The payload with its context inlined: the system instruction set, and the
+    context's parts placed in the first turn right after its prompt text"""
+    payload = dict(payload)
+    if "systemInstruction" in context:
+        payload["systemInstruction"] = context["systemInstruction"]
+    context_parts = [part for content in context.get("contents", []) for part in content.get("parts", [])]
+    if context_parts:
+        first, *rest = payload["contents"]
+        parts = first.get("parts", [])
+        split = 1 if parts and "text" in parts[0] else 0
+        payload["contents"] = [{**first, "parts": parts[:split] + context_parts + parts[split:]}, *rest]
+    return payload
+
+
+class CachedContext:
+    """Local bookkeeping for one context and its upstream handle"""
+
+    __slots__ = ("key", "model", "owner", "tokens", "uses", "name", "expires_at", "retry_at")
+
+    def __init__(self, key: str, model: str, owner: Optional[str], tokens: int):
+        self.key = key
+        self.model = model
+        self.owner = owner
+        self.tokens = tokens
+        self.uses = 0
+        self.name: Optional[str] = None
+        self.expires_at = 0.0
+        self.retry_at = 0.0
+
+
+class ContextCache:
+    """Upstream cachedContents handles for reused contexts"""
+
+    def __init__(self,
+                 enabled: bool = CONTEXT_CACHE_ENABLED,
+                 ttl: int = CONTEXT_CACHE_TTL,
+                 refresh_margin: int = CONTEXT_CACHE_REFRESH_MARGIN,
+                 min_tokens: int = CONTEXT_CACHE_MIN_TOKENS,
+                 min_uses: int = CONTEXT_CACHE_MIN_USES,
+                 max_entries: int = CONTEXT_CACHE_MAX_ENTRIES):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.refresh_margin = min(refresh_margin, ttl // 2)
+        self.min_tokens = min_tokens
+        self.min_uses = min_uses
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CachedContext]" = OrderedDict()
+        self.stats = {"hits": 0, "inlined": 0, "created": 0, "refreshed": 0, "expired": 0, "fallbacks": 0,
+                      "create_failures": 0, "deleted": 0, "evicted": 0, "cached_tokens": 0}
+
+    async def call(self,
+                   url: str,
+                   payload: Dict[str, Any],
+                   context: Dict[str, Any],
+                   owner: Optional[str] = None,
+                   timeout: Optional[float] = None,
+                   cache: Optional[bool] = None) -> Dict[str, Any]:
+        """call_api with `context` ({"systemInstruction"} and/or {"contents"}) served
+        from a cachedContents handle when one is live, inlined otherwise"""
+        inlined = inline_context(payload, context)
+        if not self.enabled or not _context_parts(context):
+            return await call_api(url, inlined, timeout=timeout, cache=cache)
+
+        entry = await self._entry(url, context, owner)
+        name = await self._handle(entry, context)
+        if name is not None:
+            try:
+                result = await call_api(url, {**payload, "cachedContent": name}, timeout=timeout, cache=cache,
+                                        cache_payload=inlined)
+            except HTTPException as e:
+                if e.status_code not in STALE_HANDLE_STATUSES:
+                    raise
+                logger.info(f"Cached context {name} rejected ({e.status_code}: {e.detail}); sending it inline")
+                self.stats["fallbacks"] += 1
+                if entry.name == name:
+                    entry.name = None
+            else:
+                self.stats["hits"] += 1
+                self.stats["cached_tokens"] += result.get("usageMetadata", {}).get("cachedContentTokenCount", 0)
+                return result
+
+        self.stats["inlined"] += 1
+        return await call_api(url, inlined, timeout=timeout, cache=cache)
+
+    async def _entry(self, url: str, context: Dict[str, Any], owner: Optional[str]) -> CachedContext:
+        model = model_name(url)
+        key = await asyncio.to_thread(
+            lambda: hashlib.sha256(dumps({"model": model, "owner": owner, "context": context})).hexdigest()
+        )
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = CachedContext(key, model, owner, await asyncio.to_thread(estimate_tokens, context))
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evicted"] += 1
+        else:
+            self._entries.move_to_end(key)
+        entry.uses += 1
+        return entry
+
+    async def _handle(self, entry: CachedContext, context: Dict[str, Any]) -> Optional[str]:
+        """Name of a live handle for the context, creating or extending one when worthwhile"""
+        now = time.time()
+        if entry.tokens < self.min_tokens or entry.uses < self.min_uses or now < entry.retry_at:
+            return None
+        if entry.name is not None:
+            if now < entry.expires_at - self.refresh_margin:
+                return entry.name
+            if now < entry.expires_at:
+                return await single_flight.do("context-cache-refresh", entry.key, lambda: self._refresh(entry))
+            self.stats["expired"] += 1
+            entry.name = None
+        return await single_flight.do("context-cache", entry.key, lambda: self._create(entry, context))
+
+    async def _request(self, method: str, url: str, body: Optional[Dict[str, Any]] = None) -> httpx.Response:
+        content = dumps(body) if body is not None else None
+        started_at = time.perf_counter()
+        try:
+            response = await gemini_client.client.request(
+                method,
+                url,
+                headers={"Content-Type": "application/json"},
+                content=content,
+                timeout=httpx.Timeout(CONTEXT_CACHE_TIMEOUT, connect=CONNECT_TIMEOUT)
+            )
+        except httpx.HTTPError:
+            observe_upstream("cachedContents", "error", 0.0, time.perf_counter() - started_at)
+            raise
+        observe_upstream("cachedContents", str(response.status_code), 0.0, time.perf_counter() - started_at,
+                         len(content or b""), len(response.content))
+        return response
+
+    async def _create(self, entry: CachedContext, context: Dict[str, Any]) -> Optional[str]:
+        if entry.name is not None and time.time() < entry.expires_at:
+            return entry.name
+        # Expiry is counted from before the request, so the local view never outlives the upstream one
+        expires_at = time.time() + self.ttl
+        body = {
+            **context,
+            "model": f"models/{entry.model}",
+            "ttl": f"{self.ttl}s",
+            "displayName": f"akaza-{entry.owner or 'shared'}"[:128]
+        }
+        try:
+            response = await self._request("POST", f"{API_BASE}/cachedContents?key={API_KEY}", body)
+        except httpx.HTTPError as e:
+            detail = str(e)
+        else:
+            if response.is_success:
+                entry.name, entry.expires_at = loads(response.content)["name"], expires_at
+                self.stats["created"] += 1
+                logger.info(f"Cached context {entry.name} for {entry.model} "
+                            f"(~{entry.tokens} tokens, owner {entry.owner or 'shared'})")
+                return entry.name
+            detail = f"{response.status_code}: {response.text[:200]}"
+        self.stats["create_failures"] += 1
+        entry.retry_at = time.time() + CONTEXT_CACHE_RETRY_AFTER
+        logger.warning(f"Could not cache context for {entry.model}, sending it inline ({detail})")
+        return None
+
+    async def _refresh(self, entry: CachedContext) -> Optional[str]:
+        name = entry.name
+        expires_at = time.time() + self.ttl
+        try:
+            response = await self._request(
+                "PATCH", f"{API_BASE}/{name}?key={API_KEY}&updateMask=ttl", {"ttl": f"{self.ttl}s"}
+            )
+        except httpx.HTTPError:
+            response = None
+        if response is not None and response.is_success:
+            entry.expires_at = expires_at
+            self.stats["refreshed"] += 1
+            return name
+        # Still usable until it expires; the next call after that creates a new one
+        logger.info(f"Could not extend cached context {name}")
+        return name if time.time() < entry.expires_at else None
+
+    async def _delete(self, entries: List[CachedContext]):
+        for entry in entries:
+            self._entries.pop(entry.key, None)
+            if entry.name is None or time.time() >= entry.expires_at:
+                continue
+            try:
+                response = await self._request("DELETE", f"{API_BASE}/{entry.name}?key={API_KEY}")
+            except httpx.HTTPError as e:
+                logger.warning(f"Could not delete cached context {entry.name}: {e}")
+                continue
+            if response.is_success or response.status_code == 404:
+                self.stats["deleted"] += 1
+
+    async def release(self, owner: str):
+        """Delete the handles owned by a style session"""
+        await self._delete([entry for entry in self._entries.values() if entry.owner == owner])
+
+    async def clear(self):
+        """Delete every handle"""
+        await self._delete(list(self._entries.values()))
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "enabled": self.enabled,
+            **self.stats,
+            "contexts": len(self._entries),
+            "live_handles": sum(1 for entry in self._entries.values() if entry.name and now < entry.expires_at),
+            "ttl": self.ttl,
+            "min_tokens": self.min_tokens,
+            "min_uses": self.min_uses
+        }
+
+
+# Global context cache instance
+context_cache = ContextCache()
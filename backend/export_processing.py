@@ -0,0 +1,378 @@
+"""
+Storyboard export: a PDF contact sheet and an MP4 animatic
+
+Both exports run as generator pipelines. Each panel's image is prepared in
+the image worker pool a few panels ahead of the writer, written out and
+dropped, so memory stays flat however many panels a storyboard has. The
+PDF comes from a small streaming writer that embeds JPEG panels as they are
+(DCTDecode); the animatic is encoded by a local ffmpeg from normalised
+frames and the panels' narration.
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import shutil
+import tempfile
+import textwrap
+from collections import deque
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from audio_processing import NUM_CHANNELS, ffmpeg_pipe, wav_pcm
+from image_processing import DEFAULT_QUALITY, IMAGE_WORKERS, _pil, encode_image, run_in_pool
+
+logger = logging.getLogger(__name__)
+
+# Export configuration
+EXPORT_LOOKAHEAD = int(os.getenv("EXPORT_LOOKAHEAD", str(IMAGE_WORKERS)))
+PDF_IMAGE_WIDTH = int(os.getenv("EXPORT_PDF_IMAGE_WIDTH", "960"))
+ANIMATIC_WIDTH = int(os.getenv("EXPORT_ANIMATIC_WIDTH", "1280"))
+ANIMATIC_FPS = int(os.getenv("EXPORT_ANIMATIC_FPS", "24"))
+
+# A4 landscape, in points
+PAGE_WIDTH, PAGE_HEIGHT = 842, 595
+PAGE_MARGIN = 36
+GUTTER = 18
+HEADER_HEIGHT = 24
+
+FRAME_BACKGROUND = (24, 24, 36)
+PDF_COLOR_SPACES = {"RGB": "/DeviceRGB", "L": "/DeviceGray"}
+
+
+async def ordered_pipeline(items: Iterable[Any],
+                           fn: Callable[[Any], Awaitable[Any]],
+                           lookahead: int = EXPORT_LOOKAHEAD) -> AsyncIterator[Any]:
+    """Map fn over items with at most `lookahead` calls in flight, yielding results in order"""
+    pending: Deque[asyncio.Future] = deque()
+    try:
+        for item in items:
+            pending.append(asyncio.ensure_future(fn(item)))
+            if len(pending) >= max(1, lookahead):
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+# --- PDF contact sheet ---
+
+def pdf_image(path: str, max_width: int = PDF_IMAGE_WIDTH) -> Tuple[bytes, int, int, str]:
+    """JPEG bytes, size and PDF colour space of a panel image, scaled down for the contact sheet"""
+    Image = _pil()
+    image = Image.open(path)
+    if image.format == "JPEG" and image.mode in PDF_COLOR_SPACES and image.width <= max_width:
+        # Already a JPEG the PDF can embed verbatim
+        return Path(path).read_bytes(), image.width, image.height, PDF_COLOR_SPACES[image.mode]
+
+    if image.width > max_width:
+        height = round(image.height * max_width / image.width)
+        if image.format == "JPEG":
+            image.draft("RGB", (max_width, height))
+        image = image.resize((max_width, height), Image.LANCZOS)
+    data, _ = encode_image(image, "jpeg")
+    return data, image.width, image.height, PDF_COLOR_SPACES.get(image.mode, "/DeviceRGB")
+
+
+def pdf_text(text: str) -> str:
+    """Text as a PDF string literal in the standard fonts' WinAnsi encoding"""
+    text = " ".join(text.split()).encode("cp1252", "replace").decode("cp1252")
+    return "(" + text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+class PdfWriter:
+    """Minimal streaming PDF writer.
+
+    Objects are returned as byte chunks to send as soon as they are written;
+    only their offsets are kept for the cross-reference table at the end.
+    """
+
+    def __init__(self):
+        self.position = 0
+        self.offsets: Dict[int, int] = {}
+        self.next_id = 1
+
+    def reserve(self) -> int:
+        """Allocate an object number, for objects referenced before they are written"""
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+
+    def _emit(self, *chunks: bytes) -> List[bytes]:
+        self.position += sum(len(chunk) for chunk in chunks)
+        return list(chunks)
+
+    def header(self) -> List[bytes]:
+        return self._emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def write(self, obj_id: int, dictionary: str, stream: Optional[bytes] = None) -> List[bytes]:
+        """Write an object; for a stream object, `dictionary` holds its entries without the brackets"""
+        self.offsets[obj_id] = self.position
+        if stream is None:
+            return self._emit(f"{obj_id} 0 obj\n{dictionary}\nendobj\n".encode("cp1252"))
+        return self._emit(
+            f"{obj_id} 0 obj\n<< {dictionary} /Length {len(stream)} >>\nstream\n".encode("cp1252"),
+            stream,
+            b"\nendstream\nendobj\n"
+        )
+
+    def trailer(self, root_id: int, info_id: int) -> List[bytes]:
+        xref_offset = self.position
+        lines = [f"xref\n0 {self.next_id}\n", "0000000000 65535 f \n"]
+        lines += [f"{self.offsets[obj_id]:010d} 00000 n \n" for obj_id in range(1, self.next_id)]
+        lines.append(
+            f"trailer\n<< /Size {self.next_id} /Root {root_id} 0 R /Info {info_id} 0 R >>\n"
+            f"startxref\n{xref_offset}\n%%EOF\n"
+        )
+        return self._emit("".join(lines).encode("cp1252"))
+
+
+class SheetLayout:
+    """Grid of panel cells on a contact sheet page"""
+
+    def __init__(self, columns: int, rows: int):
+        self.columns = columns
+        self.rows = rows
+        self.cell_width = (PAGE_WIDTH - 2 * PAGE_MARGIN - (columns - 1) * GUTTER) / columns
+        self.cell_height = (PAGE_HEIGHT - 2 * PAGE_MARGIN - HEADER_HEIGHT - (rows - 1) * GUTTER) / rows
+        # Panel label above the image, room for a few lines of notes below it
+        self.image_width = min(self.cell_width, (self.cell_height - 14 - 56) * 16 / 9)
+        self.image_height = self.image_width * 9 / 16
+
+    @property
+    def per_page(self) -> int:
+        return self.columns * self.rows
+
+    def cell_origin(self, slot: int) -> Tuple[float, float]:
+        """Top-left corner of a cell, in PDF coordinates (origin bottom-left)"""
+        column, row = slot % self.columns, slot // self.columns
+        x = PAGE_MARGIN + column * (self.cell_width + GUTTER)
+        y = PAGE_HEIGHT - PAGE_MARGIN - HEADER_HEIGHT - row * (self.cell_height + GUTTER)
+        return x, y
+
+
+def panel_content(layout: SheetLayout, slot: int, panel: Dict[str, Any],
+                  image: Optional[Tuple[str, int, int]]) -> List[str]:
+    """Drawing operators for one panel cell: label, image (or placeholder) and wrapped notes"""
+    x, top = layout.cell_origin(slot)
+    ops = [f"BT /F2 9 Tf 0 g {x:.2f} {top - 9:.2f} Td {pdf_text(panel['label'])} Tj ET"]
+
+    image_top = top - 14
+    image_bottom = image_top - layout.image_height
+    if image:
+        name, width, height = image
+        # Fit inside the 16:9 box, keeping the image's own aspect ratio
+        scale = min(layout.image_width / width, layout.image_height / height)
+        draw_width, draw_height = width * scale, height * scale
+        left = x + (layout.image_width - draw_width) / 2
+        bottom = image_bottom + (layout.image_height - draw_height) / 2
+        ops.append(f"q {draw_width:.2f} 0 0 {draw_height:.2f} {left:.2f} {bottom:.2f} cm /{name} Do Q")
+    else:
+        ops.append(f"0.92 g {x:.2f} {image_bottom:.2f} {layout.image_width:.2f} {layout.image_height:.2f} re f")
+        ops.append(
+            f"BT /F1 9 Tf 0.5 g {x + layout.image_width / 2 - 18:.2f} {image_bottom + layout.image_height / 2:.2f} Td "
+            f"{pdf_text('No image')} Tj ET"
+        )
+    ops.append(f"0.6 G 0.5 w {x:.2f} {image_bottom:.2f} {layout.image_width:.2f} {layout.image_height:.2f} re S")
+
+    # Helvetica averages a little over half an em per character
+    font_size, leading = 8, 10
+    chars_per_line = max(10, int(layout.cell_width / (font_size * 0.55)))
+    max_lines = int((image_bottom - (top - layout.cell_height)) / leading) - 1
+    lines: List[Tuple[str, str]] = []
+    for label, text in panel["notes"]:
+        wrapped = textwrap.wrap(f"{label}: {' '.join(text.split())}", chars_per_line) or [f"{label}:"]
+        lines.extend(("/F1", line) for line in wrapped)
+    if len(lines) > max_lines:
+        lines = lines[:max(0, max_lines)]
+        if lines:
+            lines[-1] = (lines[-1][0], lines[-1][1][:chars_per_line - 3] + "...")
+
+    y = image_bottom - 12
+    for font, line in lines:
+        ops.append(f"BT {font} {font_size} Tf 0.2 g {x:.2f} {y:.2f} Td {pdf_text(line)} Tj ET")
+        y -= leading
+    return ops
+
+
+async def prepare_pdf_image(panel: Dict[str, Any]) -> Optional[Tuple[bytes, int, int, str]]:
+    if panel["image"] is None:
+        return None
+    try:
+        return await run_in_pool(pdf_image, str(panel["image"]))
+    except Exception as e:
+        logger.warning(f"Skipping unreadable image for {panel['label']}: {str(e)}")
+        return None
+
+
+async def contact_sheet_pdf(panels: List[Dict[str, Any]],
+                            title: str,
+                            columns: int = 2,
+                            rows: int = 2) -> AsyncIterator[bytes]:
+    """Stream a PDF contact sheet.
+
+    Each panel is {"label": str, "image": Optional[Path], "notes": [(label, text), ...]}.
+    """
+    layout = SheetLayout(columns, rows)
+    writer = PdfWriter()
+    catalog_id, pages_id, info_id, font_id, bold_font_id = (writer.reserve() for _ in range(5))
+    page_ids: List[int] = []
+    total_pages = max(1, -(-len(panels) // layout.per_page))
+
+    for chunk in writer.header():
+        yield chunk
+    for obj_id, base_font in ((font_id, "Helvetica"), (bold_font_id, "Helvetica-Bold")):
+        for chunk in writer.write(obj_id, f"<< /Type /Font /Subtype /Type1 /BaseFont /{base_font} /Encoding /WinAnsiEncoding >>"):
+            yield chunk
+
+    def finish_page(ops: List[str], images: Dict[str, int]) -> List[bytes]:
+        page_number = len(page_ids) + 1
+        header = [
+            f"BT /F2 14 Tf 0 g {PAGE_MARGIN} {PAGE_HEIGHT - PAGE_MARGIN - 12} Td {pdf_text(title)} Tj ET",
+            f"BT /F1 9 Tf 0.4 g {PAGE_WIDTH - PAGE_MARGIN - 60} {PAGE_HEIGHT - PAGE_MARGIN - 12} Td "
+            f"{pdf_text(f'Page {page_number} of {total_pages}')} Tj ET",
+        ]
+        content_id, page_id = writer.reserve(), writer.reserve()
+        page_ids.append(page_id)
+        x_objects = " ".join(f"/{name} {obj_id} 0 R" for name, obj_id in images.items())
+        return [
+            *writer.write(content_id, "", "\n".join(header + ops).encode("cp1252")),
+            *writer.write(
+                page_id,
+                f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                f"/Resources << /Font << /F1 {font_id} 0 R /F2 {bold_font_id} 0 R >> /XObject << {x_objects} >> >> "
+                f"/Contents {content_id} 0 R >>"
+            )
+        ]
+
+    ops: List[str] = []
+    images: Dict[str, int] = {}
+    index = 0
+    async for prepared in ordered_pipeline(panels, prepare_pdf_image):
+        slot = index % layout.per_page
+        image = None
+        if prepared is not None:
+            data, width, height, color_space = prepared
+            # The image is written out now; the page only keeps its object number
+            name, image_id = f"Im{slot}", writer.reserve()
+            for chunk in writer.write(
+                image_id,
+                f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /DCTDecode",
+                data
+            ):
+                yield chunk
+            del data, prepared
+            images[name] = image_id
+            image = (name, width, height)
+
+        ops.extend(panel_content(layout, slot, panels[index], image))
+        index += 1
+        if slot == layout.per_page - 1:
+            for chunk in finish_page(ops, images):
+                yield chunk
+            ops, images = [], {}
+
+    if ops or not page_ids:
+        for chunk in finish_page(ops, images):
+            yield chunk
+
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    for chunk in (
+        *writer.write(pages_id, f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>"),
+        *writer.write(catalog_id, f"<< /Type /Catalog /Pages {pages_id} 0 R >>"),
+        *writer.write(info_id, f"<< /Title {pdf_text(title)} /Producer (Akaza) >>"),
+        *writer.trailer(catalog_id, info_id),
+    ):
+        yield chunk
+
+
+# --- Animatic ---
+
+def animatic_frame(source: Optional[str], destination: str, width: int, height: int):
+    """Letterbox a panel image onto a fixed-size frame and save it as JPEG"""
+    Image = _pil()
+    frame = Image.new("RGB", (width, height), FRAME_BACKGROUND)
+    if source:
+        image = Image.open(source)
+        scale = min(width / image.width, height / image.height)
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        if image.format == "JPEG":
+            image.draft("RGB", size)
+        image = image.convert("RGB").resize(size, Image.LANCZOS)
+        frame.paste(image, ((width - size[0]) // 2, (height - size[1]) // 2))
+    frame.save(destination, format="JPEG", quality=DEFAULT_QUALITY)
+
+
+async def narration_pcm(panels: List[Dict[str, Any]], sample_rate: int) -> AsyncIterator[bytes]:
+    """Every panel's narration, padded with silence to the panel's time on screen, as one PCM stream"""
+    bytes_per_sample = NUM_CHANNELS * 2
+    silence = memoryview(bytes(sample_rate * bytes_per_sample))
+    for panel in panels:
+        remaining = panel["samples"] * bytes_per_sample
+        if panel["audio"] is not None:
+            wav_data = await asyncio.to_thread(Path(panel["audio"]).read_bytes)
+            pcm = wav_pcm(wav_data)[:remaining]
+            yield pcm
+            remaining -= len(pcm)
+            del wav_data, pcm
+        while remaining > 0:
+            chunk = silence[:min(remaining, len(silence))]
+            yield chunk
+            remaining -= len(chunk)
+
+
+async def animatic_mp4(panels: List[Dict[str, Any]], sample_rate: int) -> AsyncIterator[bytes]:
+    """Stream an MP4 animatic: each panel's image held for its narration.
+
+    Each panel is {"image": Optional[Path], "audio": Optional[Path] (WAV),
+    "samples": int (time on screen, in samples at sample_rate)}. Frames are
+    normalised in the image worker pool, then ffmpeg encodes them with the
+    narration into a fragmented MP4 that can be sent while it is written.
+    """
+    width = ANIMATIC_WIDTH - ANIMATIC_WIDTH % 2
+    height = round(width * 9 / 16 / 2) * 2
+    workdir = Path(tempfile.mkdtemp(prefix="animatic-"))
+    try:
+        async def prepare_frame(item: Tuple[int, Dict[str, Any]]) -> Path:
+            index, panel = item
+            destination = workdir / f"frame-{index:05d}.jpg"
+            source = str(panel["image"]) if panel["image"] is not None else None
+            try:
+                await run_in_pool(animatic_frame, source, str(destination), width, height)
+            except Exception as e:
+                logger.warning(f"Using a blank frame for unreadable panel {index + 1} image: {str(e)}")
+                await run_in_pool(animatic_frame, None, str(destination), width, height)
+            return destination
+
+        entries = ["ffconcat version 1.0"]
+        frame = None
+        index = 0
+        async for frame in ordered_pipeline(enumerate(panels), prepare_frame):
+            entries += [f"file '{frame}'", f"duration {panels[index]['samples'] / sample_rate:.6f}"]
+            index += 1
+        # The concat demuxer ignores the last entry's duration unless the file is listed again
+        entries.append(f"file '{frame}'")
+        playlist = workdir / "frames.ffconcat"
+        playlist.write_text("\n".join(entries) + "\n")
+
+        arguments = [
+            "-f", "concat", "-safe", "0", "-i", str(playlist),
+            "-f", "s16le", "-ar", str(sample_rate), "-ac", str(NUM_CHANNELS), "-i", "pipe:0",
+            "-map", "0:v", "-map", "1:a",
+            "-vf", f"fps={ANIMATIC_FPS},format=yuv420p",
+            "-c:v", "libx264", "-preset", "veryfast", "-tune", "stillimage",
+            "-c:a", "aac", "-b:a", "128k",
+            "-shortest",
+            # Fragmented MP4 needs no seek back to write the index, so it can be piped out
+            "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+            "-f", "mp4", "pipe:1"
+        ]
+        async with contextlib.aclosing(ffmpeg_pipe(arguments, narration_pcm(panels, sample_rate))) as encoded:
+            async for chunk in encoded:
+                yield chunk
+    finally:
+        await asyncio.to_thread(shutil.rmtree, workdir, True)
@@ -0,0 +1,73 @@
+"""
+Optional orjson-backed JSON for large payloads
+
+Image and audio traffic is mostly multi-megabyte base64 inside JSON. With
+FAST_JSON enabled (and orjson installed) API responses are rendered with
+ORJSONResponse, request bodies are decoded by FastJSONRoute, and upstream
+Gemini payloads and responses go through orjson as well. Without it the
+stdlib json module is used, as before; either way upstream payloads are
+serialised to bytes once per call instead of by httpx on every retry.
+"""
+
+import json
+import logging
+import os
+from typing import Any, Callable, Type, Union
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import APIRoute
+
+logger = logging.getLogger(__name__)
+
+# Fast JSON configuration
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() in ("1", "true", "yes")
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if FAST_JSON and orjson is None:
+    logger.warning("FAST_JSON requested but orjson is not installed, using the stdlib json module")
+FAST_JSON_ENABLED = FAST_JSON and orjson is not None
+
+
+def dumps(value: Any) -> bytes:
+    """Serialise to UTF-8 JSON bytes"""
+    if FAST_JSON_ENABLED:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Parse JSON bytes or text; errors are json.JSONDecodeError either way"""
+    if FAST_JSON_ENABLED:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def response_class() -> Type[Response]:
+    """Default response class for the app"""
+    return ORJSONResponse if FAST_JSON_ENABLED else JSONResponse
+
+
+class FastJSONRequest(Request):
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = loads(await self.body())
+        return self._json
+
+
+class FastJSONRoute(APIRoute):
+    """APIRoute decoding JSON request bodies with orjson when FAST_JSON is enabled"""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        if not FAST_JSON_ENABLED:
+            return handler
+
+        async def fast_json_handler(request: Request) -> Response:
+            return await handler(FastJSONRequest(request.scope, request.receive))
+
+        return fast_json_handler
@@ -0,0 +1,268 @@
+"""
+Shared Gemini HTTP client for Akaza
+
+A single pooled httpx.AsyncClient is created for the lifetime of the app
+(see the lifespan hook in app.py) and reused by every router, so upstream
+calls share keep-alive connections instead of paying a fresh TCP+TLS
+handshake per request. Calls are queued per model by the upstream
+scheduler (see rate_limiter.py) and retried on 429s and transient errors.
+"""
+
+import asyncio
+import os
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from rate_limiter import (
+    MAX_RETRIES, RETRY_STATUSES, ModelBudget, backoff_delay, retry_after_seconds, upstream_scheduler
+)
+from response_cache import response_cache, cache_bypass, cache_key, is_cacheable
+from metrics import observe_upstream
+from fast_json import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# API Configuration
+API_KEY = os.getenv("GEMINI_API_KEY", "")
+API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+
+# Connection pool configuration
+MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GEMINI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("GEMINI_KEEPALIVE_EXPIRY", "30"))
+CONNECT_TIMEOUT = float(os.getenv("GEMINI_CONNECT_TIMEOUT", "10"))
+HTTP2_ENABLED = os.getenv("GEMINI_HTTP2", "true").lower() in ("1", "true", "yes")
+
+# Per-endpoint read timeouts (seconds)
+IMAGE_TIMEOUT = float(os.getenv("GEMINI_IMAGE_TIMEOUT", "60"))
+TEXT_TIMEOUT = float(os.getenv("GEMINI_TEXT_TIMEOUT", "60"))
+TTS_TIMEOUT = float(os.getenv("GEMINI_TTS_TIMEOUT", "60"))
+DEFAULT_TIMEOUT = 60.0
+
+
+def model_url(model: str, method: str = "generateContent") -> str:
+    """Build the upstream URL for a model method"""
+    return f"{API_BASE}/models/{model}:{method}?key={API_KEY}"
+
+
+def stream_url(model: str) -> str:
+    """Build the server-sent-events streaming URL for a model"""
+    return f"{model_url(model, 'streamGenerateContent')}&alt=sse"
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional h2 package (httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class GeminiClient:
+    """Owns the app-lifetime pooled connection to the Gemini API"""
+
+    def __init__(self,
+                 max_connections: int = MAX_CONNECTIONS,
+                 max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry: float = KEEPALIVE_EXPIRY,
+                 http2: bool = HTTP2_ENABLED):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.http2 = http2
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Return the pooled client, creating it on first use"""
+        if self._client is None or self._client.is_closed:
+            self.start()
+        return self._client
+
+    def start(self):
+        """Create the pooled client"""
+        if self._client is not None and not self._client.is_closed:
+            return
+
+        http2 = self.http2
+        if http2 and not _http2_available():
+            logger.warning("HTTP/2 requested but h2 is not installed, falling back to HTTP/1.1")
+            http2 = False
+
+        self._client = httpx.AsyncClient(
+            http2=http2,
+            limits=self.limits,
+            timeout=httpx.Timeout(DEFAULT_TIMEOUT, connect=CONNECT_TIMEOUT)
+        )
+        logger.info(
+            f"Gemini client started (http2={http2}, max_connections={self.limits.max_connections}, "
+            f"max_keepalive={self.limits.max_keepalive_connections})"
+        )
+
+    async def close(self):
+        """Close the pooled client and release its connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def post(self, url: str, body: bytes, timeout: Optional[float] = None) -> httpx.Response:
+        """POST a serialised JSON payload using the shared pool"""
+        return await self.client.post(
+            url,
+            headers={"Content-Type": "application/json"},
+            content=body,
+            timeout=httpx.Timeout(timeout or DEFAULT_TIMEOUT, connect=CONNECT_TIMEOUT)
+        )
+
+
+def _error_detail(response: httpx.Response) -> str:
+    """Extract the upstream error message from a failed response"""
+    error_detail = response.text
+    try:
+        error_json = response.json()
+        error_detail = error_json.get("error", {}).get("message", error_detail)
+    except Exception:
+        pass
+    return error_detail
+
+
+def _upstream_error(response: httpx.Response) -> HTTPException:
+    """HTTP error for a failed upstream response, passing on any Retry-After"""
+    retry_after = response.headers.get("retry-after")
+    return HTTPException(
+        status_code=response.status_code,
+        detail=_error_detail(response),
+        headers={"Retry-After": retry_after} if retry_after else None
+    )
+
+
+def _retry_delay(budget: ModelBudget, response: httpx.Response, attempt: int) -> float:
+    """Record a retryable failure against the model's budget and pick the backoff"""
+    retry_after = retry_after_seconds(response.headers.get("retry-after"))
+    if response.status_code == 429:
+        budget.on_throttled(retry_after)
+    budget.retries += 1
+    delay = backoff_delay(attempt, retry_after)
+    logger.info(f"Gemini {budget.name} returned {response.status_code}, retry {attempt + 1}/{MAX_RETRIES} in {delay:.2f}s")
+    return delay
+
+
+async def post_with_retries(url: str, payload: dict, timeout: Optional[float] = None) -> httpx.Response:
+    """POST within the model's budget, retrying throttled and transient failures with backoff"""
+    budget = upstream_scheduler.budget(url)
+    # Serialised once, not per attempt
+    body = dumps(payload)
+    for attempt in range(MAX_RETRIES + 1):
+        queued_at = time.perf_counter()
+        async with budget.slot():
+            started_at = time.perf_counter()
+            try:
+                response = await gemini_client.post(url, body, timeout=timeout)
+            except httpx.HTTPError:
+                observe_upstream(budget.name, "error", started_at - queued_at, time.perf_counter() - started_at)
+                raise
+        observe_upstream(
+            budget.name, str(response.status_code), started_at - queued_at, time.perf_counter() - started_at,
+            len(body), len(response.content)
+        )
+
+        if response.is_success:
+            budget.on_success()
+            return response
+        if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+            return response
+        # Back off outside the slot so other queued calls can proceed
+        await asyncio.sleep(_retry_delay(budget, response, attempt))
+    return response
+
+
+async def call_api(url: str,
+                   payload: dict,
+                   timeout: Optional[float] = None,
+                   cache: Optional[bool] = None,
+                   cache_payload: Optional[dict] = None) -> Dict[str, Any]:
+    """Call a Gemini endpoint and return the decoded JSON response.
+
+    Text responses go through the shared response cache unless `cache=False`
+    or the client sent `Cache-Control: no-cache`; a bypassed call still
+    refreshes the cached entry. `cache_payload` keys the cache instead of
+    the payload sent, e.g. the inline form of one referencing cached content.
+    """
+    cache_payload = cache_payload or payload
+    use_cache = response_cache.enabled and (is_cacheable(cache_payload) if cache is None else cache)
+    key = cache_key(url, cache_payload) if use_cache else None
+
+    if key is not None:
+        if cache_bypass.get():
+            response_cache.stats["bypassed"] += 1
+        else:
+            cached = await response_cache.get(key)
+            if cached is not None:
+                return cached
+
+    response = await post_with_retries(url, payload, timeout=timeout)
+    if not response.is_success:
+        raise _upstream_error(response)
+
+    result = loads(response.content)
+    if key is not None:
+        await response_cache.set(key, result)
+    return result
+
+
+async def stream_api(url: str, payload: dict, timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Call a streamGenerateContent endpoint, yielding each decoded response chunk.
+
+    The model's budget slot is held for the whole stream; failures are only
+    retried before the first chunk has been yielded.
+    """
+    budget = upstream_scheduler.budget(url)
+    body = dumps(payload)
+    for attempt in range(MAX_RETRIES + 1):
+        queued_at = time.perf_counter()
+        async with budget.slot():
+            started_at = time.perf_counter()
+            async with gemini_client.client.stream(
+                "POST",
+                url,
+                headers={"Content-Type": "application/json"},
+                content=body,
+                timeout=httpx.Timeout(timeout or DEFAULT_TIMEOUT, connect=CONNECT_TIMEOUT)
+            ) as response:
+                if response.is_success:
+                    async for line in response.aiter_lines():
+                        if line.startswith("data:"):
+                            yield loads(line[5:])
+                    # Latency of a stream covers the whole body, not just the first chunk
+                    observe_upstream(
+                        budget.name, str(response.status_code), started_at - queued_at,
+                        time.perf_counter() - started_at, len(body), response.num_bytes_downloaded
+                    )
+                    budget.on_success()
+                    return
+
+                await response.aread()
+                observe_upstream(
+                    budget.name, str(response.status_code), started_at - queued_at, time.perf_counter() - started_at
+                )
+                if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    raise _upstream_error(response)
+
+        await asyncio.sleep(_retry_delay(budget, response, attempt))
+
+
+def chunk_text(chunk: Dict[str, Any]) -> str:
+    """Concatenate the text parts of a streamed response chunk"""
+    parts = chunk.get("candidates", [{}])[0].get("content", {}).get("parts", [])
+    return "".join(part.get("text", "") for part in parts)
+
+
+# Global client instance
+gemini_client = GeminiClient()
@@ -0,0 +1,290 @@
+"""
+Image post-processing for generated panels
+
+Decoding, cropping and re-encoding are CPU-bound, so they run in a worker
+pool (threads by default, processes with IMAGE_WORKER_POOL=process) rather
+than on the event loop. Functions here are plain module-level callables so
+they can be shipped to a process pool.
+
+Panels that already come back at 16:9 in the requested format are stored
+byte for byte, and JPEGs that need cropping are cut losslessly on MCU
+boundaries by jpegtran when it is installed; only the remaining cases are
+decoded and re-encoded. The dimensions are read from the image header.
+"""
+
+import asyncio
+import io
+import logging
+import math
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+
+from metrics import observe_stage
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Worker pool configuration
+IMAGE_WORKER_POOL = os.getenv("IMAGE_WORKER_POOL", "thread")
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(os.cpu_count() or 2)))
+DEFAULT_QUALITY = int(os.getenv("IMAGE_QUALITY", "90"))
+
+TARGET_ASPECT_RATIO = 16 / 9
+# With the fast path, images within this relative distance of 16:9 (e.g. Gemini's 1344x768) are stored uncropped
+ASPECT_TOLERANCE = float(os.getenv("IMAGE_ASPECT_TOLERANCE", "0.02"))
+# Store matching panels without a decode/encode round trip
+CROP_FAST_PATH = os.getenv("IMAGE_CROP_FAST_PATH", "true").lower() in ("1", "true", "yes")
+
+# Derivative name -> max width, largest first; "full" is the stored original
+DERIVATIVE_WIDTHS: Dict[str, int] = {
+    "preview": int(os.getenv("IMAGE_PREVIEW_WIDTH", "960")),
+    "thumb": int(os.getenv("IMAGE_THUMB_WIDTH", "320")),
+}
+
+# Output format name -> (PIL format, mime type)
+OUTPUT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "avif": ("AVIF", "image/avif"),
+}
+
+# PIL format -> output format name, for sources that can be stored as they are
+SOURCE_FORMATS: Dict[str, str] = {pil_format: name for name, (pil_format, _) in OUTPUT_FORMATS.items()}
+
+_executor: Optional[Executor] = None
+
+
+def _pil():
+    """Import Pillow on first use; it is only needed once an image is processed"""
+    from PIL import Image
+    return Image
+
+
+def supported_formats() -> list:
+    """Output formats the installed Pillow can encode"""
+    Image = _pil()
+    Image.init()
+    return [name for name, (pil_format, _) in OUTPUT_FORMATS.items() if pil_format in Image.SAVE]
+
+
+def jpegtran_available() -> bool:
+    return shutil.which("jpegtran") is not None
+
+
+def get_executor() -> Executor:
+    """Return the shared image worker pool, creating it on first use"""
+    global _executor
+    if _executor is None:
+        if IMAGE_WORKER_POOL == "process":
+            _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+        logger.info(f"Image worker pool started ({IMAGE_WORKER_POOL}, {IMAGE_WORKERS} workers)")
+    return _executor
+
+
+def shutdown_executor():
+    """Stop the image worker pool"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def run_in_pool(fn: Callable, *args: Any) -> Any:
+    """Run a CPU-bound image function off the event loop"""
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(get_executor(), fn, *args)
+    finally:
+        # Includes time queued for a free worker
+        observe_stage("image_processing", time.perf_counter() - start)
+
+
+def center_crop_box(width: int, height: int, aspect_ratio: float = TARGET_ASPECT_RATIO) -> Tuple[int, int, int, int]:
+    """Largest centred box with the target aspect ratio"""
+    if width / height > aspect_ratio:
+        # Image is too wide
+        new_width = int(height * aspect_ratio)
+        left = (width - new_width) // 2
+        return (left, 0, left + new_width, height)
+
+    # Image is too tall
+    new_height = int(width / aspect_ratio)
+    top = (height - new_height) // 2
+    return (0, top, width, top + new_height)
+
+
+def crop_box(width: int, height: int) -> Tuple[int, int, int, int]:
+    """Fast-path box: the whole image when it is close enough to 16:9, else the centred 16:9 box"""
+    if abs(width / height - TARGET_ASPECT_RATIO) <= ASPECT_TOLERANCE * TARGET_ASPECT_RATIO:
+        return (0, 0, width, height)
+    return center_crop_box(width, height)
+
+
+def jpeg_mcu_size(image: "Image.Image") -> Tuple[int, int]:
+    """Pixel size of a JPEG's MCU, from the component sampling factors in its header"""
+    layers = getattr(image, "layer", None) or [("", 1, 1, 0)]
+    return 8 * max(layer[1] for layer in layers), 8 * max(layer[2] for layer in layers)
+
+
+def lossless_jpeg_crop(image_data: bytes, box: Tuple[int, int, int, int], mcu: Tuple[int, int]) -> Optional[bytes]:
+    """Crop a JPEG without re-encoding it, moving the box's origin back onto an MCU boundary"""
+    left, top, right, bottom = box
+    x, y = left - left % mcu[0], top - top % mcu[1]
+    try:
+        result = subprocess.run(
+            ["jpegtran", "-copy", "none", "-crop", f"{right - left}x{bottom - top}+{x}+{y}"],
+            input=image_data, capture_output=True, timeout=30
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"jpegtran failed, re-encoding instead: {e}")
+        return None
+    if result.returncode != 0 or not result.stdout:
+        logger.warning(f"jpegtran failed, re-encoding instead: {result.stderr.decode(errors='replace').strip()}")
+        return None
+    return result.stdout
+
+
+def _stored_as_is(image: "Image.Image",
+                  image_data: bytes,
+                  output_format: str,
+                  max_width: Optional[int]) -> Optional[bytes]:
+    """The panel's bytes without a decode/encode round trip, or None when one is needed"""
+    if not CROP_FAST_PATH or SOURCE_FORMATS.get(image.format) != output_format or image.mode not in ("RGB", "L"):
+        return None
+    box = crop_box(*image.size)
+    if max_width and box[2] - box[0] > max_width:
+        return None
+    if box == (0, 0, *image.size):
+        return image_data
+    if image.format == "JPEG" and jpegtran_available():
+        return lossless_jpeg_crop(image_data, box, jpeg_mcu_size(image))
+    return None
+
+
+def encode_image(image: "Image.Image", output_format: str = "jpeg", quality: int = DEFAULT_QUALITY) -> Tuple[bytes, str]:
+    """Encode a PIL image, returning the bytes and their mime type"""
+    pil_format, mime_type = OUTPUT_FORMATS[output_format]
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format=pil_format, quality=quality)
+    return buffer.getvalue(), mime_type
+
+
+def _crop(image: "Image.Image", max_width: Optional[int]) -> "Image.Image":
+    """Center-crop a lazily opened image to 16:9 and cap its width"""
+    if max_width and image.format == "JPEG":
+        # Let the JPEG decoder skip detail we would throw away when downscaling
+        width, height = image.size
+        left, _, right, _ = center_crop_box(width, height)
+        scale = max_width / (right - left)
+        if scale < 1:
+            image.draft("RGB", (math.ceil(width * scale), math.ceil(height * scale)))
+
+    cropped_image = image.crop(center_crop_box(*image.size))
+
+    if max_width and cropped_image.width > max_width:
+        cropped_image = cropped_image.resize(
+            (max_width, round(cropped_image.height * max_width / cropped_image.width)),
+            _pil().LANCZOS
+        )
+
+    return cropped_image
+
+
+def _derivatives(image: "Image.Image", output_format: str, quality: int) -> Dict[str, Tuple[bytes, str]]:
+    """Encode each derivative size from an already decoded image, reusing each step for the next"""
+    derivatives = {}
+    current = image
+    for variant, width in DERIVATIVE_WIDTHS.items():
+        if current.width > width:
+            current = current.resize((width, round(current.height * width / current.width)), _pil().LANCZOS)
+        derivatives[variant] = encode_image(current, output_format, quality)
+    return derivatives
+
+
+def normalise_reference(image_data: bytes,
+                        max_edge: int,
+                        output_format: str = "jpeg",
+                        quality: int = DEFAULT_QUALITY) -> Optional[Tuple[bytes, str]]:
+    """Downscale a reference image to max_edge and re-encode it for upload.
+
+    Transparency is flattened onto white. Returns None when the original is
+    already small enough in the target format, or would not get smaller.
+    """
+    Image = _pil()
+    image = Image.open(io.BytesIO(image_data))
+    fits = max(image.size) <= max_edge
+    if fits and SOURCE_FORMATS.get(image.format) == output_format:
+        return None
+
+    if image.format == "JPEG" and not fits:
+        scale = max_edge / max(image.size)
+        image.draft("RGB", (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+    if image.mode == "P":
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    if not fits:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    if image.mode in ("RGBA", "LA"):
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+
+    data, mime_type = encode_image(image, output_format, quality)
+    if len(data) >= len(image_data):
+        return None
+    return data, mime_type
+
+
+def make_derivatives(image_data: bytes,
+                     output_format: str = "jpeg",
+                     quality: int = DEFAULT_QUALITY) -> Dict[str, Tuple[bytes, str]]:
+    """Decode an image once and produce every smaller derivative"""
+    image = _pil().open(io.BytesIO(image_data))
+    if image.format == "JPEG":
+        largest = max(DERIVATIVE_WIDTHS.values())
+        if image.width > largest:
+            image.draft("RGB", (largest, math.ceil(image.height * largest / image.width)))
+    return _derivatives(image, output_format, quality)
+
+
+def crop_with_derivatives(image_data: bytes,
+                          output_format: str = "jpeg",
+                          max_width: Optional[int] = None,
+                          quality: int = DEFAULT_QUALITY) -> Dict[str, Tuple[bytes, str]]:
+    """Crop a generated panel and build its derivatives from the same decode.
+
+    Returns {"full": ..., "preview": ..., "thumb": ...}, each (bytes, mime type).
+    """
+    image = _pil().open(io.BytesIO(image_data))
+    full = _stored_as_is(image, image_data, output_format, max_width)
+    if full is not None:
+        # Derivatives still need pixels, but JPEG decoding can skip most of them
+        return {"full": (full, OUTPUT_FORMATS[output_format][1]), **make_derivatives(full, output_format, quality)}
+
+    cropped_image = _crop(image, max_width)
+    return {
+        "full": encode_image(cropped_image, output_format, quality),
+        **_derivatives(cropped_image, output_format, quality)
+    }
+
+
+def crop_image_to_16_9(image_data: bytes,
+                       output_format: str = "jpeg",
+                       max_width: Optional[int] = None,
+                       quality: int = DEFAULT_QUALITY) -> Tuple[bytes, str]:
+    """Center-crop an image to 16:9, optionally downscale, and re-encode it"""
+    image = _pil().open(io.BytesIO(image_data))
+    full = _stored_as_is(image, image_data, output_format, max_width)
+    if full is not None:
+        return full, OUTPUT_FORMATS[output_format][1]
+    return encode_image(_crop(image, max_width), output_format, quality)
@@ -0,0 +1,428 @@
+"""
+Persistent queue for long-running generation jobs
+
+Clients submit work for a registered kind (e.g. "generate-image") and get a
+job id back immediately, then poll, subscribe to status events or receive a
+webhook instead of holding an HTTP connection open while Gemini works.
+
+Jobs are rows in a SQLite database and are executed by a pool of worker
+tasks started in the app lifespan. Jobs that were running when the backend
+stopped are put back in the queue, so they survive a restart (up to
+JOB_MAX_ATTEMPTS tries). Running jobs are kept alive by a heartbeat; a job
+whose heartbeat is older than JOB_LEASE seconds is assumed to belong to a
+process that died and is queued again, which keeps several workers sharing
+one database from stealing each other's jobs.
+"""
+
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Type
+from urllib.parse import urlsplit
+
+import httpx
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+
+from metrics import current_route
+
+logger = logging.getLogger(__name__)
+
+# Job queue configuration
+JOB_QUEUE_DB = os.getenv("JOB_QUEUE_DB", "data/jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Finished jobs are deleted after this many seconds
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(7 * 24 * 3600)))
+# How often idle workers check the database for jobs queued by other processes
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_LEASE = float(os.getenv("JOB_LEASE", "60"))
+WEBHOOK_TIMEOUT = float(os.getenv("JOB_WEBHOOK_TIMEOUT", "10"))
+WEBHOOK_ATTEMPTS = 3
+# Comma-separated hosts webhooks may be sent to; when unset, any host resolving only to public addresses
+WEBHOOK_HOSTS = {host.strip().lower() for host in os.getenv("JOB_WEBHOOK_HOSTS", "").split(",") if host.strip()}
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+JobHandler = Callable[[BaseModel], Awaitable[Any]]
+
+
+async def check_webhook_url(url: str):
+    """Reject webhook URLs that could reach the backend's own network, with 400.
+
+    Hosts listed in JOB_WEBHOOK_HOSTS are trusted as they are. Any other host
+    must resolve only to global addresses: private, loopback, link-local,
+    reserved and multicast ranges (cloud metadata endpoints included) are
+    refused.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise HTTPException(status_code=400, detail="webhookUrl must be an http(s) URL")
+    host = parts.hostname.lower()
+    if WEBHOOK_HOSTS:
+        if host not in WEBHOOK_HOSTS:
+            raise HTTPException(status_code=400, detail=f"webhookUrl host '{host}' is not allowed")
+        return
+
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        addresses = await asyncio.get_running_loop().getaddrinfo(host, port)
+    except (OSError, ValueError):
+        raise HTTPException(status_code=400, detail=f"webhookUrl host '{host}' could not be resolved")
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            raise HTTPException(status_code=400, detail=f"webhookUrl host '{host}' resolves to a non-public address")
+
+
+class JobKind:
+    """A kind of work the queue can run: its request model and the coroutine that performs it"""
+
+    def __init__(self, name: str, request_model: Type[BaseModel], handler: JobHandler):
+        self.name = name
+        self.request_model = request_model
+        self.handler = handler
+
+
+def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+    job = dict(row)
+    job.pop("payload", None)
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+    job["error"] = json.loads(job["error"]) if job["error"] is not None else None
+    return job
+
+
+class JobQueue:
+    """SQLite-backed job queue with an in-process worker pool"""
+
+    def __init__(self, path: str = JOB_QUEUE_DB, workers: int = JOB_WORKERS):
+        self.path = path
+        self.workers = workers
+        self.kinds: Dict[str, JobKind] = {}
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        # Running job id -> task, for cancellation
+        self._running: Dict[str, asyncio.Task] = {}
+        # Job id -> events set whenever that job changes, for subscribers in this process
+        self._watchers: Dict[str, List[asyncio.Event]] = {}
+        self._webhooks: Set[asyncio.Task] = set()
+        self._stopping = False
+
+    # Storage
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, payload TEXT NOT NULL, "
+                "result TEXT, error TEXT, webhook_url TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, started_at REAL, finished_at REAL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self.conn.execute(sql, params)
+
+    def _insert(self, job_id: str, kind: str, payload: str, webhook_url: Optional[str]):
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, kind, status, payload, webhook_url, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, QUEUED, payload, webhook_url, now, now)
+        )
+
+    def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """Atomically take the oldest queued job this process can run"""
+        kinds = list(self.kinds)
+        if not kinds:
+            return None
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    f"SELECT * FROM jobs WHERE status = ? AND kind IN ({','.join('?' * len(kinds))}) "
+                    "ORDER BY created_at LIMIT 1",
+                    (QUEUED, *kinds)
+                ).fetchone()
+                if row is not None:
+                    now = time.time()
+                    self.conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ?, updated_at = ? "
+                        "WHERE id = ?",
+                        (RUNNING, now, now, row["id"])
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def _finish(self, job_id: str, status: str, result: Any = None, error: Any = None):
+        now = time.time()
+        self._execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, updated_at = ? WHERE id = ?",
+            (status,
+             json.dumps(result) if result is not None else None,
+             json.dumps(error) if error is not None else None,
+             now, now, job_id)
+        )
+
+    def _requeue(self, job_id: str):
+        self._execute(
+            "UPDATE jobs SET status = ?, started_at = NULL, updated_at = ? WHERE id = ? AND status = ?",
+            (QUEUED, time.time(), job_id, RUNNING)
+        )
+
+    def _heartbeat(self, job_ids: List[str]):
+        self._execute(
+            f"UPDATE jobs SET updated_at = ? WHERE status = ? AND id IN ({','.join('?' * len(job_ids))})",
+            (time.time(), RUNNING, *job_ids)
+        )
+
+    def _recover(self):
+        """Requeue running jobs whose process stopped heartbeating, failing those out of attempts"""
+        now = time.time()
+        stale = now - JOB_LEASE
+        with self._lock:
+            failed = self.conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, updated_at = ? "
+                "WHERE status = ? AND updated_at < ? AND attempts >= ?",
+                (FAILED, json.dumps({"status_code": 500, "detail": "Job was interrupted too many times"}),
+                 now, now, RUNNING, stale, JOB_MAX_ATTEMPTS)
+            ).rowcount
+            requeued = self.conn.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL, updated_at = ? WHERE status = ? AND updated_at < ?",
+                (QUEUED, now, RUNNING, stale)
+            ).rowcount
+            purged = self.conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({','.join('?' * len(FINISHED_STATUSES))}) AND finished_at < ?",
+                (*FINISHED_STATUSES, now - JOB_RETENTION)
+            ).rowcount
+        if requeued or failed or purged:
+            logger.info(f"Job queue recovery: {requeued} requeued, {failed} failed, {purged} expired")
+
+    # Public API
+
+    def register(self, kind: str, request_model: Type[BaseModel], handler: JobHandler):
+        """Make a kind of work available to the job API"""
+        self.kinds[kind] = JobKind(kind, request_model, handler)
+
+    async def submit(self, kind: str, payload: Dict[str, Any], webhook_url: Optional[str] = None) -> Dict[str, Any]:
+        """Validate a payload for a registered kind and queue it"""
+        job_kind = self.kinds.get(kind)
+        if job_kind is None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown job kind '{kind}'. Available: {', '.join(sorted(self.kinds))}"
+            )
+        # Reject invalid payloads now rather than when a worker picks the job up
+        try:
+            request = job_kind.request_model.model_validate(payload)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=json.loads(e.json()))
+
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(self._insert, job_id, kind, request.model_dump_json(), webhook_url)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        logger.info(f"Queued {kind} job {job_id}")
+        return await self.get(job_id)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Cancel a queued job, or a running one if this process is running it"""
+        job = await self.get(job_id)
+        if job is None or job["status"] in FINISHED_STATUSES:
+            return job
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+            # Give the worker a moment to record the cancellation
+            await self.wait_for_change(job_id, timeout=1)
+        else:
+            await asyncio.to_thread(
+                self._execute,
+                "UPDATE jobs SET status = ?, finished_at = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (CANCELLED, time.time(), time.time(), job_id, QUEUED)
+            )
+            self._notify(job_id)
+        return await self.get(job_id)
+
+    async def wait_for_change(self, job_id: str, timeout: float = JOB_POLL_INTERVAL):
+        """Wait until this process updates the job, or the timeout passes (for updates made elsewhere)"""
+        event = asyncio.Event()
+        self._watchers.setdefault(job_id, []).append(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            watchers = self._watchers.get(job_id, [])
+            if event in watchers:
+                watchers.remove(event)
+            if not watchers:
+                self._watchers.pop(job_id, None)
+
+    def _notify(self, job_id: str):
+        for event in self._watchers.get(job_id, []):
+            event.set()
+
+    def read_stats(self) -> Dict[str, Any]:
+        """Job counts and pool state; queries SQLite, so call it off the event loop"""
+        with self._lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {
+            "path": self.path,
+            "workers": self.workers if self._worker_tasks else 0,
+            "running_here": len(self._running),
+            "kinds": sorted(self.kinds),
+            "jobs": {status: count for status, count in rows}
+        }
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.read_stats)
+
+    # Workers
+
+    async def _run(self, row: sqlite3.Row):
+        job_id, kind = row["id"], row["kind"]
+        self._notify(job_id)
+        logger.info(f"Running {kind} job {job_id} (attempt {row['attempts'] + 1})")
+        # Stage timings of the job are labelled with its kind instead of an HTTP route
+        current_route.set(f"job:{kind}")
+
+        task = None
+        try:
+            # Validated here too: a payload queued by an older deploy may no longer fit the model
+            job_kind = self.kinds.get(kind)
+            if job_kind is None:
+                raise HTTPException(status_code=400, detail=f"Unknown job kind '{kind}'")
+            try:
+                request = job_kind.request_model.model_validate_json(row["payload"])
+            except ValidationError as e:
+                raise HTTPException(status_code=422, detail=json.loads(e.json()))
+            task = asyncio.ensure_future(job_kind.handler(request))
+            self._running[job_id] = task
+            result = await task
+            await asyncio.to_thread(self._finish, job_id, SUCCEEDED, result)
+        except asyncio.CancelledError:
+            if task is not None and task.cancelled() and not self._stopping:
+                # Cancelled through the API
+                await asyncio.to_thread(self._finish, job_id, CANCELLED)
+            else:
+                # Shutting down: leave the job for the next start
+                await asyncio.to_thread(self._requeue, job_id)
+                raise
+        except HTTPException as e:
+            await asyncio.to_thread(self._finish, job_id, FAILED, None,
+                                    {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logger.exception(f"{kind} job {job_id} failed")
+            await asyncio.to_thread(self._finish, job_id, FAILED, None, {"status_code": 500, "detail": str(e)})
+        finally:
+            self._running.pop(job_id, None)
+
+        self._notify(job_id)
+        job = await self.get(job_id)
+        if job and job["webhook_url"]:
+            webhook = asyncio.create_task(self._send_webhook(job))
+            self._webhooks.add(webhook)
+            webhook.add_done_callback(self._webhooks.discard)
+
+    async def _send_webhook(self, job: Dict[str, Any]):
+        """POST the finished job to its webhook, retrying a few times"""
+        # Checked again here since the host may resolve differently than at submission
+        try:
+            await check_webhook_url(job["webhook_url"])
+        except HTTPException as e:
+            logger.warning(f"Webhook for job {job['id']} not sent: {e.detail}")
+            return
+        async with httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT) as client:
+            for attempt in range(WEBHOOK_ATTEMPTS):
+                try:
+                    response = await client.post(job["webhook_url"], json=job)
+                    if response.is_success:
+                        return
+                    logger.warning(f"Webhook for job {job['id']} returned {response.status_code}")
+                except httpx.HTTPError as e:
+                    logger.warning(f"Webhook for job {job['id']} failed: {e}")
+                await asyncio.sleep(2 ** attempt)
+
+    async def _maintain(self):
+        """Heartbeat the jobs running here and recover jobs abandoned by dead processes"""
+        while True:
+            await asyncio.sleep(JOB_LEASE / 3)
+            try:
+                if self._running:
+                    await asyncio.to_thread(self._heartbeat, list(self._running))
+                await asyncio.to_thread(self._recover)
+            except Exception as e:
+                logger.error(f"Job queue maintenance failed: {e}")
+
+    async def _worker(self):
+        while True:
+            try:
+                row = await asyncio.to_thread(self._claim)
+                if row is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(row)
+            except Exception:
+                # One bad row or a locked database must not take the worker down
+                logger.exception("Job worker error")
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    def start(self):
+        """Recover interrupted jobs and start the worker pool"""
+        if self._worker_tasks or self.workers <= 0:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._recover()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._worker_tasks.append(asyncio.create_task(self._maintain()))
+        logger.info(f"Job queue started ({self.workers} workers, {self.path})")
+
+    async def stop(self):
+        """Stop the workers; jobs they were running go back to the queue"""
+        self._stopping = True
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+            self._conn = None
+
+
+# Global job queue instance
+job_queue = JobQueue()
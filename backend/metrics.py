@@ -0,0 +1,196 @@
+"""
+Prometheus metrics for request latency, per-stage timing and upstream calls
+
+Requests are timed per route by MetricsMiddleware. Routes built with
+TimedRoute also split each request into stages: request parsing and
+validation, the endpoint itself, and response serialisation. Inside the
+endpoint, prompt rendering, upstream Gemini calls (and their queue wait)
+and image processing are recorded as further stages via observe_stage(),
+labelled with the route that triggered them. Cache and queue gauges are
+read from the existing stats objects only when /metrics is scraped (see
+api/metrics.py), so the hot path pays for a few histogram observations.
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, ProcessCollector, disable_created_metrics
+
+from fast_json import FastJSONRoute
+
+logger = logging.getLogger(__name__)
+
+# Metrics configuration
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+STAGE_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1 KB .. 256 MB
+
+# Route label for work done outside a request (e.g. background jobs set their own)
+current_route: contextvars.ContextVar[str] = contextvars.ContextVar("current_route", default="background")
+
+# Set per request by TimedRoute: when the endpoint started and finished
+_endpoint_marks: contextvars.ContextVar[Optional[List[float]]] = contextvars.ContextVar("endpoint_marks", default=None)
+
+# The *_created timestamp series only add noise to every scrape
+disable_created_metrics()
+registry = CollectorRegistry()
+ProcessCollector(registry=registry)
+
+REQUEST_SECONDS = Histogram(
+    "akaza_http_request_duration_seconds", "Time to serve a request, until the last body byte is sent",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS, registry=registry
+)
+REQUEST_BYTES = Histogram(
+    "akaza_http_request_size_bytes", "Size of request bodies",
+    ["route"], buckets=SIZE_BUCKETS, registry=registry
+)
+STAGE_SECONDS = Histogram(
+    "akaza_stage_duration_seconds", "Time spent in each processing stage of a request",
+    ["route", "stage"], buckets=STAGE_BUCKETS, registry=registry
+)
+UPSTREAM_SECONDS = Histogram(
+    "akaza_upstream_request_duration_seconds", "Latency of Gemini calls, excluding time queued for a slot",
+    ["model", "status"], buckets=LATENCY_BUCKETS, registry=registry
+)
+UPSTREAM_RESPONSES = Counter(
+    "akaza_upstream_responses_total", "Gemini responses by status code",
+    ["model", "status"], registry=registry
+)
+UPSTREAM_BYTES = Histogram(
+    "akaza_upstream_payload_bytes", "Size of Gemini request and response bodies",
+    ["model", "direction"], buckets=SIZE_BUCKETS, registry=registry
+)
+REFERENCE_IMAGES = Counter(
+    "akaza_reference_images_total", "Reference images sent upstream, by how they were prepared",
+    ["result"], registry=registry
+)
+REFERENCE_BYTES_SAVED = Counter(
+    "akaza_reference_image_bytes_saved_total", "Bytes of reference images not sent thanks to normalisation",
+    registry=registry
+)
+
+
+def observe_stage(stage: str, seconds: float):
+    """Record time spent in a stage against the current route"""
+    if METRICS_ENABLED:
+        STAGE_SECONDS.labels(current_route.get(), stage).observe(seconds)
+
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def observe_upstream(model: str,
+                     status: str,
+                     queued: float,
+                     elapsed: float,
+                     request_bytes: int = 0,
+                     response_bytes: int = 0):
+    """Record one upstream attempt: queue wait, latency, status and payload sizes"""
+    if not METRICS_ENABLED:
+        return
+    route = current_route.get()
+    STAGE_SECONDS.labels(route, "upstream_queue").observe(queued)
+    STAGE_SECONDS.labels(route, "upstream").observe(elapsed)
+    UPSTREAM_SECONDS.labels(model, status).observe(elapsed)
+    UPSTREAM_RESPONSES.labels(model, status).inc()
+    if request_bytes:
+        UPSTREAM_BYTES.labels(model, "request").observe(request_bytes)
+    if response_bytes:
+        UPSTREAM_BYTES.labels(model, "response").observe(response_bytes)
+
+
+def observe_reference(result: str, original_bytes: int, sent_bytes: int):
+    """Record one reference image: cached, normalised or original, and the bytes it saved"""
+    if METRICS_ENABLED:
+        REFERENCE_IMAGES.labels(result).inc()
+        REFERENCE_BYTES_SAVED.inc(max(0, original_bytes - sent_bytes))
+
+
+class TimedRoute(FastJSONRoute):
+    """APIRoute recording parse, endpoint and serialisation time separately.
+
+    The endpoint call is wrapped to mark when it starts and ends; whatever
+    FastAPI does before (reading, decoding and validating the body) counts
+    as "parse", whatever it does after as "serialize".
+    """
+
+    def get_route_handler(self) -> Callable:
+        call = self.dependant.call
+        if not METRICS_ENABLED or not asyncio.iscoroutinefunction(call):
+            return super().get_route_handler()
+
+        @functools.wraps(call)
+        async def timed_call(*args: Any, **kwargs: Any) -> Any:
+            marks = _endpoint_marks.get()
+            if marks is not None:
+                marks.append(time.perf_counter())
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                if marks is not None:
+                    marks.append(time.perf_counter())
+
+        self.dependant.call = timed_call
+        handler = super().get_route_handler()
+        route = self.path
+
+        async def timed_handler(request):
+            current_route.set(route)
+            marks: List[float] = []
+            _endpoint_marks.set(marks)
+            start = time.perf_counter()
+            response = await handler(request)
+            if len(marks) == 2:
+                end = time.perf_counter()
+                STAGE_SECONDS.labels(route, "parse").observe(marks[0] - start)
+                STAGE_SECONDS.labels(route, "endpoint").observe(marks[1] - marks[0])
+                STAGE_SECONDS.labels(route, "serialize").observe(end - marks[1])
+            return response
+
+        return timed_handler
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by method, route template and status"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Routing stores the matched route in the scope; unmatched paths share one label
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.labels(scope["method"], route, status).observe(time.perf_counter() - start)
+            for name, value in scope.get("headers", []):
+                if name == b"content-length" and value.isdigit():
+                    REQUEST_BYTES.labels(route).observe(int(value))
+                    break
@@ -0,0 +1,85 @@
+"""
+Disk cache of synthesised narration
+
+Narration is keyed by a hash of (text, voice, sample rate). The audio
+itself is stored in the blob store as a WAV file; this cache keeps a small
+JSON index entry per key pointing at the blob, so re-exporting a storyboard
+reuses every panel's narration instead of synthesising it again.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from blob_store import blob_store
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+NARRATION_CACHE_DIR = os.getenv("NARRATION_CACHE_DIR", "data/narration")
+
+
+def narration_key(text: str, voice: Optional[str], sample_rate: int) -> str:
+    """Cache key for a narration; whitespace at the ends of the text doesn't change it"""
+    canonical = json.dumps([text.strip(), voice or "", sample_rate], separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class NarrationCache:
+    """Index of narration key -> stored WAV blob, kept on the local filesystem"""
+
+    def __init__(self, root: str = NARRATION_CACHE_DIR):
+        self.root = Path(root)
+        self.stats = {"hits": 0, "misses": 0, "stores": 0}
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached entry for a key, or None if it is missing or its blob is gone"""
+        try:
+            entry = json.loads(self.path(key).read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            self.stats["misses"] += 1
+            return None
+        if not blob_store.exists(entry.get("digest", "")):
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return entry
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        self.stats["stores"] += 1
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, entry: Dict[str, Any]):
+        await asyncio.to_thread(self.put, key, entry)
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "path": str(self.root)
+        }
+
+
+# Global narration cache instance
+narration_cache = NarrationCache()
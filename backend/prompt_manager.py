@@ -3,84 +3,304 @@ LangChain-based prompt management system for Akaza
 """
 
 import os
+import asyncio
+import hashlib
+import threading
+import time
 import yaml
-from typing import Dict, Any, Optional, List
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple, FrozenSet, TYPE_CHECKING
 from pathlib import Path
-from langchain.prompts import PromptTemplate
-from langchain_core.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
-from jinja2 import Environment, BaseLoader, meta
+from jinja2 import Environment, BaseLoader, Template
 import logging
+from metrics import observe_stage
+
+if TYPE_CHECKING:
+    # LangChain is slow to import and only needed by create_chat_prompt
+    from langchain_core.prompts import ChatPromptTemplate
 
 logger = logging.getLogger(__name__)
 
+# libyaml parses several times faster when PyYAML was built with it
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Hot reload configuration; an interval of 0 disables watching
+PROMPT_RELOAD_INTERVAL = float(os.getenv("PROMPT_RELOAD_INTERVAL", "2"))
+PROMPT_VERSION_HISTORY = int(os.getenv("PROMPT_VERSION_HISTORY", "10"))
+
+
+def template_revision(source: str) -> str:
+    """Content hash identifying one revision of a template file"""
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+
+
+class CompiledTemplate:
+    """One revision of a template, its Jinja sources compiled once and its variable rules precomputed"""
+
+    __slots__ = ("name", "revision", "data", "path", "loaded_at",
+                 "template", "system_prompt", "required", "defaults")
+
+    def __init__(self,
+                 jinja_env: Environment,
+                 name: str,
+                 template_data: Dict[str, Any],
+                 revision: str,
+                 path: Optional[Path] = None):
+        self.name = name
+        self.revision = revision
+        self.data = template_data
+        self.path = path
+        self.loaded_at = time.time()
+
+        template_str = template_data.get('template', '')
+        system_prompt = template_data.get('system_prompt', '')
+        self.template: Optional[Template] = jinja_env.from_string(template_str) if template_str else None
+        self.system_prompt: Optional[Template] = jinja_env.from_string(system_prompt) if system_prompt else None
+
+        variable_defs = template_data.get('variables', [])
+        self.required: FrozenSet[str] = frozenset(
+            var_def.get('name') for var_def in variable_defs if var_def.get('required', False)
+        )
+        self.defaults: Dict[str, Any] = {
+            var_def.get('name'): var_def.get('default')
+            for var_def in variable_defs
+            if var_def.get('default') is not None
+        }
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "revision": self.revision,
+            "path": str(self.path) if self.path else None,
+            "loaded_at": self.loaded_at
+        }
+
+
 class PromptManager:
-    """Manages prompt templates using LangChain and Jinja2"""
+    """Manages prompt templates using LangChain and Jinja2
+
+    The active templates form an immutable snapshot that reloads replace in a
+    single assignment, so a request always renders from one consistent set.
+    Earlier revisions stay addressable by their content hash.
+    """
 
-    def __init__(self, prompts_dir: str = "prompts"):
+    def __init__(self, prompts_dir: str = "prompts", history: int = PROMPT_VERSION_HISTORY):
         self.prompts_dir = Path(prompts_dir)
-        self.templates: Dict[str, Dict[str, Any]] = {}
+        self.history = history
         self.jinja_env = Environment(loader=BaseLoader())
+        # Active revision per template name; replaced wholesale, never mutated
+        self._active: Dict[str, CompiledTemplate] = {}
+        # Every retained revision, keyed by (template name, revision)
+        self._versions: "OrderedDict[Tuple[str, str], CompiledTemplate]" = OrderedDict()
+        # YAML file -> ((mtime_ns, size), template name) as of the last load
+        self._files: Dict[Path, Tuple[Tuple[int, int], Optional[str]]] = {}
+        self._reload_lock = threading.Lock()
+        self._watch_task: Optional[asyncio.Task] = None
+        self.reloads = 0
         self.load_all_templates()
 
+    @property
+    def templates(self) -> Dict[str, Dict[str, Any]]:
+        """Template definitions of the active snapshot, by name"""
+        return {name: compiled.data for name, compiled in self._active.items()}
+
+    @property
+    def revisions(self) -> Dict[str, str]:
+        """Active revision hash per template name"""
+        return {name: compiled.revision for name, compiled in self._active.items()}
+
     def load_all_templates(self):
         """Load all YAML prompt templates from the prompts directory"""
         if not self.prompts_dir.exists():
             logger.warning(f"Prompts directory {self.prompts_dir} does not exist")
             return
 
-        for yaml_file in self.prompts_dir.glob("*.yaml"):
+        self.reload_changed(force=True)
+
+    def reload_templates(self):
+        """Re-read every template from disk, dropping templates whose files are gone"""
+        return self.reload_changed(force=True)
+
+    def _load_file(self, yaml_file: Path) -> CompiledTemplate:
+        with open(yaml_file, 'r', encoding='utf-8') as f:
+            source = f.read()
+        template_data = yaml.load(source, Loader=_YAML_LOADER)
+
+        template_name = template_data.get('name', yaml_file.stem)
+        revision = template_revision(source)
+        compiled = self._versions.get((template_name, revision))
+        if compiled is None:
+            compiled = CompiledTemplate(self.jinja_env, template_name, template_data, revision, yaml_file)
+        return compiled
+
+    def reload_changed(self, force: bool = False) -> List[str]:
+        """Reload the YAML files added, modified or removed since the last load.
+
+        Parsing and compiling happen before the active snapshot is swapped, so
+        concurrent renders keep using the previous revisions until the new ones
+        are ready. Returns the names of the templates that changed.
+        """
+        with self._reload_lock:
+            previous_files = self._files
+            files: Dict[Path, Tuple[Tuple[int, int], Optional[str]]] = {}
+            active = dict(self._active)
+            changed: List[str] = []
+
+            for yaml_file in sorted(self.prompts_dir.glob("*.yaml")):
+                try:
+                    stat = yaml_file.stat()
+                except FileNotFoundError:
+                    continue
+                signature = (stat.st_mtime_ns, stat.st_size)
+                known = previous_files.get(yaml_file)
+                if not force and known is not None and known[0] == signature:
+                    files[yaml_file] = known
+                    continue
+
+                try:
+                    compiled = self._load_file(yaml_file)
+                except Exception as e:
+                    logger.error(f"Error loading template {yaml_file}: {e}")
+                    # Keep serving the last good revision of a broken file
+                    files[yaml_file] = (signature, known[1] if known else None)
+                    continue
+
+                files[yaml_file] = (signature, compiled.name)
+                current = active.get(compiled.name)
+                if current is None or current.revision != compiled.revision:
+                    active[compiled.name] = compiled
+                    self._remember(compiled)
+                    changed.append(compiled.name)
+                    logger.info(f"Loaded template: {compiled.name} ({compiled.revision})")
+
+            # Templates whose files disappeared
+            loaded_names = {name for _, name in files.values() if name}
+            for name in list(active):
+                if name not in loaded_names:
+                    del active[name]
+                    changed.append(name)
+                    logger.info(f"Removed template: {name}")
+
+            self._files = files
+            if changed:
+                self._active = active
+                self.reloads += 1
+            return changed
+
+    def _remember(self, compiled: CompiledTemplate):
+        """Retain a revision, keeping at most `history` revisions per template"""
+        self._versions[(compiled.name, compiled.revision)] = compiled
+        self._versions.move_to_end((compiled.name, compiled.revision))
+        revisions = [key for key in self._versions if key[0] == compiled.name]
+        for key in revisions[:max(0, len(revisions) - self.history)]:
+            if self._active.get(key[0]) is not self._versions[key]:
+                del self._versions[key]
+
+    def get_compiled(self, template_name: str, revision: Optional[str] = None) -> CompiledTemplate:
+        """Get the compiled form of a template, the active revision unless one is named"""
+        if revision is not None:
+            compiled = self._versions.get((template_name, revision))
+            if compiled is None:
+                raise ValueError(f"Template '{template_name}' has no revision '{revision}'")
+            return compiled
+
+        compiled = self._active.get(template_name)
+        if compiled is None:
+            raise ValueError(f"Template '{template_name}' not found")
+        return compiled
+
+    def list_versions(self, template_name: str) -> List[Dict[str, Any]]:
+        """Retained revisions of a template, oldest first"""
+        active = self._active.get(template_name)
+        return [
+            {**compiled.describe(), "active": compiled is active}
+            for (name, _), compiled in list(self._versions.items())
+            if name == template_name
+        ]
+
+    def get_registry_info(self) -> Dict[str, Any]:
+        """Active revision of every template plus watcher state"""
+        return {
+            "prompts_dir": str(self.prompts_dir),
+            "watching": self._watch_task is not None and not self._watch_task.done(),
+            "reload_interval": PROMPT_RELOAD_INTERVAL,
+            "reloads": self.reloads,
+            "templates": {name: compiled.describe() for name, compiled in sorted(self._active.items())}
+        }
+
+    async def watch(self, interval: float = PROMPT_RELOAD_INTERVAL):
+        """Poll the prompts directory and hot-reload changed files"""
+        while True:
+            await asyncio.sleep(interval)
             try:
-                with open(yaml_file, 'r', encoding='utf-8') as f:
-                    template_data = yaml.safe_load(f)
+                # File reads and Jinja compilation stay off the event loop
+                changed = await asyncio.to_thread(self.reload_changed)
+                if changed:
+                    logger.info(f"Reloaded prompt templates: {', '.join(changed)}")
+            except Exception as e:
+                logger.error(f"Prompt reload failed: {e}")
 
-                template_name = template_data.get('name', yaml_file.stem)
-                self.templates[template_name] = template_data
-                logger.info(f"Loaded template: {template_name}")
+    def start_watcher(self, interval: float = PROMPT_RELOAD_INTERVAL):
+        """Start watching for template changes; interval <= 0 disables hot reload"""
+        if interval > 0 and self._watch_task is None:
+            self._watch_task = asyncio.create_task(self.watch(interval))
+            logger.info(f"Watching {self.prompts_dir} for prompt changes every {interval}s")
 
-            except Exception as e:
-                logger.error(f"Error loading template {yaml_file}: {e}")
+    async def stop_watcher(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
 
     def get_template(self, template_name: str) -> Optional[Dict[str, Any]]:
         """Get a template by name"""
-        return self.templates.get(template_name)
+        compiled = self._active.get(template_name)
+        return compiled.data if compiled else None
 
     def list_templates(self) -> List[str]:
         """List all available template names"""
-        return list(self.templates.keys())
+        return list(self._active.keys())
 
-    def render_template(self, template_name: str, variables: Dict[str, Any]) -> str:
+    def render_template(self,
+                        template_name: str,
+                        variables: Dict[str, Any],
+                        revision: Optional[str] = None) -> str:
         """Render a template with provided variables"""
-        template_data = self.get_template(template_name)
-        if not template_data:
-            raise ValueError(f"Template '{template_name}' not found")
-
-        template_str = template_data.get('template', '')
-        if not template_str:
+        start = time.perf_counter()
+        compiled = self.get_compiled(template_name, revision)
+        if compiled.template is None:
             raise ValueError(f"Template '{template_name}' has no template content")
 
         # Validate required variables
-        self._validate_variables(template_name, variables)
+        self._validate_variables(template_name, variables, compiled)
 
         # Render with Jinja2
-        template = self.jinja_env.from_string(template_str)
-        return template.render(**variables)
-
-    def get_system_prompt(self, template_name: str, variables: Dict[str, Any]) -> str:
+        rendered = compiled.template.render(**variables)
+        observe_stage("prompt_render", time.perf_counter() - start)
+        return rendered
+
+    def get_system_prompt(self,
+                          template_name: str,
+                          variables: Dict[str, Any],
+                          revision: Optional[str] = None) -> str:
         """Get the system prompt for a template"""
-        template_data = self.get_template(template_name)
-        if not template_data:
-            raise ValueError(f"Template '{template_name}' not found")
-
-        system_prompt = template_data.get('system_prompt', '')
-        if not system_prompt:
+        start = time.perf_counter()
+        compiled = self.get_compiled(template_name, revision)
+        if compiled.system_prompt is None:
             return ""
 
         # Render system prompt with variables
-        template = self.jinja_env.from_string(system_prompt)
-        return template.render(**variables)
+        rendered = compiled.system_prompt.render(**variables)
+        observe_stage("prompt_render", time.perf_counter() - start)
+        return rendered
 
-    def create_chat_prompt(self, template_name: str, variables: Dict[str, Any]) -> ChatPromptTemplate:
+    def create_chat_prompt(self, template_name: str, variables: Dict[str, Any]) -> "ChatPromptTemplate":
         """Create a LangChain ChatPromptTemplate"""
+        from langchain_core.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
+
         template_data = self.get_template(template_name)
         if not template_data:
             raise ValueError(f"Template '{template_name}' not found")
@@ -106,24 +326,24 @@ class PromptManager:
 
         return template_data.get('response_schema')
 
-    def _validate_variables(self, template_name: str, variables: Dict[str, Any]):
+    def _validate_variables(self,
+                            template_name: str,
+                            variables: Dict[str, Any],
+                            compiled: Optional[CompiledTemplate] = None):
         """Validate that required variables are provided"""
-        template_data = self.get_template(template_name)
-        if not template_data:
-            return
-
-        template_variables = template_data.get('variables', [])
-
-        for var_def in template_variables:
-            var_name = var_def.get('name')
-            is_required = var_def.get('required', False)
-            default_value = var_def.get('default')
-
-            if is_required and var_name not in variables:
-                raise ValueError(f"Required variable '{var_name}' not provided for template '{template_name}'")
-
-            # Set default values
-            if var_name not in variables and default_value is not None:
+        if compiled is None:
+            if not self.get_template(template_name):
+                return
+            compiled = self.get_compiled(template_name)
+
+        missing = compiled.required.difference(variables)
+        if missing:
+            var_name = sorted(missing)[0]
+            raise ValueError(f"Required variable '{var_name}' not provided for template '{template_name}'")
+
+        # Set default values
+        for var_name, default_value in compiled.defaults.items():
+            if var_name not in variables:
                 variables[var_name] = default_value
 
     def get_variable_definitions(self, template_name: str) -> List[Dict[str, Any]]:
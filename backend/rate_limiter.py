@@ -0,0 +1,209 @@
+"""
+Per-model scheduling of upstream Gemini calls
+
+Each model gets its own budget: a cap on in-flight requests plus an
+optional token bucket limiting requests per minute. Calls beyond the budget
+wait in a queue instead of all hitting Gemini at once. When Gemini answers
+429, the model's budget backs off: queued calls pause until the Retry-After
+has passed, and the request rate is halved before slowly recovering.
+
+Routers register the budget for each URL they call; URLs of the same model
+(e.g. generateContent and streamGenerateContent) share one budget.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import re
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Default budgets per kind of model; an RPM of 0 means no rate limit
+IMAGE_CONCURRENCY = int(os.getenv("GEMINI_IMAGE_CONCURRENCY", "4"))
+IMAGE_RPM = float(os.getenv("GEMINI_IMAGE_RPM", "0"))
+TEXT_CONCURRENCY = int(os.getenv("GEMINI_TEXT_CONCURRENCY", "8"))
+TEXT_RPM = float(os.getenv("GEMINI_TEXT_RPM", "0"))
+TTS_CONCURRENCY = int(os.getenv("GEMINI_TTS_CONCURRENCY", "4"))
+TTS_RPM = float(os.getenv("GEMINI_TTS_RPM", "0"))
+
+# Retry configuration
+MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "30"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Longest a request waits for a slot before failing with 503
+QUEUE_TIMEOUT = float(os.getenv("GEMINI_QUEUE_TIMEOUT", "120"))
+
+_MODEL_PATTERN = re.compile(r"/models/([^:/?]+)")
+
+
+def model_name(url: str) -> str:
+    """Model a Gemini URL calls, used as its budget key"""
+    match = _MODEL_PATTERN.search(url)
+    return match.group(1) if match else url.split("?", 1)[0]
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given either in seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Delay before a retry: the server's Retry-After if given, else full-jitter exponential backoff"""
+    if retry_after is not None:
+        # A little jitter so every queued request doesn't retry in the same instant
+        return min(RETRY_MAX_DELAY, retry_after) + random.uniform(0, RETRY_BASE_DELAY / 2)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class ModelBudget:
+    """Concurrency cap and adaptive token bucket for one upstream model"""
+
+    def __init__(self, name: str, max_concurrency: int, rpm: float = 0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_rate = rpm / 60
+        self.rate = self.max_rate
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tokens = 1.0
+        self._refilled_at = time.monotonic()
+        self._bucket_lock = asyncio.Lock()
+        self.cooldown_until = 0.0
+
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.throttled = 0
+        self.retries = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+
+    async def _wait_for_token(self):
+        if self.rate <= 0:
+            return
+        async with self._bucket_lock:
+            while True:
+                now = time.monotonic()
+                # Allow a burst of up to one second's worth of requests
+                self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._refilled_at) * self.rate)
+                self._refilled_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def _wait_for_cooldown(self):
+        while (remaining := self.cooldown_until - time.monotonic()) > 0:
+            await asyncio.sleep(remaining)
+
+    async def _acquire(self):
+        await self._semaphore.acquire()
+        try:
+            await self._wait_for_cooldown()
+            await self._wait_for_token()
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    @asynccontextmanager
+    async def slot(self, timeout: float = QUEUE_TIMEOUT) -> AsyncIterator[None]:
+        """Wait for room in this model's budget, then hold a slot while the call runs"""
+        self.queued += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(self._acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail=f"Too many queued requests for {self.name}, try again shortly",
+                headers={"Retry-After": str(int(RETRY_BASE_DELAY * 5))}
+            )
+        finally:
+            self.queued -= 1
+        self.total_wait += time.monotonic() - start
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def on_success(self):
+        self.completed += 1
+        # Additive recovery towards the configured rate after a throttle
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def on_throttled(self, retry_after: Optional[float]):
+        """Back off after a 429: pause queued calls and halve the request rate"""
+        self.throttled += 1
+        pause = retry_after if retry_after is not None else RETRY_BASE_DELAY
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + min(pause, RETRY_MAX_DELAY))
+        if self.max_rate > 0:
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+        logger.warning(f"Gemini throttled {self.name}, pausing {pause:.1f}s (rate {self.rate * 60:.0f}/min)")
+
+    def get_stats(self) -> Dict[str, Any]:
+        served = self.completed + self.in_flight
+        return {
+            "max_concurrency": self.max_concurrency,
+            "rpm_limit": self.max_rate * 60 or None,
+            "current_rpm": self.rate * 60 or None,
+            "queue_depth": self.queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "cooling_down_for": round(max(0.0, self.cooldown_until - time.monotonic()), 2),
+            "avg_queue_wait": round(self.total_wait / served, 4) if served else 0.0
+        }
+
+
+class UpstreamScheduler:
+    """Registry of per-model budgets for upstream calls"""
+
+    def __init__(self, default_concurrency: int = TEXT_CONCURRENCY, default_rpm: float = TEXT_RPM):
+        self.default_concurrency = default_concurrency
+        self.default_rpm = default_rpm
+        self._budgets: Dict[str, ModelBudget] = {}
+
+    def register(self, url: str, max_concurrency: int, rpm: float = 0) -> ModelBudget:
+        """Declare the budget for the model a URL calls; the first registration wins"""
+        name = model_name(url)
+        if name not in self._budgets:
+            self._budgets[name] = ModelBudget(name, max_concurrency, rpm)
+        return self._budgets[name]
+
+    def budget(self, url: str) -> ModelBudget:
+        """Budget for a URL, registering the default budget for unknown models"""
+        name = model_name(url)
+        budget = self._budgets.get(name)
+        if budget is None:
+            budget = self.register(url, self.default_concurrency, self.default_rpm)
+        return budget
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {name: budget.get_stats() for name, budget in self._budgets.items()}
+
+
+# Global scheduler instance
+upstream_scheduler = UpstreamScheduler()
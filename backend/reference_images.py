@@ -0,0 +1,85 @@
+"""
+Normalisation of reference images before they are sent upstream
+
+Asset images, style images and previous frames arrive at whatever size the
+user uploaded, often 12MP PNGs, and Gemini downsamples them anyway. Each
+reference is downscaled to REFERENCE_MAX_EDGE and re-encoded as
+REFERENCE_FORMAT once, keyed by the sha256 of its original bytes, and the
+result is kept as a blob variant, so an asset reused across a whole
+storyboard is processed by the first panel only. Concurrent panels
+needing the same asset share one normalisation. When re-encoding would
+not make an image smaller, an empty variant records that the original is
+sent as-is.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Optional, Tuple
+
+from blob_store import blob_store
+from image_processing import DEFAULT_QUALITY, normalise_reference, run_in_pool
+from metrics import observe_reference
+from single_flight import single_flight
+
+logger = logging.getLogger(__name__)
+
+# Reference image configuration
+REFERENCE_NORMALISE = os.getenv("REFERENCE_NORMALISE", "true").lower() == "true"
+REFERENCE_MAX_EDGE = int(os.getenv("REFERENCE_MAX_EDGE", "1536"))
+# Formats Gemini accepts as input; avif is not one of them
+REFERENCE_FORMAT = os.getenv("REFERENCE_FORMAT", "jpeg").lower()
+if REFERENCE_FORMAT not in ("jpeg", "webp"):
+    logger.warning(f"Unsupported REFERENCE_FORMAT '{REFERENCE_FORMAT}'; using jpeg")
+    REFERENCE_FORMAT = "jpeg"
+REFERENCE_QUALITY = int(os.getenv("REFERENCE_QUALITY", str(DEFAULT_QUALITY)))
+
+
+def reference_variant() -> str:
+    """Blob variant holding the normalised copy for the current settings"""
+    return f"ref{REFERENCE_MAX_EDGE}q{REFERENCE_QUALITY}.{REFERENCE_FORMAT}"
+
+
+async def _normalise(digest: str, data: bytes, variant: str) -> Optional[Tuple[bytes, str]]:
+    try:
+        normalised = await run_in_pool(normalise_reference, data, REFERENCE_MAX_EDGE, REFERENCE_FORMAT, REFERENCE_QUALITY)
+    except Exception as e:
+        # Not an image Pillow can read; let Gemini see it unchanged
+        logger.warning(f"Could not normalise reference image {digest[:12]}: {e}")
+        return None
+    await blob_store.aput_variants(digest, {variant: normalised or (b"", "")})
+    return normalised
+
+
+async def prepare_reference(data: Optional[bytes],
+                            mime_type: str,
+                            digest: Optional[str] = None) -> Tuple[bytes, str, int]:
+    """Bytes and mime type to send for a reference image, plus the size of the original.
+
+    Stored blobs are passed by digest with data=None, and are read only when
+    no normalised copy is cached yet.
+    """
+    if data is not None and not digest:
+        digest = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+    variant = reference_variant()
+
+    if blob_store.exists(digest, variant):
+        cached, cached_mime_type = await blob_store.aget(digest, variant)
+        if data is None and not cached:
+            data, mime_type = await blob_store.aget(digest)
+        original_size = len(data) if data is not None else blob_store.path(digest).stat().st_size
+        result = "cached" if cached else "original"
+    else:
+        if data is None:
+            data, mime_type = await blob_store.aget(digest)
+        original_size = len(data)
+        normalised = await single_flight.do("reference-images", f"{digest}:{variant}",
+                                            lambda: _normalise(digest, data, variant))
+        cached, cached_mime_type = normalised or (b"", "")
+        result = "normalised" if cached else "original"
+
+    if cached:
+        data, mime_type = cached, cached_mime_type
+    observe_reference(result, original_size, len(data))
+    return data, mime_type, original_size
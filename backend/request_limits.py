@@ -0,0 +1,119 @@
+"""
+Request body size limits, enforced before the body is parsed
+
+BodySizeLimitMiddleware rejects requests whose Content-Length exceeds the
+limit for their path with 413 before a byte of the body is read, and counts
+streamed (chunked) bodies as they arrive so they cannot get past it either.
+Routes that accept inline images register a larger limit with limit_body(),
+by exact path or by route template ("/api/style-session/{project_id}/similar"
+matches any project id); everything else gets REQUEST_MAX_BYTES. Within an accepted body,
+check_inline_size() bounds individual base64 fields by their length, which
+for a str is free, instead of serialising the parsed request to measure it.
+"""
+
+import logging
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+# Limits configuration
+REQUEST_MAX_BYTES = int(os.getenv("REQUEST_MAX_BYTES", str(2 * 1024 * 1024)))
+# Routes carrying base64 images (style references, assets)
+IMAGE_REQUEST_MAX_BYTES = int(os.getenv("IMAGE_REQUEST_MAX_BYTES", str(45 * 1024 * 1024)))
+# Per field, measured as base64 text
+INLINE_IMAGE_MAX_BYTES = int(os.getenv("INLINE_IMAGE_MAX_BYTES", str(20 * 1024 * 1024)))
+ASSET_IMAGES_MAX_BYTES = int(os.getenv("ASSET_IMAGES_MAX_BYTES", str(40 * 1024 * 1024)))
+
+# Request path -> body limit, registered by the routers
+route_body_limits: Dict[str, int] = {}
+# Compiled route templates with their limits, checked when no exact path matches
+route_template_limits: List[Tuple[Pattern[str], int]] = []
+
+_PARAM = re.compile(r"\{[^/{}]+\}")
+
+
+def limit_body(path: str, max_bytes: int):
+    """Set the body limit for requests to a path.
+
+    The path may be a route template; each {param} matches one path segment,
+    as in the route itself.
+    """
+    if not _PARAM.search(path):
+        route_body_limits[path] = max_bytes
+        return
+    pattern = "".join(
+        "[^/]+" if _PARAM.fullmatch(part) else re.escape(part)
+        for part in re.split(r"(\{[^/{}]+\})", path)
+    )
+    route_template_limits.append((re.compile(f"{pattern}$"), max_bytes))
+
+
+def body_limit(path: str, default: int = REQUEST_MAX_BYTES) -> int:
+    """Body limit for a request path: an exact registration, then a matching template, then default"""
+    limit = route_body_limits.get(path)
+    if limit is not None:
+        return limit
+    for pattern, max_bytes in route_template_limits:
+        if pattern.match(path):
+            return max_bytes
+    return default
+
+
+def _megabytes(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f}MB"
+
+
+def check_inline_size(field: str, values: Iterable[Optional[str]], max_bytes: int) -> int:
+    """Total length of a field's base64 data, rejecting the request with 413 above max_bytes"""
+    size = sum(len(value) for value in values if value)
+    if size > max_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"{field} is too large ({_megabytes(size)}, limit {_megabytes(max_bytes)}). "
+                   f"Upload images to /api/blobs and send their digests instead."
+        )
+    return size
+
+
+class BodySizeLimitMiddleware:
+    """ASGI middleware rejecting request bodies over their path's limit with 413"""
+
+    def __init__(self, app, default_limit: int = REQUEST_MAX_BYTES):
+        self.app = app
+        self.default_limit = default_limit
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit = body_limit(scope["path"], self.default_limit)
+        detail = f"Request body too large (limit {_megabytes(limit)})"
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                if value.isdigit() and int(value) > limit:
+                    logger.warning(f"Rejected {scope['path']}: Content-Length {int(value)} exceeds {limit}")
+                    response = JSONResponse({"detail": detail}, status_code=413)
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised while the endpoint reads its body, so it becomes the response
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
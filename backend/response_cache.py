@@ -0,0 +1,220 @@
+"""
+Content-addressed response cache for deterministic Gemini text calls
+
+Responses are keyed by a hash of the model URL and the full request payload
+(rendered prompt, system prompt, response schema), with inline image data
+replaced by its digest. Entries live in an in-memory LRU with a TTL and can
+optionally be backed by an on-disk SQLite tier shared across workers.
+"""
+
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+CACHE_DB_PATH = os.getenv("RESPONSE_CACHE_DB", "")
+
+# Set per request by CacheControlMiddleware when the client asks to skip the cache
+cache_bypass: contextvars.ContextVar[bool] = contextvars.ContextVar("cache_bypass", default=False)
+
+
+def _canonical_payload(value: Any) -> Any:
+    """Replace inline binary data with its digest so keys stay small"""
+    if isinstance(value, dict):
+        if "inlineData" in value and isinstance(value["inlineData"], dict):
+            inline = value["inlineData"]
+            digest = hashlib.sha256(inline.get("data", "").encode("utf-8")).hexdigest()
+            return {"inlineData": {"mimeType": inline.get("mimeType"), "sha256": digest}}
+        return {k: _canonical_payload(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_canonical_payload(v) for v in value]
+    return value
+
+
+def _strip_api_key(url: str) -> str:
+    """Drop the API key so rotating it does not invalidate the cache"""
+    parts = urlsplit(url)
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query) if k != "key"])
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, query, parts.fragment))
+
+
+def cache_key(url: str, payload: dict) -> str:
+    """Hash of the model URL and canonical request payload"""
+    canonical = json.dumps(
+        {"url": _strip_api_key(url), "payload": _canonical_payload(payload)},
+        sort_keys=True,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(payload: dict) -> bool:
+    """Only text responses are cached; image and audio generations are always fresh"""
+    return not payload.get("generationConfig", {}).get("responseModalities")
+
+
+class SQLiteCacheTier:
+    """On-disk cache tier backed by a single SQLite table"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            return row[0]
+
+    def set(self, key: str, value: str, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+            self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+class ResponseCache:
+    """In-memory LRU + TTL cache with an optional SQLite tier"""
+
+    def __init__(self,
+                 max_entries: int = CACHE_MAX_ENTRIES,
+                 ttl: float = CACHE_TTL,
+                 db_path: str = CACHE_DB_PATH,
+                 enabled: bool = CACHE_ENABLED):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self.disk: Optional[SQLiteCacheTier] = SQLiteCacheTier(db_path) if enabled and db_path else None
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "bypassed": 0}
+
+    def _get_memory(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_memory(self, key: str, value: str, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up a cached response, promoting disk hits into memory"""
+        value = self._get_memory(key)
+        if value is None and self.disk is not None:
+            value = await asyncio.to_thread(self.disk.get, key)
+            if value is not None:
+                self.stats["disk_hits"] += 1
+                self._set_memory(key, value, time.time() + self.ttl)
+
+        if value is None:
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["hits"] += 1
+        return json.loads(value)
+
+    async def set(self, key: str, response: Dict[str, Any]):
+        """Store a response in every tier"""
+        value = json.dumps(response)
+        expires_at = time.time() + self.ttl
+        self._set_memory(key, value, expires_at)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, value, expires_at)
+
+    async def clear(self):
+        self._entries.clear()
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.clear)
+
+    def read_stats(self) -> Dict[str, Any]:
+        """Cache statistics; counts the disk tier's rows, so call it off the event loop"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "enabled": self.enabled,
+            **self.stats,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            "memory_entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "disk_entries": self.disk.count() if self.disk is not None else None
+        }
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.read_stats)
+
+
+class CacheControlMiddleware:
+    """ASGI middleware honouring `Cache-Control: no-cache` / `X-Cache-Bypass` per request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        bypass = False
+        for name, value in scope.get("headers", []):
+            if name == b"cache-control" and b"no-cache" in value.lower():
+                bypass = True
+            elif name == b"x-cache-bypass" and value.lower() in (b"1", b"true", b"yes"):
+                bypass = True
+
+        token = cache_bypass.set(bypass)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            cache_bypass.reset(token)
+
+
+# Global cache instance
+response_cache = ResponseCache()
@@ -0,0 +1,329 @@
+"""
+Pluggable storage for style consistency sessions
+
+Sessions hold the base style, a reference to the style image, the digests
+of the most recent panels and the similarity descriptors of many more. Two backends are available:
+
+- memory: process-local LRU capped by session count and idle TTL
+- sqlite: a database file shared by every worker and kept across restarts,
+  pruned to the same count and TTL limits every STYLE_SESSION_PRUNE_INTERVAL
+  writes
+
+Select one with STYLE_SESSION_BACKEND.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Session store configuration
+SESSION_BACKEND = os.getenv("STYLE_SESSION_BACKEND", "memory")
+SESSION_DB_PATH = os.getenv("STYLE_SESSION_DB", "data/style_sessions.db")
+SESSION_MAX_ENTRIES = int(os.getenv("STYLE_SESSION_MAX_ENTRIES", "1000"))
+SESSION_TTL = float(os.getenv("STYLE_SESSION_TTL", str(24 * 3600)))
+# Writes between SQLite prunes of expired and excess sessions
+SESSION_PRUNE_INTERVAL = int(os.getenv("STYLE_SESSION_PRUNE_INTERVAL", "100"))
+# Only the most recent panels are kept per session
+SESSION_MAX_IMAGES = int(os.getenv("STYLE_SESSION_MAX_IMAGES", "200"))
+# Similarity descriptors are kept for far more panels, packed at ~210 bytes each,
+# so older panels can still be picked as references
+SESSION_MAX_DESCRIPTORS = int(os.getenv("STYLE_SESSION_MAX_DESCRIPTORS", "5000"))
+
+
+def new_session(base_style: str, style_image: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Create the initial state of a style session"""
+    now = time.time()
+    return {
+        "base_style": base_style,
+        "style_image": style_image,
+        "generated_images": [],
+        # Digests and their concatenated hex descriptors, oldest first
+        "descriptors": {"digests": [], "packed": ""},
+        "style_keywords": [],
+        "consistency_prompt": "",
+        "created_at": now,
+        "updated_at": now
+    }
+
+
+def _append_image(session: Dict[str, Any], image: Dict[str, Any], max_images: int, max_descriptors: int):
+    image = dict(image)
+    descriptor = image.pop("descriptor", None)
+    images = session["generated_images"]
+    images.append(image)
+    if len(images) > max_images:
+        del images[:len(images) - max_images]
+
+    if descriptor:
+        descriptors = session.setdefault("descriptors", {"digests": [], "packed": ""})
+        descriptors["digests"].append(image["digest"])
+        descriptors["packed"] += descriptor
+        excess = len(descriptors["digests"]) - max_descriptors
+        if excess > 0:
+            del descriptors["digests"][:excess]
+            descriptors["packed"] = descriptors["packed"][excess * len(descriptor):]
+    session["updated_at"] = time.time()
+
+
+class SessionStore(ABC):
+    """Interface shared by the session store backends"""
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def save(self, session_id: str, session: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def delete(self, session_id: str):
+        ...
+
+    @abstractmethod
+    async def get_or_create(self, session_id: str, session: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the existing session, or store and return `session`"""
+
+    @abstractmethod
+    async def append_image(self, session_id: str, image: Dict[str, Any]):
+        """Atomically record a generated panel on an existing session"""
+
+    @abstractmethod
+    def read_stats(self) -> Dict[str, Any]:
+        """Store statistics; may block on I/O, so call it off the event loop"""
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.read_stats)
+
+
+class MemorySessionStore(SessionStore):
+    """Process-local LRU of sessions, evicting the least recently used past the cap or TTL"""
+
+    def __init__(self,
+                 max_entries: int = SESSION_MAX_ENTRIES,
+                 ttl: float = SESSION_TTL,
+                 max_images: int = SESSION_MAX_IMAGES,
+                 max_descriptors: int = SESSION_MAX_DESCRIPTORS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_images = max_images
+        self.max_descriptors = max_descriptors
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.evictions = 0
+
+    def _lookup(self, session_id: str) -> Optional[Dict[str, Any]]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if session["updated_at"] + self.ttl < time.time():
+            del self._sessions[session_id]
+            self.evictions += 1
+            return None
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _store(self, session_id: str, session: Dict[str, Any]):
+        self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_entries:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self._lookup(session_id)
+
+    async def save(self, session_id: str, session: Dict[str, Any]):
+        session["updated_at"] = time.time()
+        self._store(session_id, session)
+
+    async def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+    async def get_or_create(self, session_id: str, session: Dict[str, Any]) -> Dict[str, Any]:
+        existing = self._lookup(session_id)
+        if existing is not None:
+            return existing
+        self._store(session_id, session)
+        return session
+
+    async def append_image(self, session_id: str, image: Dict[str, Any]):
+        session = self._lookup(session_id)
+        if session is not None:
+            _append_image(session, image, self.max_images, self.max_descriptors)
+
+    def read_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "sessions": len(self._sessions),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "evictions": self.evictions
+        }
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return self.read_stats()
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions persisted as JSON rows in SQLite, shared across workers and restarts.
+
+    Expired sessions and the least recently updated ones past max_entries are
+    deleted every prune_interval writes, so the database stays bounded.
+    """
+
+    def __init__(self,
+                 path: str = SESSION_DB_PATH,
+                 max_entries: int = SESSION_MAX_ENTRIES,
+                 ttl: float = SESSION_TTL,
+                 max_images: int = SESSION_MAX_IMAGES,
+                 max_descriptors: int = SESSION_MAX_DESCRIPTORS,
+                 prune_interval: int = SESSION_PRUNE_INTERVAL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_images = max_images
+        self.max_descriptors = max_descriptors
+        self.prune_interval = max(1, prune_interval)
+        self.evictions = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS style_sessions "
+            "(id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS style_sessions_updated ON style_sessions (updated_at)")
+        self._prune()
+
+    def _prune(self):
+        """Delete expired sessions, then the least recently updated beyond max_entries"""
+        with self._lock:
+            expired = self._conn.execute(
+                "DELETE FROM style_sessions WHERE updated_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+            excess = self._conn.execute(
+                "DELETE FROM style_sessions WHERE id IN "
+                "(SELECT id FROM style_sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            ).rowcount
+            self.evictions += expired + excess
+
+    def _wrote(self):
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self.prune_interval == 0
+        if due:
+            self._prune()
+
+    def _read(self, session_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            "SELECT data, updated_at FROM style_sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None or row[1] + self.ttl < time.time():
+            return None
+        return json.loads(row[0])
+
+    def _write(self, session_id: str, session: Dict[str, Any]):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO style_sessions (id, data, updated_at) VALUES (?, ?, ?)",
+            (session_id, json.dumps(session), session["updated_at"])
+        )
+
+    def _get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._read(session_id)
+
+    def _save(self, session_id: str, session: Dict[str, Any]):
+        session["updated_at"] = time.time()
+        with self._lock:
+            self._write(session_id, session)
+        self._wrote()
+
+    def _delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM style_sessions WHERE id = ?", (session_id,))
+
+    def _get_or_create(self, session_id: str, session: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                existing = self._read(session_id)
+                if existing is None:
+                    self._write(session_id, session)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if existing is not None:
+            return existing
+        self._wrote()
+        return session
+
+    def _append_image(self, session_id: str, image: Dict[str, Any]):
+        with self._lock:
+            # Read-modify-write in one transaction so concurrent workers don't lose panels
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                session = self._read(session_id)
+                if session is not None:
+                    _append_image(session, image, self.max_images, self.max_descriptors)
+                    self._write(session_id, session)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._wrote()
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._get, session_id)
+
+    async def save(self, session_id: str, session: Dict[str, Any]):
+        await asyncio.to_thread(self._save, session_id, session)
+
+    async def delete(self, session_id: str):
+        await asyncio.to_thread(self._delete, session_id)
+
+    async def get_or_create(self, session_id: str, session: Dict[str, Any]) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._get_or_create, session_id, session)
+
+    async def append_image(self, session_id: str, image: Dict[str, Any]):
+        await asyncio.to_thread(self._append_image, session_id, image)
+
+    def read_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM style_sessions").fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "sessions": count,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "evictions": self.evictions
+        }
+
+
+def create_session_store(backend: str = SESSION_BACKEND) -> SessionStore:
+    """Build the session store selected by configuration"""
+    if backend == "sqlite":
+        logger.info(f"Using SQLite style session store at {SESSION_DB_PATH}")
+        return SQLiteSessionStore()
+    if backend != "memory":
+        logger.warning(f"Unknown style session backend '{backend}', using memory")
+    return MemorySessionStore()
+
+
+# Global session store instance
+session_store = create_session_store()
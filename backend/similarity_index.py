@@ -0,0 +1,215 @@
+"""
+Visual similarity of a style session's panels
+
+Each generated panel gets a 72-byte descriptor, computed once from its
+thumbnail: a 64-bin RGB colour histogram (4 levels per channel, scaled so
+the bins sum to ~255) followed by a 64-bit difference hash of its greyscale
+layout. Descriptors are stored hex-encoded and packed into one string on
+the session, capped separately from (and far above) the recent panels it
+keeps, so they live in whichever session store is configured. A
+SimilarityIndex is built from them in one pass and kept by
+session_indexes until the session gains a panel. Lookups score every panel
+at once with numpy:
+histogram intersection for palette and lighting, Hamming distance between
+hashes for composition. Panels whose hashes are within
+SIMILARITY_DUPLICATE_DISTANCE bits are near-duplicates.
+"""
+
+import io
+import logging
+import os
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy
+
+logger = logging.getLogger(__name__)
+
+# Similarity configuration
+# Weight of the colour histogram against the layout hash in the combined score
+SIMILARITY_HISTOGRAM_WEIGHT = float(os.getenv("SIMILARITY_HISTOGRAM_WEIGHT", "0.5"))
+SIMILARITY_DUPLICATE_DISTANCE = int(os.getenv("SIMILARITY_DUPLICATE_DISTANCE", "5"))
+# Sessions whose built index is kept in memory between generations
+SIMILARITY_INDEX_CACHE_SIZE = int(os.getenv("SIMILARITY_INDEX_CACHE_SIZE", "64"))
+
+HISTOGRAM_BINS = 64
+HASH_BYTES = 8
+DESCRIPTOR_BYTES = HISTOGRAM_BINS + HASH_BYTES
+HASH_BITS = HASH_BYTES * 8
+
+_popcount: Optional["numpy.ndarray"] = None
+
+
+def _numpy():
+    """Import numpy on first use; only sessions that are queried need it"""
+    import numpy
+    return numpy
+
+
+def _popcount_table() -> "numpy.ndarray":
+    global _popcount
+    if _popcount is None:
+        np = _numpy()
+        _popcount = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+    return _popcount
+
+
+def image_descriptor(image_data: bytes) -> str:
+    """Hex descriptor of an image; CPU-bound, run it in the image pool"""
+    from PIL import Image
+    np = _numpy()
+
+    image = Image.open(io.BytesIO(image_data))
+    image.draft("RGB", (128, 72))
+    image = image.convert("RGB")
+
+    pixels = np.asarray(image.resize((64, 36), Image.BILINEAR)) >> 6
+    bins = (pixels[..., 0].astype(np.intp) << 4) | (pixels[..., 1] << 2) | pixels[..., 2]
+    histogram = np.bincount(bins.ravel(), minlength=HISTOGRAM_BINS)
+    histogram = np.round(histogram * 255 / histogram.sum()).astype(np.uint8)
+
+    grey = np.asarray(image.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    layout_hash = np.packbits(grey[:, 1:] > grey[:, :-1])
+
+    return (histogram.tobytes() + layout_hash.tobytes()).hex()
+
+
+class SimilarityIndex:
+    """Descriptors of a session's panels as one numpy array, queried in a single vectorised pass"""
+
+    def __init__(self, digests: List[str], descriptors: "numpy.ndarray"):
+        self.digests = digests
+        self.histograms = descriptors[:, :HISTOGRAM_BINS]
+        self.hashes = descriptors[:, HISTOGRAM_BINS:]
+
+    @classmethod
+    def from_images(cls, images: Iterable[Dict[str, Any]]) -> "SimilarityIndex":
+        """Index generated_images entries; panels stored before descriptors existed are skipped"""
+        np = _numpy()
+        indexed = [image for image in images if len(image.get("descriptor") or "") == DESCRIPTOR_BYTES * 2]
+        packed = bytes.fromhex("".join(image["descriptor"] for image in indexed))
+        descriptors = np.frombuffer(packed, dtype=np.uint8).reshape(len(indexed), DESCRIPTOR_BYTES)
+        return cls([image["digest"] for image in indexed], descriptors)
+
+    @classmethod
+    def from_session(cls, session: Dict[str, Any]) -> "SimilarityIndex":
+        """Index a session's packed descriptors, after any left on panels stored before they were packed"""
+        np = _numpy()
+        legacy = cls.from_images(session["generated_images"])
+        stored = session.get("descriptors") or {"digests": [], "packed": ""}
+        digests, packed = stored["digests"], stored["packed"]
+        if len(packed) != len(digests) * DESCRIPTOR_BYTES * 2:
+            logger.warning("Ignoring malformed session descriptors")
+            return legacy
+        descriptors = np.frombuffer(bytes.fromhex(packed), dtype=np.uint8).reshape(len(digests), DESCRIPTOR_BYTES)
+        if not len(legacy):
+            return cls(list(digests), descriptors)
+        legacy_descriptors = np.hstack([legacy.histograms, legacy.hashes])
+        return cls(legacy.digests + list(digests), np.vstack([legacy_descriptors, descriptors]))
+
+    def __len__(self) -> int:
+        return len(self.digests)
+
+    def _compare(self, descriptor: str):
+        np = _numpy()
+        query = np.frombuffer(bytes.fromhex(descriptor), dtype=np.uint8)
+        histogram_similarity = np.minimum(self.histograms, query[:HISTOGRAM_BINS]).sum(axis=1, dtype=np.int32) / 255
+        distances = _popcount_table()[self.hashes ^ query[HISTOGRAM_BINS:]].sum(axis=1, dtype=np.int32)
+        scores = (SIMILARITY_HISTOGRAM_WEIGHT * histogram_similarity
+                  + (1 - SIMILARITY_HISTOGRAM_WEIGHT) * (1 - distances / HASH_BITS))
+        return scores, distances
+
+    def _match(self, index: int, scores, distances) -> Dict[str, Any]:
+        return {"digest": self.digests[index], "score": round(float(scores[index]), 4),
+                "distance": int(distances[index])}
+
+    def top_k(self, descriptor: str, k: int, exclude: Iterable[str] = (), distinct: bool = True) -> List[Dict[str, Any]]:
+        """The k most similar panels, best first.
+
+        With `distinct`, a candidate that is a near-duplicate of one already
+        chosen is skipped, so the references cover more than one take of a shot.
+        """
+        if not len(self) or k <= 0:
+            return []
+        np = _numpy()
+        scores, distances = self._compare(descriptor)
+        excluded = set(exclude)
+
+        # Only the best few need sorting; allow for exclusions and skipped duplicates
+        candidates = min(len(self), k * 4 + len(excluded))
+        best = np.argpartition(-scores, candidates - 1)[:candidates]
+        best = best[np.argsort(-scores[best], kind="stable")]
+
+        chosen: List[int] = []
+        for index in best:
+            if self.digests[index] in excluded:
+                continue
+            if distinct and chosen:
+                chosen_distances = _popcount_table()[self.hashes[chosen] ^ self.hashes[index]].sum(axis=1)
+                if chosen_distances.min() <= SIMILARITY_DUPLICATE_DISTANCE:
+                    continue
+            chosen.append(int(index))
+            if len(chosen) == k:
+                break
+        return [self._match(index, scores, distances) for index in chosen]
+
+    def duplicates(self, descriptor: str, exclude: Iterable[str] = ()) -> List[Dict[str, Any]]:
+        """Panels whose layout hash is within SIMILARITY_DUPLICATE_DISTANCE bits, closest first"""
+        if not len(self):
+            return []
+        np = _numpy()
+        scores, distances = self._compare(descriptor)
+        excluded = set(exclude)
+        matches = np.flatnonzero(distances <= SIMILARITY_DUPLICATE_DISTANCE)
+        matches = matches[np.lexsort((-scores[matches], distances[matches]))]
+        return [self._match(index, scores, distances) for index in matches if self.digests[index] not in excluded]
+
+    def descriptor_of(self, digest: str) -> Optional[str]:
+        """Stored descriptor of an indexed panel"""
+        try:
+            index = self.digests.index(digest)
+        except ValueError:
+            return None
+        return (self.histograms[index].tobytes() + self.hashes[index].tobytes()).hex()
+
+
+class SessionIndexCache:
+    """Built indexes of recently queried sessions, reused until the session's descriptors change.
+
+    An entry is keyed by the number of descriptors and the newest one's
+    digest, so a panel appended by this or any other worker rebuilds it.
+    """
+
+    def __init__(self, max_entries: int = SIMILARITY_INDEX_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, str, int], SimilarityIndex]]" = OrderedDict()
+        self.builds = 0
+
+    @staticmethod
+    def _version(session: Dict[str, Any]) -> Tuple[int, str, int]:
+        stored = session.get("descriptors") or {"digests": [], "packed": ""}
+        digests = stored["digests"]
+        return len(digests), digests[-1] if digests else "", len(session["generated_images"])
+
+    def get(self, session_id: str, session: Dict[str, Any]) -> SimilarityIndex:
+        version = self._version(session)
+        entry = self._entries.get(session_id)
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(session_id)
+            return entry[1]
+
+        index = SimilarityIndex.from_session(session)
+        self.builds += 1
+        self._entries[session_id] = (version, index)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return index
+
+    def invalidate(self, session_id: str):
+        self._entries.pop(session_id, None)
+
+
+# Global index cache instance
+session_indexes = SessionIndexCache()
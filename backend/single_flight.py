@@ -0,0 +1,100 @@
+"""
+Coalescing of identical concurrent requests
+
+Double-clicks and duplicate tabs send the same generation request several
+times at once. The first caller for a given canonical request hash runs
+the work; callers arriving while it is in flight wait on the same task and
+get the same result (or the same error) instead of paying for another
+Gemini call. The shared task keeps running if one caller disconnects, and
+is cancelled only when every caller waiting on it has gone away.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(request: BaseModel) -> str:
+    """Canonical hash of a request body, independent of field order"""
+    canonical = json.dumps(request.model_dump(), sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+def _consume_result(task: asyncio.Task):
+    # Mark an abandoned flight's exception as retrieved so asyncio doesn't log it
+    if not task.cancelled():
+        task.exception()
+
+
+class SingleFlight:
+    """In-flight calls keyed by namespace and request hash"""
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def _namespace_stats(self, namespace: str) -> Dict[str, int]:
+        return self.stats.setdefault(namespace, {"calls": 0, "coalesced": 0, "abandoned": 0})
+
+    async def do(self, namespace: str, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn() unless an identical call is in flight, in which case share its result"""
+        stats = self._namespace_stats(namespace)
+        stats["calls"] += 1
+        flight_key = f"{namespace}:{key}"
+
+        flight = self._flights.get(flight_key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._flights[flight_key] = flight
+
+            def finished(task: asyncio.Task, flight=flight):
+                if self._flights.get(flight_key) is flight:
+                    del self._flights[flight_key]
+                _consume_result(task)
+
+            flight.task.add_done_callback(finished)
+        else:
+            stats["coalesced"] += 1
+            logger.info(f"Coalesced duplicate {namespace} request {key[:12]}")
+
+        flight.waiters += 1
+        try:
+            # Shielded so one caller going away doesn't cancel the call for the rest
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                stats["abandoned"] += 1
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._flights),
+            "endpoints": {
+                namespace: {
+                    **stats,
+                    "coalesced_ratio": round(stats["coalesced"] / stats["calls"], 4) if stats["calls"] else 0.0
+                }
+                for namespace, stats in self.stats.items()
+            }
+        }
+
+
+# Global single-flight instance
+single_flight = SingleFlight()
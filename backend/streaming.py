@@ -0,0 +1,76 @@
+"""
+Server-sent events helpers and incremental JSON parsing for streamed generations
+"""
+
+import json
+from typing import Any, List, Optional
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Format a server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_comment(text: str) -> str:
+    """Format a server-sent events comment, which clients ignore"""
+    return f": {text}\n\n"
+
+
+class PanelStreamParser:
+    """Incrementally parse a streamed JSON document, emitting each completed panel.
+
+    Panels are the objects inside the first array of the document, either a
+    top-level array (`[{...}, {...}]`) or an array held directly by the
+    top-level object (`{"panels": [{...}]}`). Feed text fragments as they
+    arrive; every panel object is returned as soon as its closing brace is seen.
+    """
+
+    def __init__(self):
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._array_depth: Optional[int] = None
+        self._array_closed = False
+        self._buffer: List[str] = []
+        self._collecting = False
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Consume a fragment and return the panels it completed"""
+        completed = []
+
+        for ch in chunk:
+            if self._collecting:
+                self._buffer.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                self._stack.append(ch)
+                depth = len(self._stack)
+                if ch == "[" and self._array_depth is None and depth <= 2:
+                    self._array_depth = depth
+                elif (ch == "{" and not self._array_closed and self._array_depth is not None
+                      and depth == self._array_depth + 1):
+                    self._collecting = True
+                    self._buffer = ["{"]
+            elif ch in "]}":
+                depth = len(self._stack)
+                if ch == "}" and self._collecting and depth == self._array_depth + 1:
+                    completed.append(json.loads("".join(self._buffer)))
+                    self._collecting = False
+                    self._buffer = []
+                elif ch == "]" and depth == self._array_depth:
+                    self._array_closed = True
+                if self._stack:
+                    self._stack.pop()
+
+        return completed
@@ -1,5 +1,4 @@
 document.addEventListener('DOMContentLoaded', () => {
-    const { jsPDF } = window.jspdf;
     lucide.createIcons();
 
     // API Configuration - Use relative URL for Docker setup
@@ -14,7 +13,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const showScriptModalBtn = getEl('show-script-modal-btn'), scriptModal = getEl('script-modal'), scriptModalCloseBtn = getEl('script-modal-close-btn'), scriptInput = getEl('script-input'), generateStoryboardBtn = getEl('generate-storyboard-btn');
     const messageModal = getEl('message-modal'), modalMessage = getEl('modal-message'), modalCloseBtn = getEl('modal-close-btn');
     const imageZoomModal = getEl('image-zoom-modal'), zoomedImage = getEl('zoomed-image'), zoomModalCloseBtn = getEl('zoom-modal-close-btn');
-    const exportPdfBtn = getEl('export-pdf-btn'), exportXmlBtn = getEl('export-xml-btn');
+    const exportPdfBtn = getEl('export-pdf-btn'), exportXmlBtn = getEl('export-xml-btn'), exportAnimaticBtn = getEl('export-animatic-btn');
     const templateModal = getEl('template-modal'), templateModalTitle = getEl('template-modal-title'), templateInput = getEl('template-input'), templateModalCloseBtn = getEl('template-modal-close-btn'), generateTemplateStoryboardBtn = getEl('generate-template-storyboard-btn');
     const panelCountSlider = getEl('panel-count-slider'), panelCountLabel = getEl('panel-count-label');
     const analyzeStoryBtn = getEl('analyze-story-btn'), analysisModal = getEl('analysis-modal'), analysisContent = getEl('analysis-content'), analysisCloseBtn = getEl('analysis-close-btn');
@@ -29,7 +28,7 @@ document.addEventListener('DOMContentLoaded', () => {
     let panels = [];
     let activePanelId = null;
     let projectLibrary = [];
-    let styleImage = { base64: null, mimeType: null };
+    let styleImage = { digest: null, mimeType: null };
     let customStyleDescription = "";
     let currentAudio = null;
     let activeTemplate = null;
@@ -113,6 +112,114 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Upload raw image bytes to the backend blob store, returning { digest, url, mimeType }
+    async function uploadBlob(blob) {
+        const response = await fetch(`${API_BASE_URL}/blobs`, {
+            method: 'POST',
+            headers: { 'Content-Type': blob.type || 'application/octet-stream' },
+            body: blob,
+        });
+
+        if (!response.ok) {
+            throw new Error(response.status === 413 ? 'Image too large. Please use a smaller file.' : `Upload failed (HTTP ${response.status})`);
+        }
+        return await response.json();
+    }
+
+    // Stream server-sent events from a POST endpoint, calling onEvent(event, data) for each one
+    async function streamBackendApi(endpoint, data, onEvent) {
+        const response = await fetch(`${API_BASE_URL}${endpoint}`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
+            },
+            body: JSON.stringify(data),
+        });
+
+        if (!response.ok || !response.body) {
+            let errorMessage = `HTTP ${response.status}: ${response.statusText}`;
+            try {
+                const parsed = JSON.parse(await response.text());
+                errorMessage = parsed.detail || parsed.message || errorMessage;
+            } catch { }
+            throw new Error(errorMessage);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // Events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let eventName = 'message', eventData = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) eventData += line.slice(5).trim();
+                });
+
+                const payload = eventData ? JSON.parse(eventData) : null;
+                if (eventName === 'error') {
+                    throw new Error(payload?.detail || 'Streaming request failed');
+                }
+                onEvent(eventName, payload);
+            }
+        }
+    }
+
+    const JOB_FINISHED_STATUSES = ['succeeded', 'failed', 'cancelled'];
+    const JOB_POLL_INTERVAL_MS = 2000;
+
+    // Poll a job until it finishes, riding out a few failed requests in a row
+    async function pollBackendJob(jobId) {
+        let failures = 0;
+        while (true) {
+            try {
+                const job = await callBackendApi(`/jobs/${jobId}`, null, 'GET');
+                failures = 0;
+                if (JOB_FINISHED_STATUSES.includes(job.status)) return job;
+            } catch (error) {
+                if (++failures >= 5) throw new Error('Lost connection while waiting for the job');
+            }
+            await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+        }
+    }
+
+    // Run a generation as a background job, so a dropped connection doesn't lose the result;
+    // the finished job (with its result) arrives over the job's event stream, or by polling
+    // if the stream breaks (e.g. a proxy closing it)
+    async function runBackendJob(kind, payload) {
+        const job = await callBackendApi('/jobs', { kind, payload }, 'POST');
+
+        const finished = await new Promise((resolve, reject) => {
+            const events = new EventSource(`${API_BASE_URL}/jobs/${job.id}/events`);
+            events.addEventListener('status', (event) => {
+                const update = JSON.parse(event.data);
+                if (JOB_FINISHED_STATUSES.includes(update.status)) {
+                    events.close();
+                    resolve(update);
+                }
+            });
+            events.onerror = () => {
+                events.close();
+                console.warn(`Event stream for job ${job.id} failed; polling instead`);
+                pollBackendJob(job.id).then(resolve, reject);
+            };
+        });
+
+        if (finished.status === 'succeeded') return finished.result;
+        throw new Error(finished.error?.detail || `Job ${finished.status}`);
+    }
+
     // --- Modals ---
     const showMessageModal = (message) => { modalMessage.textContent = message; messageModal.classList.remove('hidden'); };
     modalCloseBtn.onclick = () => messageModal.classList.add('hidden');
@@ -148,7 +255,7 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         currentProjectStyle.baseStyle = styleSelector.value === 'Custom' ? customStyleDescription : styleSelector.value;
-        currentProjectStyle.styleImage = styleImage.base64 ? styleImage : null;
+        currentProjectStyle.styleImage = styleImage.digest ? styleImage : null;
 
         // Create style session on backend
         callBackendApi('/create-style-session', {
@@ -162,7 +269,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     function updateProjectStyle() {
         currentProjectStyle.baseStyle = styleSelector.value === 'Custom' ? customStyleDescription : styleSelector.value;
-        currentProjectStyle.styleImage = styleImage.base64 ? styleImage : null;
+        currentProjectStyle.styleImage = styleImage.digest ? styleImage : null;
 
         // Reinitialize session with new style
         if (projectStyleId) {
@@ -387,9 +494,25 @@ document.addEventListener('DOMContentLoaded', () => {
 
         try {
             console.log('Calling backend API...');
-            const result = await callBackendApi('/refine-script', {
-                natural_language: naturalText
-            }, 'POST');
+            let result = { refined_script: '' };
+            if (scriptOut) scriptOut.textContent = '';
+
+            // Show the script as it is written, falling back to a single request
+            try {
+                await streamBackendApi('/refine-script/stream', { natural_language: naturalText }, (event, data) => {
+                    if (event === 'token') {
+                        result.refined_script += data.text;
+                        if (scriptOut) scriptOut.textContent = result.refined_script;
+                    } else if (event === 'done') {
+                        result = data;
+                    }
+                });
+            } catch (streamError) {
+                console.warn('Streaming refinement failed, retrying without streaming:', streamError);
+                result = await callBackendApi('/refine-script', {
+                    natural_language: naturalText
+                }, 'POST');
+            }
 
             console.log('API response:', result);
 
@@ -572,25 +695,20 @@ document.addEventListener('DOMContentLoaded', () => {
                         console.log(`Compressed to ${(processedFile.size / 1024 / 1024).toFixed(2)}MB`);
                     }
 
-                    const reader = new FileReader();
-                    reader.onload = (e) => onFileLoaded(e.target.result, processedFile.type || file.type, file.name);
-                    reader.readAsDataURL(processedFile);
+                    // Store once on the backend and reference it by digest from then on
+                    onFileLoaded(await uploadBlob(processedFile), file.name);
                 } catch (error) {
                     console.error('Error processing file:', error);
-                    // Fallback to original file
-                    const reader = new FileReader();
-                    reader.onload = (e) => onFileLoaded(e.target.result, file.type, file.name);
-                    reader.readAsDataURL(file);
+                    showMessageModal(`Upload Error: ${error.message}`);
                 }
             }
             inputEl.value = '';
         };
     };
 
-    setupUploader(styleFileInput, async (dataUrl, mimeType) => {
-        const [, base64] = dataUrl.split(',');
-        Object.assign(styleImage, { base64, mimeType });
-        styleRefImg.src = dataUrl;
+    setupUploader(styleFileInput, async (stored) => {
+        Object.assign(styleImage, { digest: stored.digest, mimeType: stored.mimeType });
+        styleRefImg.src = `${stored.url}/preview`;
         styleRefContainer.classList.remove('hidden');
 
         // Automatically switch to custom style and analyze the image
@@ -610,8 +728,8 @@ document.addEventListener('DOMContentLoaded', () => {
         try {
             // Analyze the uploaded image style
             const analysisResult = await callBackendApi('/analyze-style', {
-                image_base64: base64,
-                mime_type: mimeType
+                image_digest: stored.digest,
+                mime_type: stored.mimeType
             }, 'POST');
 
             // Update custom style description with AI analysis
@@ -646,7 +764,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     uploadStyleBtn.onclick = () => styleFileInput.click();
     removeStyleBtn.onclick = () => {
-        Object.assign(styleImage, { base64: null, mimeType: null });
+        Object.assign(styleImage, { digest: null, mimeType: null });
         styleFileInput.value = '';
         styleRefImg.src = '';
         styleRefContainer.classList.add('hidden');
@@ -668,7 +786,7 @@ document.addEventListener('DOMContentLoaded', () => {
         projectLibrary.forEach(asset => {
             const assetEl = document.createElement('div');
             assetEl.className = 'relative group space-y-2';
-            assetEl.innerHTML = `<div class="aspect-square w-full bg-gray-900 rounded-md overflow-hidden"><img src="data:${asset.mimeType};base64,${asset.base64}" class="w-full h-full object-cover"></div><input type="text" value="${asset.name}" data-id="${asset.id}" class="library-name-input w-full bg-gray-700 text-white text-sm rounded-md p-1 border-0 focus:ring-2 focus:ring-[var(--primary-color)]"><button data-id="${asset.id}" class="library-delete-btn absolute top-1 right-1 bg-black/50 p-1 rounded-full text-white hover:bg-red-500 opacity-0 group-hover:opacity-100 transition-opacity"><i data-lucide="trash-2" class="w-4 h-4"></i></button>`;
+            assetEl.innerHTML = `<div class="aspect-square w-full bg-gray-900 rounded-md overflow-hidden"><img src="${asset.url}/thumb" loading="lazy" class="w-full h-full object-cover"></div><input type="text" value="${asset.name}" data-id="${asset.id}" class="library-name-input w-full bg-gray-700 text-white text-sm rounded-md p-1 border-0 focus:ring-2 focus:ring-[var(--primary-color)]"><button data-id="${asset.id}" class="library-delete-btn absolute top-1 right-1 bg-black/50 p-1 rounded-full text-white hover:bg-red-500 opacity-0 group-hover:opacity-100 transition-opacity"><i data-lucide="trash-2" class="w-4 h-4"></i></button>`;
             libraryModalGrid.appendChild(assetEl);
         });
         libraryModalGrid.querySelectorAll('.library-name-input').forEach(input => {
@@ -693,15 +811,14 @@ document.addEventListener('DOMContentLoaded', () => {
             const thumbEl = document.createElement('div');
             thumbEl.className = 'aspect-square bg-gray-800 rounded-md overflow-hidden border-2 border-transparent hover:border-indigo-500';
             thumbEl.title = asset.name;
-            thumbEl.innerHTML = `<img src="data:${asset.mimeType};base64,${asset.base64}" class="w-full h-full object-cover">`;
+            thumbEl.innerHTML = `<img src="${asset.url}/thumb" loading="lazy" class="w-full h-full object-cover">`;
             librarySidebarContainer.appendChild(thumbEl);
         });
     }
 
-    setupUploader(libraryFileInput, (dataUrl, mimeType, fileName) => {
-        const [, base64] = dataUrl.split(',');
+    setupUploader(libraryFileInput, (stored, fileName) => {
         const assetName = fileName.split('.')[0].replace(/[\s_-]/g, '_');
-        projectLibrary.push({ id: Date.now() + Math.random(), name: assetName, base64, mimeType });
+        projectLibrary.push({ id: Date.now() + Math.random(), name: assetName, digest: stored.digest, mimeType: stored.mimeType, url: stored.url });
         renderLibrary();
     });
 
@@ -737,7 +854,7 @@ document.addEventListener('DOMContentLoaded', () => {
             suggestionsHTML = `<div class="space-y-4 pt-4 border-t border-gray-800"><h3 class="text-md font-semibold text-white">Next Shot Suggestions</h3><div class="flex flex-col gap-2">${suggestionButtons}</div></div>`;
         }
 
-        inspectorPanel.innerHTML = `<h2 class="text-xl font-bold">Panel ${panels.indexOf(activePanel) + 1}</h2><div class="aspect-video w-full rounded-lg bg-cover bg-center border border-gray-700 bg-gray-900 flex items-center justify-center">${activePanel.imageUrl ? `<img src="${activePanel.imageUrl}" class="w-full h-full object-contain rounded-lg">` : `<i data-lucide="image" class="w-16 h-16 text-gray-600"></i>`}</div><div class="space-y-2"><label class="block text-sm font-medium" for="inspector-prompt">AI Prompt</label><textarea id="inspector-prompt" rows="5" class="block w-full rounded-md border-0 bg-gray-800 py-3 px-4 text-white focus:outline-none focus:ring-2 focus:ring-[var(--primary-color)] resize-none" placeholder="e.g., A wide shot of [character_name]...">${activePanel.prompt || ''}</textarea></div><button id="inspector-generate-btn" class="w-full flex items-center justify-center gap-2 rounded-md bg-[var(--primary-color)] px-4 py-3 text-lg font-bold text-white hover:bg-opacity-90 transition-colors"><i data-lucide="sparkles"></i><span>Generate</span></button><div class="flex items-center space-x-2"><input type="checkbox" id="inspector-ref-prev-frame" class="h-4 w-4 rounded border-gray-600 bg-gray-800 text-[var(--primary-color)] focus:ring-[var(--primary-color)]" ${(activePanel.refPrev || panels.indexOf(activePanel) > 0) ? 'checked' : ''}><label for="inspector-ref-prev-frame" class="text-sm font-medium">Reference Previous Frame</label></div>${suggestionsHTML}<div class="space-y-4 pt-4 border-t border-gray-800"><h3 class="text-md font-semibold">Annotations</h3>${createAnnotationInput('duration', 'Duration (s)', activePanel.duration, 'number')}${createAnnotationInput('motion', 'Motion/Transition Notes', activePanel.motion)}${createAnnotationInput('audio', 'Audio/VO Cues', activePanel.audio, 'text', true)}${createAnnotationInput('text', 'On-Screen Text', activePanel.text)}</div>`;
+        inspectorPanel.innerHTML = `<h2 class="text-xl font-bold">Panel ${panels.indexOf(activePanel) + 1}</h2><div class="aspect-video w-full rounded-lg bg-cover bg-center border border-gray-700 bg-gray-900 flex items-center justify-center">${activePanel.imageUrl ? `<img src="${activePanel.previewUrl || activePanel.imageUrl}" class="w-full h-full object-contain rounded-lg">` : `<i data-lucide="image" class="w-16 h-16 text-gray-600"></i>`}</div><div class="space-y-2"><label class="block text-sm font-medium" for="inspector-prompt">AI Prompt</label><textarea id="inspector-prompt" rows="5" class="block w-full rounded-md border-0 bg-gray-800 py-3 px-4 text-white focus:outline-none focus:ring-2 focus:ring-[var(--primary-color)] resize-none" placeholder="e.g., A wide shot of [character_name]...">${activePanel.prompt || ''}</textarea></div><button id="inspector-generate-btn" class="w-full flex items-center justify-center gap-2 rounded-md bg-[var(--primary-color)] px-4 py-3 text-lg font-bold text-white hover:bg-opacity-90 transition-colors"><i data-lucide="sparkles"></i><span>Generate</span></button><div class="flex items-center space-x-2"><input type="checkbox" id="inspector-ref-prev-frame" class="h-4 w-4 rounded border-gray-600 bg-gray-800 text-[var(--primary-color)] focus:ring-[var(--primary-color)]" ${(activePanel.refPrev || panels.indexOf(activePanel) > 0) ? 'checked' : ''}><label for="inspector-ref-prev-frame" class="text-sm font-medium">Reference Previous Frame</label></div>${suggestionsHTML}<div class="space-y-4 pt-4 border-t border-gray-800"><h3 class="text-md font-semibold">Annotations</h3>${createAnnotationInput('duration', 'Duration (s)', activePanel.duration, 'number')}${createAnnotationInput('motion', 'Motion/Transition Notes', activePanel.motion)}${createAnnotationInput('audio', 'Audio/VO Cues', activePanel.audio, 'text', true)}${createAnnotationInput('text', 'On-Screen Text', activePanel.text)}</div>`;
 
         getEl('inspector-prompt').oninput = (e) => activePanel.prompt = e.target.value;
         getEl('inspector-generate-btn').onclick = generateImage;
@@ -779,7 +896,7 @@ document.addEventListener('DOMContentLoaded', () => {
         imageContainer.className = 'relative mb-2 aspect-[16/9] w-full overflow-hidden rounded-md bg-gray-700 flex items-center justify-center';
 
         if (panel.isLoading) imageContainer.innerHTML = '<div class="loader"></div>';
-        else if (panel.imageUrl) imageContainer.innerHTML = `<img src="${panel.imageUrl}" class="h-full w-full object-cover">`;
+        else if (panel.imageUrl) imageContainer.innerHTML = `<img src="${panel.thumbnailUrl || panel.imageUrl}" loading="lazy" class="h-full w-full object-cover">`;
         else imageContainer.innerHTML = `<i data-lucide="image" class="h-12 w-12 text-gray-500"></i>`;
 
         if (panel.imageUrl) {
@@ -914,15 +1031,15 @@ document.addEventListener('DOMContentLoaded', () => {
                 return;
             }
 
-            const result = await callBackendApi('/generate-style', {
+            const result = await runBackendJob('generate-style', {
                 style: effectiveStyle
-            }, 'POST');
+            });
 
             styleImage = {
-                base64: result.base64,
+                digest: result.digest,
                 mimeType: result.mimeType
             };
-            styleRefImg.src = result.dataUrl;
+            styleRefImg.src = result.previewUrl || result.url;
             styleRefContainer.classList.remove('hidden');
         } catch (error) {
             showMessageModal(`Style Gen Error: ${error.message}`);
@@ -961,7 +1078,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 const asset = projectLibrary.find(a => a.name === match[1]);
                 if (asset) {
                     assetImages.push({
-                        base64: asset.base64,
+                        digest: asset.digest,
                         mimeType: asset.mimeType
                     });
                 }
@@ -987,7 +1104,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 style: effectiveStyle,
                 refPrev: activePanel.refPrev,
                 previousImageUrl,
-                styleImageBase64: styleImage.base64,
+                styleImageDigest: styleImage.digest,
                 styleImageMimeType: styleImage.mimeType,
                 assetImages,
                 // Add style consistency parameters
@@ -1001,14 +1118,12 @@ document.addEventListener('DOMContentLoaded', () => {
                 console.warn(`Large request: ${(estimatedSize / 1024 / 1024).toFixed(1)}MB`);
             }
 
-            console.log('Image generation request data:', {
-                ...requestData,
-                styleImageBase64: requestData.styleImageBase64 ? `[${requestData.styleImageBase64.length} chars]` : null,
-                assetImages: requestData.assetImages.map(img => ({ mimeType: img.mimeType, base64: `[${img.base64.length} chars]` }))
-            });
+            console.log('Image generation request data:', requestData);
 
-            const result = await callBackendApi('/generate-image', requestData, 'POST');
+            const result = await runBackendJob('generate-image', requestData);
             activePanel.imageUrl = result.imageUrl;
+            activePanel.thumbnailUrl = result.thumbnailUrl;
+            activePanel.previewUrl = result.previewUrl;
 
             // Generate suggestions
             try {
@@ -1022,6 +1137,8 @@ document.addEventListener('DOMContentLoaded', () => {
         } catch (error) {
             showMessageModal(`Image Gen Error: ${error.message}`);
             activePanel.imageUrl = null;
+            activePanel.thumbnailUrl = null;
+            activePanel.previewUrl = null;
         } finally {
             activePanel.isLoading = false;
             render();
@@ -1046,16 +1163,32 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         try {
-            console.log('Making API call to /generate-storyboard...');
-            const result = await callBackendApi('/generate-storyboard', {
-                script,
-                templateType,
-                panelCount
-            }, 'POST');
-            console.log('API result received:', result);
+            console.log('Making streaming API call to /generate-storyboard/stream...');
+            const request = { script, templateType, panelCount };
+            let streamedCount = 0;
 
-            panels = [];
-            result.panels.forEach(panelData => addNewPanel(panelData));
+            // Render panels progressively as the model finishes each one
+            try {
+                await streamBackendApi('/generate-storyboard/stream', request, (event, data) => {
+                    if (event === 'panel') {
+                        if (streamedCount === 0) panels = [];
+                        addNewPanel(data.panel);
+                        streamedCount++;
+                    } else if (event === 'done' && streamedCount === 0) {
+                        panels = [];
+                        data.panels.forEach(panelData => addNewPanel(panelData));
+                        streamedCount = data.panels.length;
+                    }
+                });
+            } catch (streamError) {
+                if (streamedCount > 0) throw streamError;
+                console.warn('Streaming storyboard failed, retrying without streaming:', streamError);
+                const result = await callBackendApi('/generate-storyboard', request, 'POST');
+                console.log('API result received:', result);
+
+                panels = [];
+                result.panels.forEach(panelData => addNewPanel(panelData));
+            }
 
             scriptModal.classList.add('hidden');
             templateModal.classList.add('hidden');
@@ -1154,66 +1287,66 @@ document.addEventListener('DOMContentLoaded', () => {
         URL.revokeObjectURL(a.href);
     }
 
-    async function exportToPdf() {
-        showMessageModal("Generating PDF... Please wait.");
-
-        const doc = new jsPDF({ orientation: 'landscape', unit: 'px', format: 'a4' });
-        const docWidth = doc.internal.pageSize.getWidth();
-        const margin = 20;
-        const imgWidth = docWidth / 2 - margin * 1.5;
-        const imgHeight = imgWidth * (9 / 16);
-
-        doc.setFontSize(24);
-        doc.text(getEl('project-title').value, docWidth / 2, margin + 10, { align: 'center' });
-
-        for (let i = 0; i < panels.length; i++) {
-            const panel = panels[i];
-            const isLeft = i % 2 === 0;
-
-            if (i > 0 && isLeft) doc.addPage();
-
-            const x = isLeft ? margin : docWidth / 2 + margin / 2;
-            const y = margin * 2;
+    // Build an export on the server from the stored panel images and download it
+    async function downloadExport(format, extension) {
+        if (panels.length === 0) {
+            showMessageModal("Cannot export an empty storyboard.");
+            return;
+        }
 
-            doc.setDrawColor(100);
-            doc.rect(x, y, imgWidth, imgHeight);
-            doc.setFontSize(10);
-            doc.setTextColor(150);
-            doc.text(`Panel ${i + 1}`, x, y - 5);
+        const title = getEl('project-title').value;
+        const response = await fetch(`${API_BASE_URL}/export`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                format,
+                title,
+                panels: panels.map(panel => ({
+                    imageUrl: panel.imageUrl || null,
+                    prompt: panel.prompt || null,
+                    motion: panel.motion || null,
+                    audio: panel.audio || null,
+                    text: panel.text || null,
+                    duration: parseFloat(panel.duration) > 0 ? parseFloat(panel.duration) : null,
+                    narration: panel.audio || null,
+                })),
+            }),
+        });
 
-            if (panel.imageUrl) {
-                try {
-                    doc.addImage(panel.imageUrl, 'JPEG', x, y, imgWidth, imgHeight);
-                } catch (e) {
-                    console.error(`PDF Export Error: ${e.message}`);
-                }
-            } else {
-                doc.setTextColor(100);
-                doc.text("No Image", x + imgWidth / 2, y + imgHeight / 2, { align: 'center' });
-            }
+        if (!response.ok) {
+            let errorMessage = `HTTP ${response.status}: ${response.statusText}`;
+            try {
+                const parsed = JSON.parse(await response.text());
+                errorMessage = parsed.detail || errorMessage;
+            } catch { }
+            throw new Error(errorMessage);
+        }
 
-            let textY = y + imgHeight + 15;
-            doc.setFontSize(8);
-            doc.setTextColor(0);
-
-            const addWrappedText = (label, text) => {
-                if (!text) return;
-                doc.setFont(undefined, 'bold');
-                doc.text(label, x, textY);
-                doc.setFont(undefined, 'normal');
-                const splitText = doc.splitTextToSize(text, imgWidth - 25);
-                doc.text(splitText, x + 25, textY);
-                textY += (splitText.length * 8) + 5;
-            };
+        const a = document.createElement('a');
+        a.href = URL.createObjectURL(await response.blob());
+        a.download = `${(title || 'storyboard').replace(/ /g, '_')}.${extension}`;
+        a.click();
+        URL.revokeObjectURL(a.href);
+    }
 
-            addWrappedText("Prompt:", panel.prompt);
-            addWrappedText("Motion:", panel.motion);
-            addWrappedText("Audio:", panel.audio);
-            addWrappedText("Text:", panel.text);
+    async function exportToPdf() {
+        showMessageModal("Generating PDF... Please wait.");
+        try {
+            await downloadExport('pdf', 'pdf');
+            messageModal.classList.add('hidden');
+        } catch (error) {
+            showMessageModal(`PDF Export Error: ${error.message}`);
         }
+    }
 
-        doc.save(getEl('project-title').value.replace(/ /g, '_') + '.pdf');
-        modalCloseBtn.click();
+    async function exportAnimatic() {
+        showMessageModal("Rendering animatic... Please wait.");
+        try {
+            await downloadExport('animatic', 'mp4');
+            messageModal.classList.add('hidden');
+        } catch (error) {
+            showMessageModal(`Animatic Export Error: ${error.message}`);
+        }
     }
 
     // --- Story Analyst ---
@@ -1324,6 +1457,11 @@ document.addEventListener('DOMContentLoaded', () => {
         console.error('generateStyleBtn not found');
     }
     exportPdfBtn.onclick = exportToPdf;
+    exportAnimaticBtn.onclick = exportAnimatic;
+    // The animatic needs ffmpeg on the server; hide the button where it isn't installed
+    callBackendApi('/export/formats')
+        .then(({ formats }) => exportAnimaticBtn.classList.toggle('hidden', !formats.includes('animatic')))
+        .catch(() => exportAnimaticBtn.classList.add('hidden'));
     exportXmlBtn.onclick = exportToXml;
     if (analyzeStoryBtn) {
         analyzeStoryBtn.onclick = () => {